@@ -61,6 +61,7 @@ class AeraExportAdmin(admin.ModelAdmin):
         "sales_price",
         "updated_at",
         "last_pushed_to_aera",
+        "changed_since_last_push",
     )
     list_display_links = ("sku", "product_name")
     search_fields = ("sku", "product_name", "manufacturer", "mpn", "gtin")
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aera', '0013_alter_aeraorder_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aeraexport',
+            name='changed_since_last_push',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+        migrations.AddField(
+            model_name='aeraexport',
+            name='row_hash',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='aeraexport',
+            name='sku',
+            field=models.CharField(blank=True, db_index=True, max_length=25, null=True),
+        ),
+    ]
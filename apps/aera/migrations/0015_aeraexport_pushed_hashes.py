@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aera', '0014_export_change_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aeraexport',
+            name='pushed_offer_hash',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='aeraexport',
+            name='pushed_payload_hash',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+    ]
@@ -122,7 +122,7 @@ class AeraExport(Model):
     Holds product data pushed to Aera
     """
 
-    sku = CharField(max_length=25, blank=True, null=True)
+    sku = CharField(max_length=25, blank=True, null=True, db_index=True)
     product_name = CharField(max_length=255, blank=True, null=True)
     manufacturer = CharField(max_length=200, blank=True, null=True)
     mpn = CharField(max_length=25, blank=True, null=True)
@@ -147,6 +147,12 @@ class AeraExport(Model):
     )
     gift_valid_until = DateField(blank=True, null=True)
     updated_at = DateTimeField(auto_now=True)
+    row_hash = CharField(max_length=255, editable=False, null=True, blank=True)
+    changed_since_last_push = BooleanField(default=True, db_index=True)
+    pushed_payload_hash = CharField(
+        max_length=255, editable=False, null=True, blank=True
+    )
+    pushed_offer_hash = CharField(max_length=255, editable=False, null=True, blank=True)
     last_pushed_to_aera = DateTimeField(
         verbose_name="Date pushed to aera", null=True, blank=True
     )
@@ -1,4 +1,8 @@
 from datetime import date
+from decimal import Decimal
+import gzip
+import json
+import time
 import traceback
 
 import requests
@@ -8,7 +12,12 @@ from django.db import transaction
 from django.http import JsonResponse
 from django.utils import timezone
 
-from utils import clean_payload, make_time_zone_aware
+from utils import (
+    bulk_update_rows,
+    clean_payload,
+    make_time_zone_aware,
+    payload_digest,
+)
 
 from .models import (
     AeraCompetitorPrice,
@@ -19,13 +28,16 @@ from .models import (
     AeraSession,
 )
 from .utils import AeraLog
-
+from apps.core.models import RepricingQueue
 
 # Constants
 AERA_BASE_URL = settings.AERA_BASE_URL
 AERA_COMPANY_ID = settings.AERA_COMPANY_ID
 AERA_LOGIN_NAME = settings.AERA_LOGIN_NAME
 AERA_PASSWORD = settings.AERA_PASSWORD
+AERA_PUSH_CHUNK_SIZE = settings.AERA_PUSH_CHUNK_SIZE
+AERA_PUSH_GZIP = settings.AERA_PUSH_GZIP
+AERA_PUSH_MAX_RETRIES = 3
 
 
 def get_aera_session_id():
@@ -90,6 +102,17 @@ def fetch_aera_products():
         AeraProduct.objects.bulk_create(objs, batch_size=5000)
 
 
+def top_prices_changed(competitor_price, item):
+    """Compare stored top prices with the fetched ones as they would be saved."""
+    for i in range(1, 4):
+        new = item[f"Top{i}NetPrice"]
+        if new is not None:
+            new = Decimal(str(new)).quantize(Decimal("0.01"))
+        if getattr(competitor_price, f"net_top_{i}") != new:
+            return True
+    return False
+
+
 def fetch_aera_competitor_prices(sku=None):
     url = f"{AERA_BASE_URL}/Roles/Sellers/{AERA_COMPANY_ID}/Offers/CompetitorOffers"
     params = {
@@ -126,11 +149,14 @@ def fetch_aera_competitor_prices(sku=None):
         }
         updated_products = []
         new_products = []
+        repriced_skus = []
 
         for item in batch:
             sku = item["SKU"]
             if sku in existing_skus.keys():
                 p = existing_skus[sku]
+                if top_prices_changed(p, item):
+                    repriced_skus.append(sku)
                 p.net_own = item["OwnNetPrice"]
                 p.net_top_1 = item["Top1NetPrice"]
                 p.net_top_2 = item["Top2NetPrice"]
@@ -138,6 +164,7 @@ def fetch_aera_competitor_prices(sku=None):
                 p.last_fetch_from_aera = now
                 updated_products.append(p)
             else:
+                repriced_skus.append(sku)
                 new_products.append(
                     AeraCompetitorPrice(
                         sku=sku,
@@ -163,55 +190,154 @@ def fetch_aera_competitor_prices(sku=None):
                 )
             if new_products:
                 AeraCompetitorPrice.objects.bulk_create(new_products)
+            RepricingQueue.mark(repriced_skus)
 
     return True
 
 
-def push_products_to_aera(sku=None):
-    BATCH_SIZE = 300000
+def build_product_payload(p):
+    product_payload = {
+        "SKU": p.sku,
+        "Manufacturer": p.manufacturer,
+        "MPN": p.mpn,
+        "OfferTypeId": p.offer_type_id,
+        "GTIN": p.gtin,
+        "ProductName": p.product_name,
+        "AvailabilityTypeId": p.availability_type_id,
+        "DifferentDeliveryTime": p.different_delivery_time,
+        "LowerBound1": 1,
+        "NetPrice1": p.sales_price,
+        "ShippedTemperatureStable": p.shipped_temperature_stable,
+    }
+    return clean_payload(product_payload)
+
+
+def build_special_offer_payload(p):
+    product_payload = {
+        "SKU": p.sku,
+        "ValidThrough": p.gift_valid_until.isoformat(),
+        "Discountable": False,
+        "LowerBound1": p.gift_min_qty,
+        "NetPrice1": p.gift_sales_price,
+    }
+    return clean_payload(product_payload)
+
+
+def iter_export_chunks(product_exports, chunk_size):
+    # keyset pagination, a restarted push continues with the rows not yet sent
+    cursor = 0
+    while True:
+        chunk = list(product_exports.filter(id__gt=cursor).order_by("id")[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        cursor = chunk[-1].id
+
+
+def post_aera_chunk(url, payload, params, error_message):
+    """
+    POST one import request, gzip compressed unless AERA_PUSH_GZIP is off.
+    Connection errors, 429 and 5xx responses are retried with backoff.
+    """
+    body = json.dumps(payload).encode()
+    headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+    }
+    if AERA_PUSH_GZIP:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+
+    for attempt in range(1, AERA_PUSH_MAX_RETRIES + 1):
+        headers["Ao-SessionId"] = get_aera_session_id()
+        try:
+            response = requests.post(
+                url, data=body, headers=headers, params=params, timeout=300
+            )
+        except requests.RequestException:
+            if attempt == AERA_PUSH_MAX_RETRIES:
+                raise
+        else:
+            if response.ok:
+                return response
+            if response.status_code != 429 and response.status_code < 500:
+                break
+            if attempt == AERA_PUSH_MAX_RETRIES:
+                break
+        time.sleep(2**attempt)
+
+    raise Exception(f"{error_message}, {response.status_code}: {response.text}")
+
+
+def product_batch(chunk):
+    """Payloads and (id, digest) rows of the offers that differ from the pushed ones."""
+    batch_payload = []
+    batch_rows = []
+    for p in chunk:
+        if not p.sales_price:
+            continue
+
+        product_payload = build_product_payload(p)
+        digest = payload_digest(product_payload)
+        if digest == p.pushed_payload_hash:
+            continue
+
+        batch_payload.append(product_payload)
+        batch_rows.append((p.id, digest))
+    return batch_payload, batch_rows
+
+
+def special_offer_batch(chunk):
+    """Same as product_batch for the special offers of rows with a gift price."""
     batch_payload = []
-    batch_ids = []
+    batch_rows = []
+    for p in chunk:
+        if p.gift_sales_price is None:
+            continue
+
+        product_payload = build_special_offer_payload(p)
+        digest = payload_digest(product_payload)
+        if digest == p.pushed_offer_hash:
+            continue
+
+        batch_payload.append(product_payload)
+        batch_rows.append((p.id, digest))
+    return batch_payload, batch_rows
+
+
+def push_products_to_aera(sku=None):
+    """
+    Delta push of the rows flagged changed_since_last_push, or of the given
+    sku, in chunks of AERA_PUSH_CHUNK_SIZE. A flagged row is only sent when
+    its offer or special offer payload differs from the last accepted one.
+    Each chunk clears its flags once accepted, so a failed run resumes where
+    it stopped. push_products_to_aera_full_import stays the full sync.
+    """
     total_synced = 0
     processing_date = date.today().isoformat()
 
     try:
         product_exports = (
-            AeraExport.objects.filter(sku=sku) if sku else AeraExport.objects.all()
+            AeraExport.objects.filter(sku=sku)
+            if sku
+            else AeraExport.objects.filter(changed_since_last_push=True)
         )
-        for p in product_exports.iterator(chunk_size=BATCH_SIZE):
-            if not p.sales_price:
-                continue
-
-            product_payload = {
-                "SKU": p.sku,
-                "Manufacturer": p.manufacturer,
-                "MPN": p.mpn,
-                "OfferTypeId": p.offer_type_id,
-                "GTIN": p.gtin,
-                "ProductName": p.product_name,
-                "AvailabilityTypeId": p.availability_type_id,
-                "DifferentDeliveryTime": p.different_delivery_time,
-                "LowerBound1": 1,
-                "NetPrice1": p.sales_price,
-                "ShippedTemperatureStable": p.shipped_temperature_stable,
-            }
-
-            product_payload = clean_payload(product_payload)
-
-            batch_payload.append(product_payload)
-            batch_ids.append(p.id)
-
-            if len(batch_payload) >= BATCH_SIZE:
-                _upsert_product_batch(batch_payload, batch_ids, processing_date)
+        for chunk in iter_export_chunks(product_exports, AERA_PUSH_CHUNK_SIZE):
+            read_at = timezone.now()
+            batch_payload, batch_rows = product_batch(chunk)
+            if batch_payload:
+                _upsert_product_batch(batch_payload, batch_rows, processing_date)
                 total_synced += len(batch_payload)
-                batch_payload.clear()
-                batch_ids.clear()
 
-        if batch_payload:
-            _upsert_product_batch(batch_payload, batch_ids, processing_date)
-            total_synced += len(batch_payload)
+            offer_payload, offer_rows = special_offer_batch(chunk)
+            if offer_payload:
+                _upsert_special_offer_batch(offer_payload, offer_rows, processing_date)
+
+            # rows rebuilt by the export since they were read stay flagged
+            AeraExport.objects.filter(
+                id__in=[p.id for p in chunk], updated_at__lt=read_at
+            ).update(changed_since_last_push=False)
 
-        push_special_offers_to_aera(sku=sku)
         AeraLog.info(
             f"Product update on marketplace completed successfully. Total products updated:{total_synced}"
         )
@@ -223,8 +349,6 @@ def push_products_to_aera(sku=None):
 
 
 def push_special_offers_to_aera(sku=None):
-    BATCH_SIZE = 300000
-    batch_payload = []
     processing_date = date.today().isoformat()
 
     try:
@@ -234,25 +358,10 @@ def push_special_offers_to_aera(sku=None):
             else AeraExport.objects.filter(gift_sales_price__isnull=False)
         )
 
-        for p in product_exports.iterator(chunk_size=BATCH_SIZE):
-
-            product_payload = {
-                "SKU": p.sku,
-                "ValidThrough": p.gift_valid_until.isoformat(),
-                "Discountable": False,
-                "LowerBound1": p.gift_min_qty,
-                "NetPrice1": p.gift_sales_price,
-            }
-
-            product_payload = clean_payload(product_payload)
-            batch_payload.append(product_payload)
-
-            if len(batch_payload) >= BATCH_SIZE:
-                _upsert_special_offer_batch(batch_payload, processing_date)
-                batch_payload.clear()
-
-        if batch_payload:
-            _upsert_special_offer_batch(batch_payload, processing_date)
+        for chunk in iter_export_chunks(product_exports, AERA_PUSH_CHUNK_SIZE):
+            batch_payload, batch_rows = special_offer_batch(chunk)
+            if batch_payload:
+                _upsert_special_offer_batch(batch_payload, batch_rows, processing_date)
 
     except Exception:
         AeraLog.error(
@@ -260,7 +369,8 @@ def push_special_offers_to_aera(sku=None):
         )
 
 
-def _upsert_product_batch(payload_list, ids, processing_date):
+def _upsert_product_batch(payload_list, rows, processing_date):
+    """rows = [(export id, payload digest)]"""
     url = f"{AERA_BASE_URL}/Roles/Sellers/{AERA_COMPANY_ID}/Offers/PartialImports"
 
     payload = {"Data": {"CreateOfferImportDataList": {"Items": payload_list}}}
@@ -270,23 +380,18 @@ def _upsert_product_batch(payload_list, ids, processing_date):
         "Currency": "EUR",
         "ValidateOnly": True,
     }
-    session_id = get_aera_session_id()
-    headers = {
-        "Ao-SessionId": session_id,
-        "Accept": "application/json",
-    }
-    response = requests.post(url, json=payload, headers=headers, params=params)
-    if not response.ok:
-        raise Exception(
-            f"Product price update failed, {response.status_code}: {response.text}"
-        )
-
-    response.raise_for_status()
+    post_aera_chunk(url, payload, params, "Product price update failed")
 
-    AeraExport.objects.filter(id__in=ids).update(last_pushed_to_aera=timezone.now())
+    now = timezone.now()
+    bulk_update_rows(
+        AeraExport,
+        ["pushed_payload_hash", "last_pushed_to_aera"],
+        ((pk, digest, now) for pk, digest in rows),
+    )
 
 
-def _upsert_special_offer_batch(payload_list, processing_date):
+def _upsert_special_offer_batch(payload_list, rows, processing_date):
+    """rows = [(export id, payload digest)]"""
     url = (
         f"{AERA_BASE_URL}/Roles/Sellers/{AERA_COMPANY_ID}/SpecialOffers/PartialImports"
     )
@@ -298,19 +403,9 @@ def _upsert_special_offer_batch(payload_list, processing_date):
         "Currency": "EUR",
         "ValidateOnly": True,
     }
+    post_aera_chunk(url, payload, params, "Product gift price update failed")
 
-    headers = {
-        "Ao-SessionId": get_aera_session_id(),
-        "Accept": "application/json",
-    }
-
-    response = requests.post(url, json=payload, headers=headers, params=params)
-    if not response.ok:
-        raise Exception(
-            f"Product gift price update failed, {response.status_code}: {response.text}"
-        )
-
-    response.raise_for_status()
+    bulk_update_rows(AeraExport, ["pushed_offer_hash"], rows)
 
 
 def fetch_aera_orders(test_mode=False):
@@ -498,9 +593,11 @@ def index(request):
 
 
 def push_products_to_aera_full_import(sku=None):
-    BATCH_SIZE = 300000
-    batch_payload = []
-    batch_ids = []
+    """
+    A FullImport replaces the seller's whole offer set, so every offer goes
+    out in one request. Rows are read in chunks, the body is compressed by
+    post_aera_chunk.
+    """
     total_synced = 0
     processing_date = date.today().isoformat()
 
@@ -509,38 +606,19 @@ def push_products_to_aera_full_import(sku=None):
             AeraExport.objects.filter(sku=sku) if sku else AeraExport.objects.all()
         )
 
-        for p in product_exports.iterator(chunk_size=BATCH_SIZE):
-
-            product_payload = {
-                "SKU": p.sku,
-                "Manufacturer": p.manufacturer,
-                "MPN": p.mpn,
-                "OfferTypeId": p.offer_type_id,
-                "GTIN": p.gtin,
-                "ProductName": p.product_name,
-                "AvailabilityTypeId": p.availability_type_id,
-                "DifferentDeliveryTime": p.different_delivery_time,
-                "Discountable": True,
-                "Refundable": True,
-                "LowerBound1": 1,
-                "NetPrice1": p.sales_price,
-                "ShippedTemperatureStable": p.shipped_temperature_stable,
-            }
-
-            product_payload = clean_payload(product_payload)
-
-            batch_payload.append(product_payload)
-            batch_ids.append(p.id)
-
-            if len(batch_payload) >= BATCH_SIZE:
-                _upsert_product_batch_full(batch_payload, batch_ids, processing_date)
-                total_synced += len(batch_payload)
-                batch_payload.clear()
-                batch_ids.clear()
+        batch_payload = []
+        batch_rows = []
+        for chunk in iter_export_chunks(product_exports, AERA_PUSH_CHUNK_SIZE):
+            for p in chunk:
+                product_payload = build_product_payload(p)
+                # digest of the delta payload, so the next delta push skips this row
+                batch_rows.append((p.id, payload_digest(product_payload)))
+                product_payload.update({"Discountable": True, "Refundable": True})
+                batch_payload.append(product_payload)
 
         if batch_payload:
-            _upsert_product_batch_full(batch_payload, batch_ids, processing_date)
-            total_synced += len(batch_payload)
+            _upsert_product_batch_full(batch_payload, batch_rows, processing_date)
+            total_synced = len(batch_payload)
 
         push_special_offers_to_aera(sku=sku)
 
@@ -554,7 +632,8 @@ def push_products_to_aera_full_import(sku=None):
         )
 
 
-def _upsert_product_batch_full(payload_list, ids, processing_date):
+def _upsert_product_batch_full(payload_list, rows, processing_date):
+    """rows = [(export id, delta payload digest)]"""
     url = f"{AERA_BASE_URL}/Roles/Sellers/{AERA_COMPANY_ID}/Offers/FullImports"
 
     payload = {"Data": {"CreateOfferImportDataList": {"Items": payload_list}}}
@@ -565,18 +644,17 @@ def _upsert_product_batch_full(payload_list, ids, processing_date):
         "ClearSpecialOffer": True,
         "ValidateOnly": True,
     }
+    post_aera_chunk(url, payload, params, "Product full import update failed")
 
-    headers = {
-        "Ao-SessionId": get_aera_session_id(),
-        "Accept": "application/json",
-    }
-
-    response = requests.post(url, json=payload, headers=headers, params=params)
-    if not response.ok:
-        raise Exception(
-            f"Product full import update failed, {response.status_code}: {response.text}"
-        )
-
-    response.raise_for_status()
-
-    AeraExport.objects.filter(id__in=ids).update(last_pushed_to_aera=timezone.now())
+    # special offers were cleared, they are all sent again afterwards
+    now = timezone.now()
+    bulk_update_rows(
+        AeraExport,
+        [
+            "pushed_payload_hash",
+            "pushed_offer_hash",
+            "last_pushed_to_aera",
+            "changed_since_last_push",
+        ],
+        ((pk, digest, None, now, False) for pk, digest in rows),
+    )
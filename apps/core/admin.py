@@ -9,7 +9,9 @@ from .models import (
     Product,
     MiddlewareSetting,
     ProductPriceHistory,
+    ProductGiftPriceHistory,
     ProductGtin,
+    RepricingQueue,
 )
 from django.contrib.auth.models import Group
 from django.contrib.auth.models import User
@@ -235,8 +237,10 @@ class ExportTaskAdmin(admin.ModelAdmin):
         "name",
         "file_type",
         "status",
+        "attempts",
         "created_at",
         "completed_at",
+        "next_attempt_at",
         "download_link",
     )
     search_fields = ("name",)
@@ -272,6 +276,11 @@ class MiddlewareSettingAdmin(admin.ModelAdmin):
         "undercut_value",
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # margin, rule and undercut apply to every product
+        RepricingQueue.mark_all()
+
     def has_add_permission(self, request):
         return False
 
@@ -340,8 +349,25 @@ class LogEntryAdmin(admin.ModelAdmin):
     created_at_with_colour.short_description = "Created_at"
 
 
+class ProductGiftPriceHistoryInline(admin.TabularInline):
+    model = ProductGiftPriceHistory
+    extra = 0
+    fields = (
+        "aera_gift_sales_price",
+        "wawibox_gift_sales_price",
+        "gift_min_qty",
+        "gift_paid_qty",
+        "gift_free_qty",
+        "gift_valid_from",
+        "gift_valid_until",
+    )
+    readonly_fields = fields
+
+
 @admin.register(ProductPriceHistory)
 class ProductPriceHistoryAdmin(admin.ModelAdmin):
+    inlines = [ProductGiftPriceHistoryInline]
+
     list_display = (
         "product__name",
         "product__sku",
@@ -0,0 +1,198 @@
+import gzip
+import mimetypes
+import os
+import re
+import shutil
+from pathlib import Path
+
+from django.conf import settings
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+BLOCK_SIZE = FileResponse.block_size
+
+
+def get_export_dir():
+    return Path(settings.MEDIA_ROOT) / "exports"
+
+
+def resolve_export_file(file_path):
+    """
+    Map the file_path query parameter onto a file in the export directory.
+    Only the file name is used, so the parameter cannot point outside of it.
+    """
+    name = Path(file_path or "").name
+    if not name:
+        raise Http404("File not found")
+
+    path = get_export_dir() / name
+    if not path.is_file():
+        raise Http404("File not found")
+    return path
+
+
+def write_gzip_sibling(file_path):
+    """Store a precompressed copy next to a plain CSV export."""
+    gz_path = Path(f"{file_path}.gz")
+    tmp_path = gz_path.with_name(f".{gz_path.name}.tmp")
+    with open(file_path, "rb") as source, gzip.open(tmp_path, "wb", 6) as target:
+        shutil.copyfileobj(source, target, BLOCK_SIZE)
+    os.replace(tmp_path, gz_path)
+    return gz_path
+
+
+def accepts_gzip(request):
+    for coding in request.headers.get("Accept-Encoding", "").split(","):
+        name, _, params = coding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def pick_variant(request, path):
+    """Return the file to send and its content encoding."""
+    if path.suffix == ".gz":
+        return path, None
+
+    gz_path = Path(f"{path}.gz")
+    if (
+        accepts_gzip(request)
+        and gz_path.is_file()
+        and gz_path.stat().st_mtime >= path.stat().st_mtime
+    ):
+        return gz_path, "gzip"
+    return path, None
+
+
+def make_etag(stat, encoding):
+    etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+    if encoding:
+        etag += f"-{encoding}"
+    return quote_etag(etag)
+
+
+def parse_range(header, size):
+    """
+    Parse a single byte range. Returns (start, end) inclusive, None when the
+    header should be ignored and the whole file sent, or False when the range
+    cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.replace(" ", ""))
+    if not match:
+        # multiple ranges or other units: answer with the full file
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0:
+            return False
+        return max(size - suffix, 0), size - 1
+
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    return if_range == etag or if_range == http_date(last_modified)
+
+
+def iter_file_range(file_obj, start, length):
+    try:
+        file_obj.seek(start)
+        while length > 0:
+            chunk = file_obj.read(min(BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file_obj.close()
+
+
+def offload_response(path):
+    """
+    Let the front web server send the file. nginx maps EXPORT_ACCEL_PREFIX
+    to the export directory as an internal location, Apache/lighttpd read
+    the absolute path from X-Sendfile.
+    """
+    response = HttpResponse()
+    if settings.EXPORT_SENDFILE_BACKEND == "nginx":
+        prefix = settings.EXPORT_ACCEL_PREFIX.rstrip("/")
+        response["X-Accel-Redirect"] = f"{prefix}/{path.name}"
+    else:
+        response["X-Sendfile"] = str(path)
+    del response["Content-Type"]
+    return response
+
+
+def serve_export_file(request, path):
+    """
+    Send an export file with conditional GET, single byte ranges and the
+    precompressed variant when the client accepts gzip. Files can be handed
+    off to the web server with EXPORT_SENDFILE_BACKEND.
+    """
+    variant, encoding = pick_variant(request, path)
+    stat = variant.stat()
+    etag = make_etag(stat, encoding)
+    last_modified = int(stat.st_mtime)
+
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if not_modified is not None:
+        return not_modified
+
+    if settings.EXPORT_SENDFILE_BACKEND:
+        response = offload_response(variant)
+    else:
+        response = None
+        size = stat.st_size
+        range_header = request.headers.get("Range")
+        if range_header and if_range_matches(request, etag, last_modified):
+            byte_range = parse_range(range_header, size)
+            if byte_range is False:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+            if byte_range:
+                start, end = byte_range
+                response = StreamingHttpResponse(
+                    iter_file_range(open(variant, "rb"), start, end - start + 1),
+                    status=206,
+                )
+                response["Content-Range"] = f"bytes {start}-{end}/{size}"
+                response["Content-Length"] = end - start + 1
+
+        if response is None:
+            # FileResponse lets the WSGI server use sendfile for the whole file
+            response = FileResponse(open(variant, "rb"))
+
+    content_type, _ = mimetypes.guess_type(path.name)
+    if path.suffix == ".gz":
+        content_type = "application/gzip"
+    response["Content-Type"] = content_type or "application/octet-stream"
+    response["Content-Disposition"] = f'attachment; filename="{path.name}"'
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    if encoding:
+        response["Content-Encoding"] = encoding
+    if path.suffix != ".gz":
+        patch_vary_headers(response, ["Accept-Encoding"])
+    return response
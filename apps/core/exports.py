@@ -1,6 +1,8 @@
-from django.db import transaction
+from collections import namedtuple
 import traceback
 
+from utils import IncrementalTable
+
 from .utils import CoreLog
 from .models import (
     Product,
@@ -84,236 +86,460 @@ def get_vat_rate_map():
     return vat_rate_map
 
 
-def build_aera_export(
-    product,
-    gls_stock_map,
-    non_gls_stock_map,
-    manufacturer_map,
-    gtin_map,
-):
-    supplier_article_no = product.supplier_article_no
-
-    if product.supplier == Product.SUPPLIER_GLS:
-        stock = gls_stock_map.get(supplier_article_no, 0)
-        manufacturer_name = manufacturer_map.get(product.manufacturer_id)
-    else:
-        stock = non_gls_stock_map.get(supplier_article_no, 0)
-        manufacturer_name = product.manufacturer
-
-    availability_type_id = 1 if stock > 0 else 2
-
-    export = AeraExport(
-        sku=product.sku,
-        product_name=product.name,
-        manufacturer=manufacturer_name,
-        mpn=product.manufacturer_article_no,
-        offer_type_id=1,
-        gtin=gtin_map.get(supplier_article_no),
-        availability_type_id=availability_type_id,
-        different_delivery_time=get_delivery_time(stock),
-        shipped_temperature_stable=product.store_refrigerated,
-        sales_price=product.aera_sales_price,
-        gift_sales_price=product.aera_gift_sales_price,
-        gift_min_qty=product.gift_min_qty,
-        gift_valid_until=product.gift_valid_until,
-    )
-
-    return export
-
+ProductSnapshot = namedtuple(
+    "ProductSnapshot",
+    [
+        "sku",
+        "name",
+        "description",
+        "supplier",
+        "supplier_article_no",
+        "manufacturer",
+        "manufacturer_article_no",
+        "store_refrigerated",
+        "aera_sales_price",
+        "wawibox_sales_price",
+        "aera_gift_sales_price",
+        "wawibox_gift_sales_price",
+        "gift_min_qty",
+        "gift_paid_qty",
+        "gift_free_qty",
+        "gift_valid_from",
+        "gift_valid_until",
+        "stock",
+        "gtin",
+        "vat_rate",
+        "shopware_id",
+        "length",
+        "width",
+        "height",
+        "weight",
+    ],
+)
 
-def build_shopware_export(
-    product,
-    gls_stock_map,
-    non_gls_stock_map,
-    manufacturer_map,
-    gtin_map,
-    vat_rate_map,
-):
-    shopware_id = product.shopware_product.shopware_id
-    master_data = product.gls_master_data.first()
 
-    if not shopware_id:
-        return None
+def get_shopware_id_map():
+    shopware_id_map = {
+        product_id: shopware_id
+        for product_id, shopware_id in ShopwareProduct.objects.filter(
+            product__isnull=False
+        ).values_list("product_id", "shopware_id")
+    }
+    return shopware_id_map
+
+
+def get_dimensions_map():
+    dimensions_map = {}
+    # first master data row per product, like product.gls_master_data.first()
+    for product_id, *dimensions in (
+        GLSMasterData.objects.filter(product__isnull=False)
+        .order_by("-pk")
+        .values_list("product_id", "length", "width", "height", "weight")
+    ):
+        dimensions_map[product_id] = tuple(dimensions)
+    return dimensions_map
+
+
+def load_product_snapshot(products=None):
+    """
+    Yield a ProductSnapshot per exportable product with stock, GTIN, VAT,
+    manufacturer name, Shopware id and dimensions already resolved, using a
+    fixed number of queries regardless of catalog size.
+    """
+    if products is None:
+        products = Product.objects.filter(is_blocked=False)
 
-    supplier_article_no = product.supplier_article_no
-    if product.supplier == Product.SUPPLIER_GLS:
-        stock = gls_stock_map.get(supplier_article_no, 0)
-        vat_rate = vat_rate_map.get(supplier_article_no)
-        manufacturer_name = manufacturer_map.get(product.manufacturer_id)
-    else:
-        stock = non_gls_stock_map.get(supplier_article_no, 0)
-        vat_rate = None
-        manufacturer_name = product.manufacturer
-
-    export = ShopwareExport(
-        shopware_id=shopware_id,
-        sku=product.sku,
-        name=product.name,
-        description=product.description,
-        sales_price=product.aera_sales_price,
-        gift_sales_price=product.aera_gift_sales_price,
-        gift_min_qty=product.gift_min_qty,
-        gift_paid_qty=product.gift_paid_qty,
-        gift_free_qty=product.gift_free_qty,
-        gift_valid_from=product.gift_valid_from,
-        gift_valid_until=product.gift_valid_until,
-        manufacturer=manufacturer_name,
-        mpn=product.manufacturer_article_no,
-        gtin=gtin_map.get(supplier_article_no),
-        shipped_temperature_stable=product.store_refrigerated,
-        length=master_data.length,
-        width=master_data.width,
-        height=master_data.height,
-        weight=master_data.weight,
-        stock=stock,
-        tax_rate=vat_rate,
+    gls_stock_map = get_gls_stock()
+    non_gls_stock_map = get_non_gls_stock()
+    manufacturer_map = get_manufacturer_map()
+    gtin_map = get_gtin_map()
+    vat_rate_map = get_vat_rate_map()
+    shopware_id_map = get_shopware_id_map()
+    dimensions_map = get_dimensions_map()
+    no_dimensions = (None, None, None, None)
+
+    rows = products.values_list(
+        "id",
+        "sku",
+        "name",
+        "description",
+        "supplier",
+        "supplier_article_no",
+        "manufacturer",
+        "manufacturer_id",
+        "manufacturer_article_no",
+        "store_refrigerated",
+        "aera_sales_price",
+        "wawibox_sales_price",
+        "aera_gift_sales_price",
+        "wawibox_gift_sales_price",
+        "gift_min_qty",
+        "gift_paid_qty",
+        "gift_free_qty",
+        "gift_valid_from",
+        "gift_valid_until",
     )
 
-    return export
-
+    for (
+        pid,
+        sku,
+        name,
+        description,
+        supplier,
+        supplier_article_no,
+        manufacturer,
+        manufacturer_id,
+        *rest,
+    ) in rows.iterator(chunk_size=5000):
+        if supplier == Product.SUPPLIER_GLS:
+            stock = gls_stock_map.get(supplier_article_no, 0)
+            vat_rate = vat_rate_map.get(supplier_article_no)
+            manufacturer_name = manufacturer_map.get(manufacturer_id)
+        else:
+            stock = non_gls_stock_map.get(supplier_article_no, 0)
+            vat_rate = None
+            manufacturer_name = manufacturer
+
+        yield ProductSnapshot(
+            sku,
+            name,
+            description,
+            supplier,
+            supplier_article_no,
+            manufacturer_name,
+            *rest,
+            stock,
+            gtin_map.get(supplier_article_no),
+            vat_rate,
+            shopware_id_map.get(pid),
+            *dimensions_map.get(pid, no_dimensions),
+        )
 
-def build_wawibox_export(product, gls_stock_map, non_gls_stock_map, vat_rate_map):
-    vat_map = {
-        0: 2,
-        7: 1,
-        19: 0,
-    }
 
-    supplier_article_no = product.supplier_article_no
-    if product.supplier == Product.SUPPLIER_GLS:
-        stock = gls_stock_map.get(supplier_article_no, 0)
-        vat_rate = int(float(vat_rate_map.get(supplier_article_no)))
-    else:
-        stock = non_gls_stock_map.get(supplier_article_no, 0)
-        vat_rate = None
+def load_product_columns(products=None):
+    """
+    Transpose the product snapshot into one list per ProductSnapshot field,
+    so each marketplace row set is derived by zipping the columns it needs.
+    """
+    rows = list(load_product_snapshot(products))
+    if not rows:
+        return ProductSnapshot(*([] for _ in ProductSnapshot._fields))
+    return ProductSnapshot(*map(list, zip(*rows)))
 
-    export = WawiboxExport(
-        internal_number=product.sku,
-        name=product.name,
-        manufacturer_article_no=product.manufacturer_article_no,
-        order_number=f"{product.sku}-BASE",
-        sales_price=product.wawibox_sales_price,
-        order_number_2=f"{product.sku}-GIFT",
-        min_order_quantity_2=product.gift_min_qty,
-        price_2=product.wawibox_gift_sales_price,
-        valid_from=product.gift_valid_from,
-        valid_until=product.gift_valid_until,
-        vat_category=vat_map.get(vat_rate, 0),
-        delivery_time=get_delivery_time(stock),
-        is_available=stock > 0,
-    )
-    return export
 
+WAWIBOX_VAT_CATEGORIES = {
+    0: 2,
+    7: 1,
+    19: 0,
+}
 
-def build_dentalheld_export(
-    product,
-    gls_stock_map,
-    non_gls_stock_map,
-    manufacturer_map,
-    gtin_map,
-):
 
-    supplier_article_no = product.supplier_article_no
-    if product.supplier == Product.SUPPLIER_GLS:
-        stock = gls_stock_map.get(supplier_article_no, 0)
-        manufacturer_name = manufacturer_map.get(product.manufacturer_id)
+def get_wawibox_vat_category(supplier, vat_rate):
+    if supplier == Product.SUPPLIER_GLS:
+        vat_rate = int(float(vat_rate))
     else:
-        stock = non_gls_stock_map.get(supplier_article_no, 0)
-        manufacturer_name = product.manufacturer
-
-    export = DentalheldExport(
-        article_id=product.sku,
-        ean=gtin_map.get(supplier_article_no),
-        name=product.name,
-        net_price=product.aera_sales_price,
-        manufacturer_name=manufacturer_name,
-        manufacturer_article_number=product.manufacturer_article_no,
-        delivery_status=2 if stock > 0 else 1,
-        delivery_time_days=get_delivery_time(stock),
-        stock_level=stock,
-        tier_qty_1=product.gift_min_qty,
-        tier_price_1=product.aera_gift_sales_price,
-    )
-
-    return export
+        vat_rate = None
+    return WAWIBOX_VAT_CATEGORIES.get(vat_rate, 0)
+
+
+AERA_ROW_FIELDS = [
+    "sku",
+    "product_name",
+    "manufacturer",
+    "mpn",
+    "offer_type_id",
+    "gtin",
+    "availability_type_id",
+    "different_delivery_time",
+    "shipped_temperature_stable",
+    "sales_price",
+    "gift_sales_price",
+    "gift_min_qty",
+    "gift_valid_until",
+]
+
+
+def build_aera_rows(columns, delivery_times, skus, make_row):
+    for (
+        sku,
+        name,
+        manufacturer,
+        mpn,
+        gtin,
+        stock,
+        delivery_time,
+        refrigerated,
+        price,
+        gift_price,
+        gift_min_qty,
+        gift_valid_until,
+    ) in zip(
+        columns.sku,
+        columns.name,
+        columns.manufacturer,
+        columns.manufacturer_article_no,
+        columns.gtin,
+        columns.stock,
+        delivery_times,
+        columns.store_refrigerated,
+        columns.aera_sales_price,
+        columns.aera_gift_sales_price,
+        columns.gift_min_qty,
+        columns.gift_valid_until,
+    ):
+        if price and sku in skus:
+            yield make_row(
+                sku,
+                name,
+                manufacturer,
+                mpn,
+                1,
+                gtin,
+                1 if stock > 0 else 2,
+                delivery_time,
+                refrigerated,
+                price,
+                gift_price,
+                gift_min_qty,
+                gift_valid_until,
+            )
+
+
+SHOPWARE_ROW_FIELDS = [
+    "shopware_id",
+    "sku",
+    "name",
+    "description",
+    "sales_price",
+    "gift_sales_price",
+    "gift_min_qty",
+    "gift_paid_qty",
+    "gift_free_qty",
+    "gift_valid_from",
+    "gift_valid_until",
+    "manufacturer",
+    "mpn",
+    "gtin",
+    "shipped_temperature_stable",
+    "length",
+    "width",
+    "height",
+    "weight",
+    "stock",
+    "tax_rate",
+]
+
+
+def build_shopware_rows(columns, skus, make_row):
+    for row in zip(
+        columns.shopware_id,
+        columns.sku,
+        columns.name,
+        columns.description,
+        columns.aera_sales_price,
+        columns.aera_gift_sales_price,
+        columns.gift_min_qty,
+        columns.gift_paid_qty,
+        columns.gift_free_qty,
+        columns.gift_valid_from,
+        columns.gift_valid_until,
+        columns.manufacturer,
+        columns.manufacturer_article_no,
+        columns.gtin,
+        columns.store_refrigerated,
+        columns.length,
+        columns.width,
+        columns.height,
+        columns.weight,
+        columns.stock,
+        columns.vat_rate,
+    ):
+        shopware_id, sku, _, _, price = row[:5]
+        if price and sku in skus and shopware_id:
+            yield make_row(*row)
+
+
+WAWIBOX_ROW_FIELDS = [
+    "internal_number",
+    "name",
+    "manufacturer_article_no",
+    "order_number",
+    "sales_price",
+    "order_number_2",
+    "min_order_quantity_2",
+    "price_2",
+    "valid_from",
+    "valid_until",
+    "vat_category",
+    "delivery_time",
+    "is_available",
+]
+
+
+def build_wawibox_rows(columns, delivery_times, skus, make_row):
+    for (
+        sku,
+        name,
+        mpn,
+        supplier,
+        vat_rate,
+        stock,
+        delivery_time,
+        price,
+        gift_price,
+        gift_min_qty,
+        gift_valid_from,
+        gift_valid_until,
+    ) in zip(
+        columns.sku,
+        columns.name,
+        columns.manufacturer_article_no,
+        columns.supplier,
+        columns.vat_rate,
+        columns.stock,
+        delivery_times,
+        columns.wawibox_sales_price,
+        columns.wawibox_gift_sales_price,
+        columns.gift_min_qty,
+        columns.gift_valid_from,
+        columns.gift_valid_until,
+    ):
+        if price and sku in skus:
+            yield make_row(
+                sku,
+                name,
+                mpn,
+                f"{sku}-BASE",
+                price,
+                f"{sku}-GIFT",
+                gift_min_qty,
+                gift_price,
+                gift_valid_from,
+                gift_valid_until,
+                get_wawibox_vat_category(supplier, vat_rate),
+                delivery_time,
+                stock > 0,
+            )
+
+
+DENTALHELD_ROW_FIELDS = [
+    "article_id",
+    "ean",
+    "name",
+    "net_price",
+    "manufacturer_name",
+    "manufacturer_article_number",
+    "delivery_status",
+    "delivery_time_days",
+    "stock_level",
+    "tier_qty_1",
+    "tier_price_1",
+]
+
+
+def build_dentalheld_rows(columns, delivery_times, skus, make_row):
+    for (
+        sku,
+        gtin,
+        name,
+        price,
+        manufacturer,
+        mpn,
+        stock,
+        delivery_time,
+        gift_min_qty,
+        gift_price,
+    ) in zip(
+        columns.sku,
+        columns.gtin,
+        columns.name,
+        columns.aera_sales_price,
+        columns.manufacturer,
+        columns.manufacturer_article_no,
+        columns.stock,
+        delivery_times,
+        columns.gift_min_qty,
+        columns.aera_gift_sales_price,
+    ):
+        if price and sku in skus:
+            yield make_row(
+                sku,
+                gtin,
+                name,
+                price,
+                manufacturer,
+                mpn,
+                2 if stock > 0 else 1,
+                delivery_time,
+                stock,
+                gift_min_qty,
+                gift_price,
+            )
 
 
 def build_product_exports():
     try:
-        aera = []
-        wawi = []
-        dentalheld = []
-        shopware = []
-
-        products = Product.objects.filter(is_blocked=False)
         aera_skus = set(AeraProduct.objects.values_list("sku", flat=True))
         wawibox_skus = set(WawiboxProduct.objects.values_list("sku", flat=True))
         # dentalheld_skus = set(DentalheldProduct.objects.values_list("sku", flat=True))
         shopware_skus = set(ShopwareProduct.objects.values_list("sku", flat=True))
-        gls_stock_map = get_gls_stock()
-        non_gls_stock_map = get_non_gls_stock()
-        manufacturer_map = get_manufacturer_map()
-        gtin_map = get_gtin_map()
-        vat_rate_map = get_vat_rate_map()
-
-        for product in products:
-            if product.aera_sales_price and (product.sku in aera_skus):
-                aera_export = build_aera_export(
-                    product,
-                    gls_stock_map,
-                    non_gls_stock_map,
-                    manufacturer_map,
-                    gtin_map,
-                )
-                if aera_export:
-                    aera.append(aera_export)
-
-            if product.wawibox_sales_price and (product.sku in wawibox_skus):
-                wawibox_export = build_wawibox_export(
-                    product,
-                    gls_stock_map,
-                    non_gls_stock_map,
-                    vat_rate_map,
-                )
-                if wawibox_export:
-                    wawi.append(wawibox_export)
-
-            if product.aera_sales_price and (
-                product.sku in wawibox_skus
-            ):  # wawibox skus is used here since dentalhed has no means to fetch existing products
-                dentalheld_export = build_dentalheld_export(
-                    product,
-                    gls_stock_map,
-                    non_gls_stock_map,
-                    manufacturer_map,
-                    gtin_map,
-                )
-                if dentalheld_export:
-                    dentalheld.append(dentalheld_export)
-
-            if product.aera_sales_price and (product.sku in shopware_skus):
-                shopware_export = build_shopware_export(
-                    product,
-                    gls_stock_map,
-                    non_gls_stock_map,
-                    manufacturer_map,
-                    gtin_map,
-                    vat_rate_map,
-                )
-                if shopware_export:
-                    shopware.append(shopware_export)
-
-        with transaction.atomic():
-            AeraExport.objects.all().delete()
-            DentalheldExport.objects.all().delete()
-            ShopwareExport.objects.all().delete()
-            WawiboxExport.objects.all().delete()
-
-            AeraExport.objects.bulk_create(aera, batch_size=5000)
-            DentalheldExport.objects.bulk_create(dentalheld, batch_size=5000)
-            ShopwareExport.objects.bulk_create(shopware, batch_size=5000)
-            WawiboxExport.objects.bulk_create(wawi, batch_size=5000)
-            CoreLog.info("Product exports prepared successfully")
+
+        # rows are upserted by sku, unchanged rows keep their push state
+        aera = IncrementalTable(AeraExport, "sku", 5000)
+        dentalheld = IncrementalTable(DentalheldExport, "article_id", 5000)
+        shopware = IncrementalTable(ShopwareExport, "sku", 5000)
+        wawi = IncrementalTable(WawiboxExport, "internal_number", 5000)
+
+        # rows are built outside a transaction, each flush commits on its own
+        columns = load_product_columns()
+        delivery_times = [get_delivery_time(stock) for stock in columns.stock]
+
+        for row in build_aera_rows(
+            columns,
+            delivery_times,
+            aera_skus,
+            aera.row_factory(AERA_ROW_FIELDS),
+        ):
+            aera.add_row(row)
+
+        for row in build_wawibox_rows(
+            columns,
+            delivery_times,
+            wawibox_skus,
+            wawi.row_factory(WAWIBOX_ROW_FIELDS),
+        ):
+            wawi.add_row(row)
+
+        # wawibox skus is used here since dentalhed has no means to fetch existing products
+        for row in build_dentalheld_rows(
+            columns,
+            delivery_times,
+            wawibox_skus,
+            dentalheld.row_factory(DENTALHELD_ROW_FIELDS),
+        ):
+            dentalheld.add_row(row)
+
+        for row in build_shopware_rows(
+            columns,
+            shopware_skus,
+            shopware.row_factory(SHOPWARE_ROW_FIELDS),
+        ):
+            shopware.add_row(row)
+
+        stats = {
+            "Aera": aera.finish(),
+            "Dentalheld": dentalheld.finish(),
+            "Shopware": shopware.finish(),
+            "Wawibox": wawi.finish(),
+        }
+        CoreLog.info(
+            "Product exports prepared successfully: "
+            + ", ".join(
+                f"{name} {st['created']} created, {st['updated']} updated, "
+                f"{st['deleted']} deleted, {st['unchanged']} unchanged"
+                for name, st in stats.items()
+            )
+        )
         return True
     except Exception:
         CoreLog.error(
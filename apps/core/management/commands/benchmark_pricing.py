@@ -0,0 +1,230 @@
+import random
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from apps.core.models import MiddlewareSetting
+from apps.gls.models import (
+    GLSPromotionHeader,
+    GLSPromotionPosition,
+    GLSPromotionPrice,
+)
+from apps.core.pricing import (
+    compute_cogs,
+    compute_gift_info,
+    compute_gls_sales_price,
+    compute_non_gls_sales_price,
+    compute_catalog_prices,
+)
+
+CENT = Decimal("0.01")
+
+
+def random_price(rnd):
+    return Decimal(rnd.randint(100, 500000)) / 100
+
+
+def build_synthetic_catalog(size, seed=1):
+    rnd = random.Random(seed)
+    today = date.today()
+
+    product_id_group_id = []
+    gls_price_list = {}
+    non_gls_product_ids = []
+    non_gls_price_list = {}
+    aera_comp_prices = {}
+    wawi_comp_prices = {}
+
+    for pid in range(1, size + 1):
+        if pid % 10:
+            product_id_group_id.append((pid, f"{pid % 40:03d}"))
+            gls_price_list[pid] = random_price(rnd) if pid % 50 else None
+        else:
+            non_gls_product_ids.append(pid)
+            non_gls_price_list[pid] = random_price(rnd)
+
+        if rnd.random() < 0.7:
+            aera_comp_prices[pid] = [random_price(rnd) for _ in range(3)]
+        if rnd.random() < 0.7:
+            wawi_comp_prices[pid] = [
+                random_price(rnd) for _ in range(rnd.randint(1, 6))
+            ]
+
+    gls_handling_surcharge = {
+        f"{g:03d}": Decimal(g) / 100 if g % 4 else Decimal(g) / 10 for g in range(30)
+    }
+
+    headers = {}
+    for k in range(200):
+        headers[f"AC{k}"] = GLSPromotionHeader(
+            action_code=f"AC{k}",
+            action_type=rnd.choice(["3", "03", "5", "06", "7", "1"]),
+            valid_from=today - timedelta(days=5),
+            valid_to=today + timedelta(days=5 if k % 4 else -10),
+            natural_discount_qty=rnd.choice(["1", "2", "0"]),
+            min_qty=rnd.choice(["3", "5", "10"]),
+        )
+
+    promo_price = {}
+    promo_pos = {}
+    blocked_action_codes = set()
+    gls_pids = [pid for pid, _ in product_id_group_id]
+    for pid in rnd.sample(gls_pids, len(gls_pids) // 5):
+        k = rnd.randint(0, 199)
+        promo_price.setdefault(pid, []).append(
+            GLSPromotionPrice(
+                action_code=f"AC{k}",
+                promotional_purchase_price=random_price(rnd),
+                valid_from=today - timedelta(days=1) if k % 2 else None,
+                valid_to=today + timedelta(days=1) if k % 2 else None,
+            )
+        )
+        position = GLSPromotionPosition(
+            action_code=f"AC{rnd.randint(0, 199)}",
+            qty_editable="1" if rnd.random() < 0.002 else "0",
+        )
+        promo_pos.setdefault(pid, []).append(position)
+        if position.qty_editable == "1":
+            blocked_action_codes.add(position.action_code)
+
+    return {
+        "product_id_group_id": product_id_group_id,
+        "gls_price_list": gls_price_list,
+        "gls_handling_surcharge": gls_handling_surcharge,
+        "promotions": (headers, promo_price, promo_pos, blocked_action_codes),
+        "non_gls_product_ids": non_gls_product_ids,
+        "non_gls_price_list": non_gls_price_list,
+        "aera_comp_prices": aera_comp_prices,
+        "wawi_comp_prices": wawi_comp_prices,
+    }
+
+
+def scalar_catalog_prices(catalog, middleware_settings):
+    # the per product loop run_pricing_engine used before compute_catalog_prices
+    headers, promo_price, promo_pos, blocked_action_codes = catalog["promotions"]
+    aera_comp_prices = catalog["aera_comp_prices"]
+    wawi_comp_prices = catalog["wawi_comp_prices"]
+    pid_sales_price_dict = defaultdict(dict)
+    gift_updates = defaultdict(dict)
+
+    for pid, article_group_no in catalog["product_id_group_id"]:
+        cogs = compute_cogs(pid, catalog["gls_price_list"], headers, promo_price)
+        handling_surcharge = catalog["gls_handling_surcharge"].get(article_group_no, 0)
+        aera_sp = compute_gls_sales_price(
+            pid, handling_surcharge, cogs, aera_comp_prices, middleware_settings
+        )
+        wawibox_sp = compute_gls_sales_price(
+            pid, handling_surcharge, cogs, wawi_comp_prices, middleware_settings
+        )
+        if aera_sp or wawibox_sp:
+            pid_sales_price_dict[pid]["aera"] = aera_sp
+            pid_sales_price_dict[pid]["wawibox"] = wawibox_sp
+
+        if cogs is None:
+            continue
+        gift_info = compute_gift_info(
+            pid, cogs, headers, promo_pos, blocked_action_codes
+        )
+        if gift_info:
+            gift_updates[pid]["aera_gift_sp"] = compute_gls_sales_price(
+                pid,
+                handling_surcharge,
+                gift_info["gift_cogs"],
+                aera_comp_prices,
+                middleware_settings,
+            )
+            gift_updates[pid]["wawibox_gift_sp"] = compute_gls_sales_price(
+                pid,
+                handling_surcharge,
+                gift_info["gift_cogs"],
+                wawi_comp_prices,
+                middleware_settings,
+            )
+            gift_updates[pid]["min_qty"] = gift_info["min_qty"]
+            gift_updates[pid]["free_qty"] = gift_info["free_qty"]
+            gift_updates[pid]["paid_qty"] = gift_info["paid_qty"]
+            gift_updates[pid]["gift_valid_from"] = gift_info["gift_valid_from"]
+            gift_updates[pid]["gift_valid_until"] = gift_info["gift_valid_until"]
+            gift_updates[pid]["gift_promo_code"] = gift_info["gift_promo_code"]
+            gift_updates[pid]["gift_action_type"] = gift_info["gift_action_type"]
+
+    for pid in catalog["non_gls_product_ids"]:
+        aera_sp = compute_non_gls_sales_price(
+            pid, catalog["non_gls_price_list"], aera_comp_prices, middleware_settings
+        )
+        wawibox_sp = compute_non_gls_sales_price(
+            pid, catalog["non_gls_price_list"], wawi_comp_prices, middleware_settings
+        )
+        if aera_sp or wawibox_sp:
+            pid_sales_price_dict[pid]["aera"] = aera_sp
+            pid_sales_price_dict[pid]["wawibox"] = wawibox_sp
+
+    return pid_sales_price_dict, gift_updates
+
+
+def to_cents(data):
+    return {
+        pid: {
+            key: value.quantize(CENT) if isinstance(value, Decimal) else value
+            for key, value in values.items()
+        }
+        for pid, values in data.items()
+    }
+
+
+class Command(BaseCommand):
+    help = "Check parity and compare run times of the scalar and batch pricing engines"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--products", type=int, nargs="+", default=[100000, 1000000]
+        )
+
+    def handle(self, *args, **options):
+        all_ok = True
+        for rule in (MiddlewareSetting.RULE_CHEAPEST, MiddlewareSetting.RULE_AVERAGE):
+            middleware_settings = MiddlewareSetting(
+                minimum_margin=Decimal("12.50"),
+                competitor_rule=rule,
+                undercut_value=Decimal("0.05"),
+            )
+            for size in options["products"]:
+                catalog = build_synthetic_catalog(size)
+
+                started = time.perf_counter()
+                scalar = scalar_catalog_prices(catalog, middleware_settings)
+                scalar_seconds = time.perf_counter() - started
+
+                started = time.perf_counter()
+                batch = compute_catalog_prices(
+                    catalog["product_id_group_id"],
+                    catalog["gls_price_list"],
+                    catalog["gls_handling_surcharge"],
+                    catalog["promotions"],
+                    catalog["non_gls_product_ids"],
+                    catalog["non_gls_price_list"],
+                    catalog["aera_comp_prices"],
+                    catalog["wawi_comp_prices"],
+                    middleware_settings,
+                )
+                batch_seconds = time.perf_counter() - started
+
+                identical = all(
+                    to_cents(s) == to_cents(b) for s, b in zip(scalar, batch)
+                )
+                all_ok = all_ok and identical
+
+                self.stdout.write(
+                    f"{rule} {size} products: scalar {scalar_seconds:.2f}s, "
+                    f"batch {batch_seconds:.2f}s "
+                    f"({scalar_seconds / batch_seconds:.1f}x), "
+                    f"{'identical' if identical else 'MISMATCH'}"
+                )
+
+        if all_ok:
+            self.stdout.write(self.style.SUCCESS("batch prices match scalar prices"))
+        else:
+            self.stdout.write(
+                self.style.ERROR("batch prices differ from scalar prices")
+            )
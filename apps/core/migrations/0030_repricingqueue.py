@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:39
+
+from django.db import migrations, models
+
+
+def queue_full_repricing(apps, schema_editor):
+    # nothing has been tracked before this migration, so start with a full run
+    RepricingQueue = apps.get_model("core", "RepricingQueue")
+    RepricingQueue.objects.get_or_create(sku="*")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_alter_product_aera_sales_price_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepricingQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sku', models.CharField(max_length=50, unique=True)),
+                ('marked_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Repricing Queue',
+            },
+        ),
+        migrations.RunPython(queue_full_repricing, migrations.RunPython.noop),
+    ]
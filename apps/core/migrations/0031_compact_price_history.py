@@ -0,0 +1,134 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+GIFT_FIELDS = [
+    "gift_min_qty",
+    "gift_paid_qty",
+    "gift_free_qty",
+    "gift_valid_from",
+    "gift_valid_until",
+]
+
+
+def to_cents(value):
+    return None if value is None else int(value.scaleb(2))
+
+
+def copy_to_compact_history(apps, schema_editor):
+    ProductPriceHistory = apps.get_model("core", "ProductPriceHistory")
+    ProductGiftPriceHistory = apps.get_model("core", "ProductGiftPriceHistory")
+
+    rows = ProductPriceHistory.objects.values_list(
+        "id",
+        "aera_sales_price",
+        "wawibox_sales_price",
+        "aera_gift_sales_price",
+        "wawibox_gift_sales_price",
+        *GIFT_FIELDS,
+    ).iterator(chunk_size=5000)
+
+    histories = []
+    gifts = []
+    for pk, aera, wawibox, aera_gift, wawibox_gift, *gift_values in rows:
+        histories.append(
+            ProductPriceHistory(
+                id=pk,
+                aera_sales_price_cents=to_cents(aera),
+                wawibox_sales_price_cents=to_cents(wawibox),
+            )
+        )
+        if aera_gift is not None or wawibox_gift is not None:
+            gifts.append(
+                ProductGiftPriceHistory(
+                    history_id=pk,
+                    aera_gift_sales_price_cents=to_cents(aera_gift),
+                    wawibox_gift_sales_price_cents=to_cents(wawibox_gift),
+                    **dict(zip(GIFT_FIELDS, gift_values)),
+                )
+            )
+        if len(histories) >= 5000:
+            ProductPriceHistory.objects.bulk_update(
+                histories, ["aera_sales_price_cents", "wawibox_sales_price_cents"]
+            )
+            histories = []
+
+    ProductPriceHistory.objects.bulk_update(
+        histories, ["aera_sales_price_cents", "wawibox_sales_price_cents"]
+    )
+    ProductGiftPriceHistory.objects.bulk_create(gifts, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0030_repricingqueue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductGiftPriceHistory',
+            fields=[
+                ('history', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='gift', serialize=False, to='core.productpricehistory')),
+                ('aera_gift_sales_price_cents', models.IntegerField(blank=True, null=True)),
+                ('wawibox_gift_sales_price_cents', models.IntegerField(blank=True, null=True)),
+                ('gift_min_qty', models.IntegerField(blank=True, null=True)),
+                ('gift_paid_qty', models.IntegerField(blank=True, null=True)),
+                ('gift_free_qty', models.IntegerField(blank=True, null=True)),
+                ('gift_valid_from', models.DateField(blank=True, null=True)),
+                ('gift_valid_until', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Product Gift Price History',
+            },
+        ),
+        migrations.AddField(
+            model_name='productpricehistory',
+            name='aera_sales_price_cents',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='productpricehistory',
+            name='wawibox_sales_price_cents',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(copy_to_compact_history, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='productpricehistory',
+            name='aera_gift_sales_price',
+        ),
+        migrations.RemoveField(
+            model_name='productpricehistory',
+            name='aera_sales_price',
+        ),
+        migrations.RemoveField(
+            model_name='productpricehistory',
+            name='gift_free_qty',
+        ),
+        migrations.RemoveField(
+            model_name='productpricehistory',
+            name='gift_min_qty',
+        ),
+        migrations.RemoveField(
+            model_name='productpricehistory',
+            name='gift_paid_qty',
+        ),
+        migrations.RemoveField(
+            model_name='productpricehistory',
+            name='gift_valid_from',
+        ),
+        migrations.RemoveField(
+            model_name='productpricehistory',
+            name='gift_valid_until',
+        ),
+        migrations.RemoveField(
+            model_name='productpricehistory',
+            name='wawibox_gift_sales_price',
+        ),
+        migrations.RemoveField(
+            model_name='productpricehistory',
+            name='wawibox_sales_price',
+        ),
+    ]
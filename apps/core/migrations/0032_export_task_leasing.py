@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0031_compact_price_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exporttask',
+            name='attempts',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='exporttask',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='exporttask',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
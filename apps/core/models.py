@@ -4,6 +4,7 @@ from datetime import timedelta
 from django.db import models
 from django.db.models import Model
 from django.db.models import ForeignKey
+from django.db.models import OneToOneField
 from django.db.models import CharField
 from django.db.models import DateField
 from django.db.models import BooleanField
@@ -14,6 +15,8 @@ from django.db.models import TextField
 from django.db.models import DecimalField
 from utils import CleanDecimalField
 from django.db.models import SET_NULL
+from django.db.models import F
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 from decimal import Decimal
 
@@ -293,9 +296,40 @@ class ProductGtin(Model):
     def __str__(self):
         return self.gtin or "gtin"
 
+    @classmethod
+    def preload_export_rows(cls, objs):
+        """
+        Attach the GLS supplier to a chunk of rows with two queries, so the
+        product safety contact columns below don't query per row and column.
+        """
+        from apps.gls.models import GLSMasterData, GLSSupplier
+
+        article_nos = {o.article_no for o in objs if o.supplier == cls.SUPPLIER_GLS}
+        manufacturer_map = dict(
+            GLSMasterData.objects.filter(article_no__in=article_nos).values_list(
+                "article_no", "manufacturer"
+            )
+        )
+        supplier_map = {}
+        # lowest pk wins, like .first()
+        for s in GLSSupplier.objects.filter(
+            supplier_no__in=set(manufacturer_map.values())
+        ).order_by("-pk"):
+            supplier_map[s.supplier_no] = s
+
+        for o in objs:
+            o._export_supplier = (
+                supplier_map.get(manufacturer_map.get(o.article_no))
+                if o.supplier == cls.SUPPLIER_GLS
+                else None
+            )
+
     def _supplier_obj(self):
         from apps.gls.models import GLSMasterData, GLSSupplier
 
+        if hasattr(self, "_export_supplier"):
+            return self._export_supplier
+
         if self.supplier == self.SUPPLIER_GLS:
             md = GLSMasterData.objects.filter(article_no=self.article_no).first()
             if not md:
@@ -389,10 +423,101 @@ class ExportTask(Model):
     error_message = TextField(blank=True, null=True)
     created_at = DateTimeField(auto_now_add=True)
     completed_at = DateTimeField(blank=True, null=True)
+    attempts = IntegerField(default=0, editable=False)
+    lease_expires_at = DateTimeField(blank=True, null=True, editable=False)
+    next_attempt_at = DateTimeField(blank=True, null=True, editable=False)
+
+    MAX_ATTEMPTS = 5
+    # renewed every LEASE_RENEWAL while the export runs, so it only expires
+    # when the worker is gone
+    LEASE = timedelta(minutes=10)
+    LEASE_RENEWAL = timedelta(minutes=2)
+    RETRY_DELAY = timedelta(minutes=2)
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def lease_expired(cls, now):
+        # tasks left processing before leases existed have none
+        return Q(lease_expires_at__lt=now) | Q(lease_expires_at__isnull=True)
+
+    @classmethod
+    def claimable(cls, now):
+        """
+        Pending tasks, failed tasks due for a retry and tasks whose lease
+        expired. Tasks that failed before retries were scheduled have no
+        next_attempt_at and are due right away.
+        """
+        return (
+            Q(status=cls.STATUS_PENDING)
+            | Q(
+                Q(next_attempt_at__lte=now) | Q(next_attempt_at__isnull=True),
+                status=cls.STATUS_FAILED,
+                attempts__lt=cls.MAX_ATTEMPTS,
+            )
+            | Q(
+                cls.lease_expired(now),
+                status=cls.STATUS_PROCESSING,
+                attempts__lt=cls.MAX_ATTEMPTS,
+            )
+        )
+
+    @classmethod
+    def fail_expired(cls, now):
+        """Give up on tasks whose last allowed attempt lost its lease."""
+        cls.objects.filter(
+            cls.lease_expired(now),
+            status=cls.STATUS_PROCESSING,
+            attempts__gte=cls.MAX_ATTEMPTS,
+        ).update(status=cls.STATUS_FAILED, error_message="Export lease expired")
+
+    @classmethod
+    def claim(cls, limit):
+        """
+        Lease up to limit tasks. Each claim is a conditional UPDATE, so a task
+        picked by two workers at once is only processed by the one that wins.
+        """
+        now = timezone.now()
+        cls.fail_expired(now)
+
+        claimed = []
+        while len(claimed) < limit:
+            # tasks lost to another worker are no longer claimable, so the
+            # next query moves on to the following ones
+            candidates = list(
+                cls.objects.filter(cls.claimable(now))
+                .order_by("created_at")
+                .values_list("pk", flat=True)[: limit - len(claimed)]
+            )
+            if not candidates:
+                break
+            for pk in candidates:
+                leased = (
+                    cls.objects.filter(cls.claimable(now), pk=pk).update(
+                        status=cls.STATUS_PROCESSING,
+                        attempts=F("attempts") + 1,
+                        lease_expires_at=now + cls.LEASE,
+                    )
+                    == 1
+                )
+                if leased:
+                    claimed.append(pk)
+        return claimed
+
+    def leased(self):
+        """This task, for as long as the lease this instance was loaded with holds."""
+        return ExportTask.objects.filter(
+            pk=self.pk, status=self.STATUS_PROCESSING, attempts=self.attempts
+        )
+
+    def renew_lease(self):
+        return self.leased().update(lease_expires_at=timezone.now() + self.LEASE) == 1
+
+    def retry_delay(self):
+        # 2, 4, 8, 16 minutes
+        return self.RETRY_DELAY * 2 ** max(self.attempts - 1, 0)
+
 
 class MiddlewareSetting(Model):
     RULE_CHEAPEST = "cheapest"
@@ -432,37 +557,28 @@ class MiddlewareSetting(Model):
         return self.minimum_margin / Decimal(100)
 
 
+def price_to_cents(price):
+    if price is None:
+        return None
+    return int(Decimal(price).quantize(Decimal("0.01")).scaleb(2))
+
+
+def cents_to_price(cents):
+    return None if cents is None else Decimal(cents).scaleb(-2)
+
+
 class ProductPriceHistory(Model):
+    """
+    Sales prices of a product after a pricing run that changed them,
+    stored as integer cents. Gift prices live in ProductGiftPriceHistory.
+    """
+
     product = ForeignKey(
         Product, on_delete=models.CASCADE, related_name="price_history"
     )
 
-    aera_sales_price = DecimalField(
-        max_digits=12, decimal_places=2, null=True, blank=True
-    )
-    wawibox_sales_price = DecimalField(
-        max_digits=12, decimal_places=2, null=True, blank=True
-    )
-    aera_gift_sales_price = DecimalField(
-        max_digits=12,
-        decimal_places=2,
-        null=True,
-        blank=True,
-    )
-    wawibox_gift_sales_price = DecimalField(
-        max_digits=12,
-        decimal_places=2,
-        null=True,
-        blank=True,
-    )
-    gift_min_qty = IntegerField(
-        null=True,
-        blank=True,
-    )
-    gift_paid_qty = IntegerField(null=True, blank=True)
-    gift_free_qty = IntegerField(null=True, blank=True)
-    gift_valid_from = DateField(blank=True, null=True)
-    gift_valid_until = DateField(blank=True, null=True)
+    aera_sales_price_cents = IntegerField(null=True, blank=True)
+    wawibox_sales_price_cents = IntegerField(null=True, blank=True)
     calculated_at = DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -473,5 +589,94 @@ class ProductPriceHistory(Model):
         ]
         verbose_name_plural = "Product Price History"
 
+    @property
+    def aera_sales_price(self):
+        return cents_to_price(self.aera_sales_price_cents)
+
+    @property
+    def wawibox_sales_price(self):
+        return cents_to_price(self.wawibox_sales_price_cents)
+
     def __str__(self):
         return f"{self.product_id} → {self.aera_sales_price} @ {self.calculated_at}"
+
+
+class ProductGiftPriceHistory(Model):
+    """
+    Gift prices of a price history entry, only written while a promotion is active
+    """
+
+    history = OneToOneField(
+        ProductPriceHistory,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="gift",
+    )
+
+    aera_gift_sales_price_cents = IntegerField(null=True, blank=True)
+    wawibox_gift_sales_price_cents = IntegerField(null=True, blank=True)
+    gift_min_qty = IntegerField(null=True, blank=True)
+    gift_paid_qty = IntegerField(null=True, blank=True)
+    gift_free_qty = IntegerField(null=True, blank=True)
+    gift_valid_from = DateField(blank=True, null=True)
+    gift_valid_until = DateField(blank=True, null=True)
+
+    class Meta:
+        verbose_name_plural = "Product Gift Price History"
+
+    @property
+    def aera_gift_sales_price(self):
+        return cents_to_price(self.aera_gift_sales_price_cents)
+
+    @property
+    def wawibox_gift_sales_price(self):
+        return cents_to_price(self.wawibox_gift_sales_price_cents)
+
+    def __str__(self):
+        return f"{self.history_id} → {self.aera_gift_sales_price}"
+
+
+class RepricingQueue(Model):
+    """
+    SKUs whose pricing inputs changed since the last pricing run
+    """
+
+    SKU_ALL = "*"
+    BATCH = 1000
+
+    sku = CharField(max_length=50, unique=True)
+    marked_at = DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Repricing Queue"
+
+    def __str__(self):
+        return self.sku
+
+    @classmethod
+    def mark(cls, skus):
+        objs = [cls(sku=sku) for sku in set(skus) if sku]
+        # re-marking refreshes marked_at so a running pricing job keeps the entry
+        cls.objects.bulk_create(
+            objs,
+            batch_size=cls.BATCH,
+            update_conflicts=True,
+            unique_fields=["sku"],
+            update_fields=["marked_at"],
+        )
+
+    @classmethod
+    def mark_all(cls):
+        cls.mark([cls.SKU_ALL])
+
+    @classmethod
+    def dirty_skus(cls):
+        """Return the queued skus, or None when every product needs repricing."""
+        skus = set(cls.objects.values_list("sku", flat=True))
+        if cls.SKU_ALL in skus:
+            return None
+        return skus
+
+    @classmethod
+    def clear(cls, marked_before):
+        cls.objects.filter(marked_at__lte=marked_before).delete()
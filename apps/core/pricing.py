@@ -1,9 +1,11 @@
 from datetime import datetime, timedelta
 from decimal import Decimal
 from django.db import transaction
+from django.utils import timezone
 from collections import defaultdict
 import traceback
 
+from utils import bulk_update_rows
 from .utils import (
     CoreLog,
 )
@@ -11,7 +13,10 @@ from .models import (
     Product,
     MiddlewareSetting,
     ProductPriceHistory,
+    ProductGiftPriceHistory,
     AdditionalMasterData,
+    RepricingQueue,
+    price_to_cents,
 )
 from apps.aera.models import (
     AeraCompetitorPrice,
@@ -28,30 +33,68 @@ from apps.gls.models import (
 )
 
 
-def get_product_ids_and_groups():
+def filter_product_ids(qs, product_ids, batch_size=5000):
+    """Rows of qs for product_ids, looked up in chunks of batch_size ids."""
+    if product_ids is None:
+        return list(qs)
+    product_ids = sorted(product_ids)
+    rows = []
+    for i in range(0, len(product_ids), batch_size):
+        rows.extend(qs.filter(id__in=product_ids[i : i + batch_size]))
+    return rows
+
+
+def get_product_ids_and_groups(product_ids=None):
     """
     Return a list of tuples containing (id, gls_article_group_no)
-    for all gls products in the database.
+    for all gls products in the database, or only for product_ids.
     """
-    id_article_group_no_list = list(
-        Product.objects.filter(
-            supplier=Product.SUPPLIER_GLS,
-        ).values_list("id", "gls_article_group_no")
-    )
-    return id_article_group_no_list
+    qs = Product.objects.filter(
+        supplier=Product.SUPPLIER_GLS,
+    ).values_list("id", "gls_article_group_no")
+    return filter_product_ids(qs, product_ids)
 
 
-def get_non_gls_product_ids():
+def get_non_gls_product_ids(product_ids=None):
     """
     Return a list containing id
-    for all non gls products in the database.
+    for all non gls products in the database, or only for product_ids.
+    """
+    qs = Product.objects.filter(supplier=Product.SUPPLIER_NON_GLS).values_list(
+        "id", flat=True
+    )
+    return filter_product_ids(qs, product_ids)
+
+
+def get_reprice_product_ids(dirty_skus):
+    """
+    Return the ids of products to reprice: queued skus, products on a GLS
+    promotion and products carrying a gift price, since promotion validity
+    depends on the date rather than on imported data.
     """
-    id_list = list(
-        Product.objects.filter(supplier=Product.SUPPLIER_NON_GLS).values_list(
-            "id", flat=True
+    product_ids = set()
+    dirty_skus = list(dirty_skus)
+    for i in range(0, len(dirty_skus), 5000):
+        product_ids.update(
+            Product.objects.filter(sku__in=dirty_skus[i : i + 5000]).values_list(
+                "id", flat=True
+            )
+        )
+
+    product_ids.update(
+        GLSPromotionPrice.objects.filter(product__isnull=False).values_list(
+            "product_id", flat=True
+        )
+    )
+    product_ids.update(
+        GLSPromotionPosition.objects.filter(product__isnull=False).values_list(
+            "product_id", flat=True
         )
     )
-    return id_list
+    product_ids.update(
+        Product.objects.filter(has_gift_price=True).values_list("id", flat=True)
+    )
+    return product_ids
 
 
 def fetch_gls_prices():
@@ -149,8 +192,8 @@ def fetch_promotions():
     return headers, promo_price, promo_pos, blocked_action_codes
 
 
-def compute_cogs(pid, gls_prices, headers, promo_price):
-    today = datetime.today().date()
+def compute_cogs(pid, gls_prices, headers, promo_price, today=None):
+    today = today or datetime.today().date()
 
     cogs = gls_prices.get(pid)
     if not cogs:
@@ -177,8 +220,8 @@ def compute_cogs(pid, gls_prices, headers, promo_price):
     return cogs
 
 
-def compute_gift_info(pid, cogs, headers, promo_pos, blocked_action_codes):
-    today = datetime.today().date()
+def compute_gift_info(pid, cogs, headers, promo_pos, blocked_action_codes, today=None):
+    today = today or datetime.today().date()
 
     promo_positions = promo_pos.get(pid, [])
 
@@ -299,212 +342,313 @@ def compute_non_gls_sales_price(
     return top_comp - undercut
 
 
+def compute_reference_prices(competitor_prices, competitor_rule):
+    """
+    Return {product_id: reference competitor price}, sorted and reduced once
+    per product with the same rule as compute_gls_sales_price.
+    """
+    average = competitor_rule == MiddlewareSetting.RULE_AVERAGE
+    ref_prices = {}
+    for pid, prices in competitor_prices.items():
+        if not prices:
+            continue
+        prices = sorted(prices)
+        ref_prices[pid] = sum(prices[:3]) / 3 if average else prices[0]
+    return ref_prices
+
+
+def apply_reference_prices(pids, base_prices, ref_prices, undercut):
+    """
+    Column-wise equivalent of the competitor step of compute_gls_sales_price
+    for parallel lists of product ids and base prices.
+    """
+    sales_prices = []
+    for pid, base_price in zip(pids, base_prices):
+        ref_price = ref_prices.get(pid)
+        if base_price is None or ref_price is None or base_price > ref_price:
+            sales_prices.append(base_price)
+        else:
+            sales_prices.append(ref_price - undercut)
+    return sales_prices
+
+
+def compute_catalog_prices(
+    product_id_group_id,
+    gls_price_list,
+    gls_handling_surcharge,
+    promotions,
+    non_gls_product_ids,
+    non_gls_price_list,
+    aera_comp_prices,
+    wawi_comp_prices,
+    middleware_settings,
+):
+    """
+    Batch pricing for the whole catalog. Inputs are loaded once, competitor
+    references and surcharge factors are evaluated once, and the per product
+    work is reduced to column operations on Decimals, so results are identical
+    to the scalar compute_* functions.
+    """
+    today = datetime.today().date()
+    promo_headers, promo_price, promo_pos, blocked_action_codes = promotions
+    one_plus_margin = 1 + middleware_settings.normalised_minimum_margin
+    undercut = middleware_settings.undercut_value
+    rule = middleware_settings.competitor_rule
+
+    aera_refs = compute_reference_prices(aera_comp_prices, rule)
+    wawi_refs = compute_reference_prices(wawi_comp_prices, rule)
+    one_plus_surcharge = {
+        group: 1 + surcharge for group, surcharge in gls_handling_surcharge.items()
+    }
+
+    pid_sales_price_dict = defaultdict(dict)
+    gift_updates = defaultdict(dict)
+
+    # ---------- GLS ----------
+    gls_pids = []
+    base_prices = []
+    gift_pids = []
+    gift_base_prices = []
+    gift_infos = []
+    for pid, article_group_no in product_id_group_id:
+        cogs = compute_cogs(pid, gls_price_list, promo_headers, promo_price, today)
+        factor = one_plus_surcharge.get(article_group_no, 1)
+        gls_pids.append(pid)
+        base_prices.append(cogs * factor * one_plus_margin if cogs else None)
+
+        if cogs is None:
+            continue
+        gift_info = compute_gift_info(
+            pid, cogs, promo_headers, promo_pos, blocked_action_codes, today
+        )
+        if gift_info:
+            gift_cogs = gift_info["gift_cogs"]
+            gift_pids.append(pid)
+            gift_infos.append(gift_info)
+            gift_base_prices.append(
+                gift_cogs * factor * one_plus_margin if gift_cogs else None
+            )
+
+    aera_prices = apply_reference_prices(gls_pids, base_prices, aera_refs, undercut)
+    wawi_prices = apply_reference_prices(gls_pids, base_prices, wawi_refs, undercut)
+    for pid, aera_sp, wawibox_sp in zip(gls_pids, aera_prices, wawi_prices):
+        if aera_sp or wawibox_sp:
+            pid_sales_price_dict[pid]["aera"] = aera_sp
+            pid_sales_price_dict[pid]["wawibox"] = wawibox_sp
+
+    aera_gift_prices = apply_reference_prices(
+        gift_pids, gift_base_prices, aera_refs, undercut
+    )
+    wawi_gift_prices = apply_reference_prices(
+        gift_pids, gift_base_prices, wawi_refs, undercut
+    )
+    for pid, gift_info, aera_gift_sp, wawibox_gift_sp in zip(
+        gift_pids, gift_infos, aera_gift_prices, wawi_gift_prices
+    ):
+        gift_updates[pid]["aera_gift_sp"] = aera_gift_sp
+        gift_updates[pid]["wawibox_gift_sp"] = wawibox_gift_sp
+        gift_updates[pid]["min_qty"] = gift_info["min_qty"]
+        gift_updates[pid]["free_qty"] = gift_info["free_qty"]
+        gift_updates[pid]["paid_qty"] = gift_info["paid_qty"]
+        gift_updates[pid]["gift_valid_from"] = gift_info["gift_valid_from"]
+        gift_updates[pid]["gift_valid_until"] = gift_info["gift_valid_until"]
+        gift_updates[pid]["gift_promo_code"] = gift_info["gift_promo_code"]
+        gift_updates[pid]["gift_action_type"] = gift_info["gift_action_type"]
+
+    # ---------- NON GLS ----------
+    non_gls_pids = []
+    base_prices = []
+    for pid in non_gls_product_ids:
+        price_with_handling_fee = non_gls_price_list.get(pid)
+        if price_with_handling_fee is None:
+            continue
+        non_gls_pids.append(pid)
+        base_prices.append(price_with_handling_fee * one_plus_margin)
+
+    aera_prices = apply_reference_prices(non_gls_pids, base_prices, aera_refs, undercut)
+    wawi_prices = apply_reference_prices(non_gls_pids, base_prices, wawi_refs, undercut)
+    for pid, aera_sp, wawibox_sp in zip(non_gls_pids, aera_prices, wawi_prices):
+        if aera_sp or wawibox_sp:
+            pid_sales_price_dict[pid]["aera"] = aera_sp
+            pid_sales_price_dict[pid]["wawibox"] = wawibox_sp
+
+    return pid_sales_price_dict, gift_updates
+
+
+PRODUCT_PRICE_FIELDS = [
+    "aera_sales_price",
+    "wawibox_sales_price",
+    "aera_gift_sales_price",
+    "wawibox_gift_sales_price",
+    "gift_min_qty",
+    "gift_free_qty",
+    "gift_paid_qty",
+    "gift_valid_from",
+    "gift_valid_until",
+    "gift_promo_code",
+    "gift_action_type",
+    "has_gift_price",
+]
+
+CENT = Decimal("0.01")
+
+
+def as_stored(value):
+    # prices are stored with two decimals, compare them the way they will be saved
+    return value.quantize(CENT) if isinstance(value, Decimal) else value
+
+
 def update_products(prices, gift_updates):
     """prices = {product_id: {aera: sales_price, wawibox: sales_price,}}"""
     """gift_updates = {product_id: {aera: (gift_sp, min_qty), wawibox: (gift_sp, min_qty)}}"""
     """gift_updates = {product_id: {aera_gift_sp: 2.1, wawibox_gift_sp: 2.2, min_qty: 4, gift_valid_from: 2026/01/05, gift_valid_until: 2026/04/05,}}"""
+    """Only products whose stored values change are written, their ids are returned."""
     ids = list(set(prices.keys()) | set(gift_updates.keys()))
-    BATCH = 500
+    BATCH = 5000
+    no_gift = (None,) * 9 + (False,)
+    rows = []
 
     for i in range(0, len(ids), BATCH):
         chunk = ids[i : i + BATCH]
 
-        products = Product.objects.filter(id__in=chunk).only(
-            "id",
-            "aera_sales_price",
-            "wawibox_sales_price",
-            "aera_gift_sales_price",
-            "wawibox_gift_sales_price",
-            "gift_min_qty",
-            "gift_valid_from",
-            "gift_valid_until",
-            "has_gift_price",
+        current = Product.objects.filter(id__in=chunk).values_list(
+            "id", *PRODUCT_PRICE_FIELDS
         )
-        batch = []
-        for p in products:
-            if p.id in prices:
-                p.aera_sales_price = prices[p.id]["aera"]
-                p.wawibox_sales_price = prices[p.id]["wawibox"]
-
-            if p.id in gift_updates:
-                p.aera_gift_sales_price = gift_updates[p.id]["aera_gift_sp"]
-                p.wawibox_gift_sales_price = gift_updates[p.id]["wawibox_gift_sp"]
-                p.gift_min_qty = gift_updates[p.id]["min_qty"]
-                p.gift_free_qty = gift_updates[p.id]["free_qty"]
-                p.gift_paid_qty = gift_updates[p.id]["paid_qty"]
-                p.gift_valid_from = gift_updates[p.id]["gift_valid_from"]
-                p.gift_valid_until = gift_updates[p.id]["gift_valid_until"]
-                p.gift_promo_code = gift_updates[p.id]["gift_promo_code"]
-                p.gift_action_type = gift_updates[p.id]["gift_action_type"]
-                p.has_gift_price = True
+        for pid, *before in current:
+            if pid in prices:
+                sales_prices = (prices[pid]["aera"], prices[pid]["wawibox"])
             else:
-                p.aera_gift_sales_price = None
-                p.wawibox_gift_sales_price = None
-                p.gift_min_qty = None
-                p.gift_free_qty = None
-                p.gift_paid_qty = None
-                p.gift_valid_from = None
-                p.gift_valid_until = None
-                p.gift_promo_code = None
-                p.gift_action_type = None
-                p.has_gift_price = False
-
-            batch.append(p)
-
-        if batch:
-            Product.objects.bulk_update(
-                batch,
-                [
-                    "aera_sales_price",
-                    "wawibox_sales_price",
-                    "aera_gift_sales_price",
-                    "wawibox_gift_sales_price",
-                    "gift_min_qty",
-                    "gift_free_qty",
-                    "gift_paid_qty",
-                    "gift_valid_from",
-                    "gift_valid_until",
-                    "gift_promo_code",
-                    "gift_action_type",
-                    "has_gift_price",
-                ],
-                batch_size=BATCH,
-            )
+                sales_prices = tuple(before[:2])
+
+            gift = gift_updates.get(pid)
+            if gift is not None:
+                gift_values = (
+                    gift["aera_gift_sp"],
+                    gift["wawibox_gift_sp"],
+                    gift["min_qty"],
+                    gift["free_qty"],
+                    gift["paid_qty"],
+                    gift["gift_valid_from"],
+                    gift["gift_valid_until"],
+                    gift["gift_promo_code"],
+                    gift["gift_action_type"],
+                    True,
+                )
+            else:
+                gift_values = no_gift
+
+            after = tuple(as_stored(v) for v in sales_prices + gift_values)
+            if list(after) != before:
+                rows.append((pid,) + after)
 
+    if rows:
+        bulk_update_rows(Product, PRODUCT_PRICE_FIELDS, rows)
 
-def save_price_history(prices, gift_updates):
+    return {row[0] for row in rows}
+
+
+def save_price_history(prices, gift_updates, product_ids=None):
     """prices = {product_id: {aera: sales_price, wawibox: sales_price,}}"""
     """gift_updates = {product_id: {aera: (gift_sp, min_qty), wawibox: (gift_sp, min_qty)}}"""
     """gift_updates = {product_id: {aera_gift_sp: 2.1, wawibox_gift_sp: 2.2, min_qty: 4, gift_valid_from: 2026/01/05, gift_valid_until: 2026/04/05,}}"""
+    """product_ids limits the history to those products, e.g. the ones whose price changed."""
 
     objs = []
+    gift_pids = []
 
     for pid, sp_dict in prices.items():
-        gift_dict = gift_updates.get(pid, {})
+        if product_ids is not None and pid not in product_ids:
+            continue
 
         objs.append(
             ProductPriceHistory(
                 product_id=pid,
-                aera_sales_price=sp_dict["aera"],
-                wawibox_sales_price=sp_dict["wawibox"],
-                aera_gift_sales_price=gift_dict.get("aera_gift_sp"),
-                wawibox_gift_sales_price=gift_dict.get("wawibox_gift_sp"),
-                gift_min_qty=gift_dict.get("min_qty"),
-                gift_free_qty=gift_dict.get("free_qty"),
-                gift_paid_qty=gift_dict.get("paid_qty"),
-                gift_valid_from=gift_dict.get("gift_valid_from"),
-                gift_valid_until=gift_dict.get("gift_valid_until"),
+                aera_sales_price_cents=price_to_cents(sp_dict["aera"]),
+                wawibox_sales_price_cents=price_to_cents(sp_dict["wawibox"]),
             )
         )
+        gift_pids.append(pid if pid in gift_updates else None)
 
+    # ids are set on the created objects, gift rows are only written for promotions
     ProductPriceHistory.objects.bulk_create(objs, batch_size=5000)
 
+    gifts = []
+    for history, pid in zip(objs, gift_pids):
+        if pid is None:
+            continue
+        gift_dict = gift_updates[pid]
+        gifts.append(
+            ProductGiftPriceHistory(
+                history=history,
+                aera_gift_sales_price_cents=price_to_cents(gift_dict["aera_gift_sp"]),
+                wawibox_gift_sales_price_cents=price_to_cents(
+                    gift_dict["wawibox_gift_sp"]
+                ),
+                gift_min_qty=gift_dict["min_qty"],
+                gift_free_qty=gift_dict["free_qty"],
+                gift_paid_qty=gift_dict["paid_qty"],
+                gift_valid_from=gift_dict["gift_valid_from"],
+                gift_valid_until=gift_dict["gift_valid_until"],
+            )
+        )
+    ProductGiftPriceHistory.objects.bulk_create(gifts, batch_size=5000)
+
 
-def cleanup_history():
-    limit = datetime.now() - timedelta(days=90)
-    ProductPriceHistory.objects.filter(calculated_at__lt=limit).delete()
+def cleanup_history(batch_size=5000):
+    """
+    Delete history older than 90 days in small transactions, so the
+    database is never locked for the whole cleanup.
+    """
+    limit = timezone.now() - timedelta(days=90)
+    deleted = 0
+    while True:
+        ids = list(
+            ProductPriceHistory.objects.filter(calculated_at__lt=limit)
+            .order_by()
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            ProductGiftPriceHistory.objects.filter(history_id__in=ids).delete()
+            ProductPriceHistory.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
 
 
 def run_pricing_engine():
     try:
+        started = timezone.now()
+        dirty_skus = RepricingQueue.dirty_skus()
+        product_ids = None
+        if dirty_skus is not None:
+            product_ids = get_reprice_product_ids(dirty_skus)
+
         middleware_settings = MiddlewareSetting.objects.first()
         aera_comp_prices = fetch_aera_competitive_prices()
         wawi_comp_prices = fetch_wawibox_competitive_prices()
 
-        pid_sales_price_dict = defaultdict(dict)
-        gift_updates = defaultdict(dict)
-
-        # Calculate for GLS products
-        product_id_group_id = get_product_ids_and_groups()
-        gls_price_list = fetch_gls_prices()
-        gls_handling_surcharge = fetch_gls_handling_surcharge()
-        promo_headers, promo_price, promo_pos, blocked_action_codes = fetch_promotions()
-
-        for pid, article_group_no in product_id_group_id:
-            # Normal sales price
-            cogs = compute_cogs(pid, gls_price_list, promo_headers, promo_price)
-            handling_surcharge = gls_handling_surcharge.get(article_group_no, 0)
-            aera_sp = compute_gls_sales_price(
-                pid,
-                handling_surcharge,
-                cogs,
-                aera_comp_prices,
-                middleware_settings,
-            )
-            wawibox_sp = compute_gls_sales_price(
-                pid,
-                handling_surcharge,
-                cogs,
-                wawi_comp_prices,
-                middleware_settings,
-            )
-
-            if aera_sp or wawibox_sp:
-                pid_sales_price_dict[pid]["aera"] = aera_sp
-                pid_sales_price_dict[pid]["wawibox"] = wawibox_sp
-
-            # Gift sales price
-            gift_info = compute_gift_info(
-                pid,
-                cogs,
-                promo_headers,
-                promo_pos,
-                blocked_action_codes,
-            )
-            if gift_info:
-                aera_gift_sp = compute_gls_sales_price(
-                    pid,
-                    handling_surcharge,
-                    gift_info["gift_cogs"],
-                    aera_comp_prices,
-                    middleware_settings,
-                )
-                wawibox_gift_sp = compute_gls_sales_price(
-                    pid,
-                    handling_surcharge,
-                    gift_info["gift_cogs"],
-                    wawi_comp_prices,
-                    middleware_settings,
-                )
-
-                gift_updates[pid]["aera_gift_sp"] = aera_gift_sp
-                gift_updates[pid]["wawibox_gift_sp"] = wawibox_gift_sp
-                gift_updates[pid]["min_qty"] = gift_info["min_qty"]
-                gift_updates[pid]["free_qty"] = gift_info["free_qty"]
-                gift_updates[pid]["paid_qty"] = gift_info["paid_qty"]
-                gift_updates[pid]["gift_valid_from"] = gift_info["gift_valid_from"]
-                gift_updates[pid]["gift_valid_until"] = gift_info["gift_valid_until"]
-                gift_updates[pid]["gift_promo_code"] = gift_info["gift_promo_code"]
-                gift_updates[pid]["gift_action_type"] = gift_info["gift_action_type"]
-
-        # Calculate for non GLS products
-        product_ids = get_non_gls_product_ids()
-        non_gls_price_list = fetch_non_gls_prices()
-
-        for pid in product_ids:
-            aera_sp = compute_non_gls_sales_price(
-                pid,
-                non_gls_price_list,
-                aera_comp_prices,
-                middleware_settings,
-            )
-
-            wawibox_sp = compute_non_gls_sales_price(
-                pid,
-                non_gls_price_list,
-                wawi_comp_prices,
-                middleware_settings,
-            )
-
-            if aera_sp or wawibox_sp:
-                pid_sales_price_dict[pid]["aera"] = aera_sp
-                pid_sales_price_dict[pid]["wawibox"] = wawibox_sp
+        pid_sales_price_dict, gift_updates = compute_catalog_prices(
+            get_product_ids_and_groups(product_ids),
+            fetch_gls_prices(),
+            fetch_gls_handling_surcharge(),
+            fetch_promotions(),
+            get_non_gls_product_ids(product_ids),
+            fetch_non_gls_prices(),
+            aera_comp_prices,
+            wawi_comp_prices,
+            middleware_settings,
+        )
 
         with transaction.atomic():
-            update_products(pid_sales_price_dict, gift_updates)
-            save_price_history(pid_sales_price_dict, gift_updates)
-            cleanup_history()
-            CoreLog.info("Sales prices calculated successfully")
+            changed_ids = update_products(pid_sales_price_dict, gift_updates)
+            save_price_history(pid_sales_price_dict, gift_updates, changed_ids)
+            RepricingQueue.clear(started)
+            CoreLog.info(
+                f"Sales prices calculated successfully: "
+                f"{'all' if product_ids is None else len(product_ids)} products repriced, "
+                f"{len(changed_ids)} changed"
+            )
+        cleanup_history()
         return True
     except Exception:
         CoreLog.error(
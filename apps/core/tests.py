@@ -0,0 +1,590 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.aera.models import AeraExport, AeraProduct
+from apps.core import exports
+from apps.core.exports import build_product_exports, load_product_snapshot
+from apps.core.management.commands.benchmark_pricing import (
+    build_synthetic_catalog,
+    scalar_catalog_prices,
+)
+from apps.core.models import (
+    AdditionalMasterData,
+    ExportTask,
+    MiddlewareSetting,
+    Product,
+    ProductGtin,
+)
+from apps.core.pricing import (
+    compute_catalog_prices,
+    get_non_gls_product_ids,
+    get_product_ids_and_groups,
+)
+from apps.gls.models import (
+    GLSMasterData,
+    GLSPriceList,
+    GLSPromotionHeader,
+    GLSPromotionPosition,
+    GLSPromotionPrice,
+    GLSStockLevel,
+    GLSSupplier,
+)
+from apps.shopware.models import ShopwareProduct
+from apps.wawibox.models import WawiboxProduct
+from utils import FTPClient, FTPSClient, StreamAborted, stream_upload
+
+
+class FakeFTP:
+    """Keeps what a STOR received even when the data connection is cut."""
+
+    def __init__(self):
+        self.files = {}
+        self.pending_reply = False
+
+    def storbinary(self, cmd, fp, blocksize=8192):
+        name = cmd.removeprefix("STOR ")
+        self.files[name] = b""
+        try:
+            while buf := fp.read(blocksize):
+                self.files[name] += buf
+        except Exception:
+            self.pending_reply = True
+            raise
+        return "226 Transfer complete"
+
+    def voidresp(self):
+        assert self.pending_reply, "no reply pending on the control connection"
+        self.pending_reply = False
+        return "226 Transfer complete"
+
+    def delete(self, name):
+        del self.files[name]
+
+    def rename(self, source, target):
+        self.files[target] = self.files.pop(source)
+
+
+class FakeSFTP(FakeFTP):
+    def putfo(self, fp, remote_path):
+        self.files[remote_path] = b""
+        while buf := fp.read(32768):
+            self.files[remote_path] += buf
+
+    def remove(self, name):
+        del self.files[name]
+
+    def posix_rename(self, source, target):
+        self.rename(source, target)
+
+
+class StreamUploadTests(SimpleTestCase):
+    remote_path = "/upload/products.csv"
+
+    def setUp(self):
+        tmp_dir = TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.local_path = str(Path(tmp_dir.name) / "products.csv")
+
+    def make_client(self, client_class):
+        client = client_class("host", "user", "password")
+        if client_class is FTPSClient:
+            client.ftps = FakeFTP()
+            client.server = client.ftps
+        else:
+            client.sftp = FakeSFTP()
+            client.server = client.sftp
+        client.server.files[self.remote_path] = b"previous good file"
+        return client
+
+    def upload(self, client, chunks):
+        @contextmanager
+        def open_connection():
+            yield client
+
+        return stream_upload(open_connection, chunks, self.remote_path, self.local_path)
+
+    def test_complete_upload_replaces_remote_file(self):
+        for client_class in (FTPSClient, FTPClient):
+            with self.subTest(client=client_class.__name__):
+                client = self.make_client(client_class)
+                chunks = [b"sku;price\n"] + [b"LG%05d;1.00\n" % i for i in range(5000)]
+
+                result = self.upload(client, iter(chunks))
+
+                self.assertTrue(result["uploaded"], result["error"])
+                self.assertEqual(
+                    client.server.files, {self.remote_path: b"".join(chunks)}
+                )
+                self.assertEqual(Path(self.local_path).read_bytes(), b"".join(chunks))
+
+    def test_producer_failure_keeps_previous_remote_file(self):
+        def failing_chunks():
+            yield b"sku;price\n"
+            for i in range(5000):
+                yield b"LG%05d;1.00\n" % i
+            raise ValueError("export query failed")
+
+        for client_class in (FTPSClient, FTPClient):
+            with self.subTest(client=client_class.__name__):
+                client = self.make_client(client_class)
+
+                with self.assertRaises(ValueError):
+                    self.upload(client, failing_chunks())
+
+                self.assertEqual(
+                    client.server.files, {self.remote_path: b"previous good file"}
+                )
+                self.assertFalse(client.server.pending_reply)
+                self.assertFalse(Path(self.local_path).exists())
+
+    def test_aborted_read_raises_stream_aborted(self):
+        client = self.make_client(FTPSClient)
+
+        class AbortedPipe:
+            def read(self, size=-1):
+                raise StreamAborted("Stream aborted by producer")
+
+        with self.assertRaises(StreamAborted):
+            client.upload_stream(AbortedPipe(), self.remote_path)
+        self.assertEqual(client.server.files, {self.remote_path: b"previous good file"})
+
+
+class ExportTaskLeaseTests(TestCase):
+    def setUp(self):
+        self.tasks = [ExportTask.objects.create(name=f"export {i}") for i in range(3)]
+
+    def test_claim_leases_only_the_requested_number(self):
+        first = ExportTask.claim(1)
+        second = ExportTask.claim(1)
+
+        self.assertEqual(first, [self.tasks[0].pk])
+        self.assertEqual(second, [self.tasks[1].pk])
+        self.assertEqual(
+            ExportTask.objects.filter(status=ExportTask.STATUS_PENDING).count(), 1
+        )
+
+    def test_renewed_lease_is_not_claimed_again(self):
+        ExportTask.claim(3)
+        task = ExportTask.objects.get(pk=self.tasks[0].pk)
+        ExportTask.objects.filter(pk=task.pk).update(
+            lease_expires_at=timezone.now() + timedelta(seconds=1)
+        )
+
+        self.assertTrue(task.renew_lease())
+        task.refresh_from_db()
+        self.assertGreater(task.lease_expires_at, timezone.now() + ExportTask.LEASE / 2)
+        self.assertEqual(ExportTask.claim(3), [])
+
+    def test_expired_lease_moves_to_the_next_worker(self):
+        ExportTask.claim(1)
+        stale = ExportTask.objects.get(pk=self.tasks[0].pk)
+        ExportTask.objects.filter(pk=stale.pk).update(
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        self.assertEqual(ExportTask.claim(1), [stale.pk])
+        # the first worker can neither renew nor save its result anymore
+        self.assertFalse(stale.renew_lease())
+        self.assertFalse(stale.leased().exists())
+
+    def test_last_attempt_with_expired_lease_fails(self):
+        ExportTask.objects.filter(pk=self.tasks[0].pk).update(
+            status=ExportTask.STATUS_PROCESSING,
+            attempts=ExportTask.MAX_ATTEMPTS,
+            lease_expires_at=timezone.now() - timedelta(seconds=1),
+        )
+
+        ExportTask.fail_expired(timezone.now())
+
+        self.assertEqual(
+            ExportTask.objects.get(pk=self.tasks[0].pk).status,
+            ExportTask.STATUS_FAILED,
+        )
+
+    def test_tasks_from_before_leases_are_claimed(self):
+        failed, stuck, _ = self.tasks
+        ExportTask.objects.filter(pk=failed.pk).update(status=ExportTask.STATUS_FAILED)
+        ExportTask.objects.filter(pk=stuck.pk).update(
+            status=ExportTask.STATUS_PROCESSING
+        )
+
+        self.assertCountEqual(
+            ExportTask.claim(3), [failed.pk, stuck.pk, self.tasks[2].pk]
+        )
+
+
+def make_middleware_settings(rule):
+    return MiddlewareSetting(
+        minimum_margin=Decimal("12.50"),
+        competitor_rule=rule,
+        undercut_value=Decimal("0.05"),
+    )
+
+
+def batch_catalog_prices(catalog, middleware_settings):
+    return compute_catalog_prices(
+        catalog["product_id_group_id"],
+        catalog["gls_price_list"],
+        catalog["gls_handling_surcharge"],
+        catalog["promotions"],
+        catalog["non_gls_product_ids"],
+        catalog["non_gls_price_list"],
+        catalog["aera_comp_prices"],
+        catalog["wawi_comp_prices"],
+        middleware_settings,
+    )
+
+
+def edge_case_catalog():
+    today = date.today()
+    past = today - timedelta(days=30)
+    future = today + timedelta(days=30)
+    yesterday = today - timedelta(days=1)
+
+    def header(action_code, action_type, valid_to=future, free="0", total="0"):
+        return GLSPromotionHeader(
+            action_code=action_code,
+            action_type=action_type,
+            valid_from=past,
+            valid_to=valid_to,
+            natural_discount_qty=free,
+            min_qty=total,
+        )
+
+    headers = {
+        "PRICE": header("PRICE", "3"),
+        "PRICE_EXPIRED": header("PRICE_EXPIRED", "03", valid_to=yesterday),
+        "PRICE_OTHER": header("PRICE_OTHER", "1"),
+        "GIFT": header("GIFT", "5", free="1", total="4"),
+        "GIFT_EXPIRED": header("GIFT_EXPIRED", "06", yesterday, free="2", total="6"),
+        "GIFT_BLOCKED": header("GIFT_BLOCKED", "7", free="1", total="3"),
+        "GIFT_NO_FREE": header("GIFT_NO_FREE", "5", free="0", total="3"),
+        "GIFT_INVALID": header("GIFT_INVALID", "07", free="n/a", total="3"),
+    }
+
+    def price(action_code, value, valid_from=None, valid_to=None):
+        return GLSPromotionPrice(
+            action_code=action_code,
+            promotional_purchase_price=Decimal(value),
+            valid_from=valid_from,
+            valid_to=valid_to,
+        )
+
+    def position(action_code, qty_editable="0"):
+        return GLSPromotionPosition(action_code=action_code, qty_editable=qty_editable)
+
+    promo_price = {
+        4: [price("PRICE", "15.00")],
+        5: [price("PRICE_EXPIRED", "15.00")],
+        6: [price("PRICE", "15.00", past, yesterday)],
+        13: [price("PRICE_OTHER", "15.00"), price("PRICE", "0")],
+    }
+    promo_pos = {
+        7: [position("GIFT")],
+        8: [position("GIFT_EXPIRED")],
+        9: [position("GIFT_BLOCKED", "1"), position("GIFT")],
+        10: [position("GIFT_BLOCKED")],
+        11: [position("GIFT_NO_FREE")],
+        14: [position("GIFT_INVALID"), position("UNKNOWN")],
+    }
+
+    gls_price_list = {
+        1: Decimal("10.00"),
+        2: None,
+        3: Decimal("0"),
+        4: Decimal("20.00"),
+        5: Decimal("20.00"),
+        6: Decimal("20.00"),
+        7: Decimal("30.00"),
+        8: Decimal("30.00"),
+        9: Decimal("30.00"),
+        10: Decimal("30.00"),
+        11: Decimal("30.00"),
+        12: Decimal("5.00"),
+        13: Decimal("20.00"),
+        14: Decimal("30.00"),
+    }
+    return {
+        "product_id_group_id": [
+            (pid, "999" if pid == 12 else "001") for pid in gls_price_list
+        ],
+        "gls_price_list": gls_price_list,
+        "gls_handling_surcharge": {"001": Decimal("0.10")},
+        "promotions": (headers, promo_price, promo_pos, {"GIFT_BLOCKED"}),
+        "non_gls_product_ids": [20, 21],
+        "non_gls_price_list": {20: Decimal("50.00"), 21: Decimal("8.00")},
+        "aera_comp_prices": {
+            1: [Decimal("20.00"), Decimal("12.00"), Decimal("15.00")],
+            2: [Decimal("9.00")],
+            4: [Decimal("25.00"), Decimal("30.00"), Decimal("35.00"), Decimal("1")],
+            7: [Decimal("40.00")],
+            12: [Decimal("2.00"), Decimal("1.00")],
+            20: [Decimal("40.00")],
+        },
+        "wawi_comp_prices": {
+            1: [],
+            9: [Decimal("50.00"), Decimal("45.00")],
+            12: [Decimal("100.00")],
+            21: [Decimal("20.00"), Decimal("30.00"), Decimal("25.00")],
+        },
+    }
+
+
+class CatalogPricingParityTests(TestCase):
+    """compute_catalog_prices must price exactly like the scalar compute_* path."""
+
+    RULES = (MiddlewareSetting.RULE_CHEAPEST, MiddlewareSetting.RULE_AVERAGE)
+
+    def assert_parity(self, make_catalog):
+        for rule in self.RULES:
+            with self.subTest(rule=rule):
+                middleware_settings = make_middleware_settings(rule)
+                # the scalar functions sort the competitor lists in place
+                scalar_prices, scalar_gifts = scalar_catalog_prices(
+                    make_catalog(), middleware_settings
+                )
+                batch_prices, batch_gifts = batch_catalog_prices(
+                    make_catalog(), middleware_settings
+                )
+                self.assertEqual(batch_prices, scalar_prices)
+                self.assertEqual(batch_gifts, scalar_gifts)
+
+    def test_synthetic_catalog(self):
+        self.assert_parity(lambda: build_synthetic_catalog(3000, seed=7))
+
+    def test_edge_cases(self):
+        self.assert_parity(edge_case_catalog)
+
+    def test_edge_case_prices(self):
+        prices, gifts = batch_catalog_prices(
+            edge_case_catalog(),
+            make_middleware_settings(MiddlewareSetting.RULE_CHEAPEST),
+        )
+        margin = Decimal("1.125")
+        surcharge = Decimal("1.10")
+
+        # missing and zero purchase prices are not priced
+        self.assertNotIn(2, prices)
+        self.assertNotIn(3, prices)
+        # valid promotion price; a competitor below it does not lower the price
+        promo_price = Decimal("15.00") * surcharge * margin
+        self.assertEqual(prices[4]["aera"], promo_price)
+        self.assertEqual(prices[4]["wawibox"], promo_price)
+        # otherwise the cheapest competitor is undercut
+        self.assertEqual(prices[7]["aera"], Decimal("40.00") - Decimal("0.05"))
+        # expired by header, expired by own dates, wrong type or zero price
+        for pid in (5, 6, 13):
+            self.assertEqual(
+                prices[pid]["wawibox"], Decimal("20.00") * surcharge * margin
+            )
+        # unknown article group has no surcharge
+        self.assertEqual(prices[12]["aera"], Decimal("5.00") * margin)
+        self.assertEqual(prices[21]["aera"], Decimal("8.00") * margin)
+        self.assertEqual(prices[21]["wawibox"], Decimal("20.00") - Decimal("0.05"))
+
+        self.assertEqual(gifts[7]["gift_promo_code"], "GIFT")
+        self.assertEqual((gifts[7]["paid_qty"], gifts[7]["free_qty"]), (3, 1))
+        # a blocked action code is skipped for the next position
+        self.assertEqual(gifts[9]["gift_promo_code"], "GIFT")
+        for pid in (8, 10, 11, 14):
+            self.assertNotIn(pid, gifts)
+
+    def test_missing_non_gls_price_is_skipped(self):
+        catalog = edge_case_catalog()
+        catalog["non_gls_product_ids"].append(22)
+
+        prices, _ = batch_catalog_prices(
+            catalog, make_middleware_settings(MiddlewareSetting.RULE_AVERAGE)
+        )
+
+        self.assertNotIn(22, prices)
+        self.assertIn(20, prices)
+
+
+class RepriceProductSelectionTests(TestCase):
+    def setUp(self):
+        self.gls = [
+            Product.objects.create(sku=f"LG{n}", gls_article_group_no="001")
+            for n in range(3)
+        ]
+        self.non_gls = Product.objects.create(
+            sku="N1", supplier=Product.SUPPLIER_NON_GLS
+        )
+
+    def test_only_queued_products_are_loaded(self):
+        product_ids = {self.gls[1].pk, self.non_gls.pk}
+
+        with self.assertNumQueries(2):
+            groups = get_product_ids_and_groups(product_ids)
+            non_gls_ids = get_non_gls_product_ids(product_ids)
+
+        self.assertEqual(groups, [(self.gls[1].pk, "001")])
+        self.assertEqual(non_gls_ids, [self.non_gls.pk])
+
+    def test_all_products_without_a_queue(self):
+        self.assertEqual(len(get_product_ids_and_groups()), 3)
+        self.assertEqual(get_non_gls_product_ids(), [self.non_gls.pk])
+        self.assertEqual(get_product_ids_and_groups(set()), [])
+
+
+def create_export_catalog(first, size):
+    """
+    Create `size` exportable products, every fifth one non-GLS, with GTINs,
+    stock, master data, purchase and promotion prices, gift prices and a
+    listing on each marketplace.
+    """
+    today = date.today()
+    products = Product.objects.bulk_create(
+        Product(
+            sku=f"SKU{n}",
+            name=f"Product {n}",
+            supplier=Product.SUPPLIER_NON_GLS if n % 5 == 0 else Product.SUPPLIER_GLS,
+            supplier_article_no=f"A{n}",
+            manufacturer_id=f"M{n % 3}",
+            manufacturer="Non-GLS manufacturer",
+            manufacturer_article_no=f"MPN{n}",
+            aera_sales_price=Decimal("12.50"),
+            wawibox_sales_price=Decimal("13.50"),
+            aera_gift_sales_price=Decimal("11.00"),
+            wawibox_gift_sales_price=Decimal("12.00"),
+            gift_min_qty=4,
+            gift_paid_qty=3,
+            gift_free_qty=1,
+            gift_valid_from=today,
+            gift_valid_until=today + timedelta(days=30),
+        )
+        for n in range(first, first + size)
+    )
+    gls_products = [p for p in products if p.supplier == Product.SUPPLIER_GLS]
+    non_gls_products = [p for p in products if p.supplier != Product.SUPPLIER_GLS]
+
+    GLSSupplier.objects.bulk_create(
+        GLSSupplier(supplier_no=f"M{n}", name1=f"Manufacturer {n}")
+        for n in range(3)
+        if not GLSSupplier.objects.filter(supplier_no=f"M{n}").exists()
+    )
+    GLSMasterData.objects.bulk_create(
+        GLSMasterData(
+            product=p,
+            article_no=p.supplier_article_no,
+            vat_rate=Decimal("19"),
+            length=Decimal("10"),
+            width=Decimal("20"),
+            height=Decimal("30"),
+            weight=Decimal("40"),
+        )
+        for p in gls_products
+    )
+    GLSStockLevel.objects.bulk_create(
+        GLSStockLevel(article_no=p.supplier_article_no, inventory=Decimal("5"))
+        for p in gls_products
+    )
+    GLSPriceList.objects.bulk_create(
+        GLSPriceList(
+            product=p, article_no=p.supplier_article_no, purchase_price=Decimal("10")
+        )
+        for p in gls_products
+    )
+    GLSPromotionPrice.objects.bulk_create(
+        GLSPromotionPrice(
+            product=p,
+            action_code="PRICE",
+            article_no=p.supplier_article_no,
+            promotional_purchase_price=Decimal("8"),
+            valid_from=today,
+            valid_to=today + timedelta(days=30),
+        )
+        for p in gls_products
+    )
+    AdditionalMasterData.objects.bulk_create(
+        AdditionalMasterData(
+            product=p,
+            article_no=p.supplier_article_no,
+            manufacturer_article_no=p.manufacturer_article_no,
+            manufacturer=p.manufacturer,
+            stock=Decimal("2"),
+        )
+        for p in non_gls_products
+    )
+    ProductGtin.objects.bulk_create(
+        ProductGtin(
+            article_no=p.supplier_article_no,
+            sku=p.sku,
+            gtin=f"4000000{p.pk:06d}",
+            supplier=p.supplier,
+        )
+        for p in products
+    )
+    for model in (AeraProduct, WawiboxProduct):
+        model.objects.bulk_create(model(product=p, sku=p.sku) for p in products)
+    ShopwareProduct.objects.bulk_create(
+        ShopwareProduct(product=p, sku=p.sku, shopware_id=f"sw{p.pk}") for p in products
+    )
+
+
+class ExportQueryCountTests(TestCase):
+    """The product exports must not issue queries per product."""
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            result = func()
+        return result, len(context.captured_queries)
+
+    def test_snapshot_query_count_does_not_grow_with_catalog(self):
+        create_export_catalog(0, 10)
+        small, small_queries = self.count_queries(lambda: list(load_product_snapshot()))
+        create_export_catalog(10, 40)
+        large, large_queries = self.count_queries(lambda: list(load_product_snapshot()))
+
+        self.assertEqual((len(small), len(large)), (10, 50))
+        self.assertEqual(large_queries, small_queries)
+
+        pk = Product.objects.get(sku="SKU1").pk
+        gls_row = next(row for row in large if row.sku == "SKU1")
+        self.assertEqual(gls_row.gtin, f"4000000{pk:06d}")
+        self.assertEqual(gls_row.manufacturer, "Manufacturer 1")
+        self.assertEqual((gls_row.stock, gls_row.vat_rate), (5.0, Decimal("19")))
+        self.assertEqual(gls_row.shopware_id, f"sw{pk}")
+        self.assertEqual(gls_row.weight, Decimal("40"))
+        non_gls_row = next(row for row in large if row.sku == "SKU5")
+        self.assertEqual(non_gls_row.manufacturer, "Non-GLS manufacturer")
+        self.assertEqual((non_gls_row.stock, non_gls_row.vat_rate), (2.0, None))
+
+    def test_build_exports_query_count_does_not_grow_with_catalog(self):
+        create_export_catalog(0, 10)
+        ok, small_queries = self.count_queries(build_product_exports)
+        self.assertTrue(ok)
+
+        create_export_catalog(10, 40)
+        ok, large_queries = self.count_queries(build_product_exports)
+        self.assertTrue(ok)
+
+        self.assertEqual(large_queries, small_queries)
+
+
+class ExportTransactionTests(TransactionTestCase):
+    """Building the export rows must not hold the database write lock."""
+
+    def test_rows_are_built_outside_a_transaction(self):
+        create_export_catalog(0, 10)
+        atomic_while_building = []
+        original = exports.load_product_columns
+
+        def load_product_columns(*args, **kwargs):
+            atomic_while_building.append(connection.in_atomic_block)
+            return original(*args, **kwargs)
+
+        with mock.patch("apps.core.exports.load_product_columns", load_product_columns):
+            self.assertTrue(build_product_exports())
+
+        self.assertEqual(atomic_while_building, [False])
+        self.assertEqual(AeraExport.objects.count(), 10)
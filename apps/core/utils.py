@@ -10,6 +10,7 @@ from .models import (
     BlockedProduct,
     LogEntry,
     ProductGtin,
+    RepricingQueue,
 )
 
 FILE_ADDITIONAL_PRODUCTS = "additional_products"
@@ -326,6 +327,13 @@ def upload_additional_products_to_db(rows, batch_size=500):
                     "Please clean up your data and try again."
                 )
 
+    # calculation prices feed the pricing engine
+    RepricingQueue.mark(
+        f"{obj.manufacturer[:2].upper()}{obj.article_no}"
+        for obj in instances
+        if obj.manufacturer and obj.article_no
+    )
+
     return {
         "created": created_count,
         "updated": updated_count,
@@ -1,6 +1,10 @@
+import multiprocessing
 import os
 import sys
+import threading
 import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
 from urllib.parse import parse_qs, urlparse
@@ -8,11 +12,11 @@ from urllib.parse import parse_qs, urlparse
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
-from django.http import FileResponse, Http404, HttpResponse
+from django.db import connections
 from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.utils import timezone
-from django.views.decorators.http import require_GET, require_POST
+from django.views.decorators.http import require_POST, require_safe
 
 from utils import (
     delete_old_files,
@@ -20,6 +24,11 @@ from utils import (
     send_email,
 )
 
+from .downloads import (
+    resolve_export_file,
+    serve_export_file,
+    write_gzip_sibling,
+)
 from .exports import build_product_exports
 from .models import (
     AdditionalMasterData,
@@ -27,6 +36,7 @@ from .models import (
     ExportTask,
     LogEntry,
     Product,
+    RepricingQueue,
 )
 from .pricing import run_pricing_engine
 from .utils import (
@@ -385,6 +395,7 @@ def create_missing_products():
 
         if to_create:
             Product.objects.bulk_create(to_create, batch_size=5000)
+            RepricingQueue.mark(p.sku for p in to_create)
             to_create = []
 
         # ---------------------------------------------------------
@@ -549,75 +560,163 @@ def export_amazon_data(request):
     return redirect(changelist_url)
 
 
-def process_pending_exports():
+@contextmanager
+def hold_export_lease(task):
+    """Renew the lease of task in a background thread while the block runs."""
+    stop = threading.Event()
 
-    pending_tasks = ExportTask.objects.filter(
-        status__in=[
-            ExportTask.STATUS_PENDING,
-            ExportTask.STATUS_FAILED,
-        ]
-    )
+    def renew():
+        try:
+            while not stop.wait(ExportTask.LEASE_RENEWAL.total_seconds()):
+                try:
+                    if not task.renew_lease():
+                        # another worker took the task over, stop renewing
+                        break
+                except Exception:
+                    CoreLog.warning(
+                        f"Export lease renewal failed: {traceback.format_exc()}"
+                    )
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
 
-    for task in pending_tasks:
-        task.status = ExportTask.STATUS_PROCESSING
-        task.save(update_fields=["status"])
 
-        try:
-            response = export_model_data(task.config)
-            file_ext = ".csv" if task.file_type == "csv" else ".xlsx"
-            display_name = task.config.get("display_name")
-            filename = f"{display_name}_{timezone.now().strftime('%d%m%Y')}{file_ext}"
-
-            export_dir = Path(settings.MEDIA_ROOT) / "exports"
-            export_dir.mkdir(parents=True, exist_ok=True)
-
-            file_path = export_dir / filename
-            with open(file_path, "wb") as f:
-                if isinstance(response, HttpResponse):
-                    f.write(response.content)
-                else:
-                    f.write(response)
-
-            download_url = get_download_url(file_path)
-            task.download_url = download_url
-            task.status = ExportTask.STATUS_DONE
-            task.error_message = None
-            task.completed_at = timezone.now()
-            task.save(
-                update_fields=[
-                    "download_url",
-                    "status",
-                    "error_message",
-                    "completed_at",
-                ]
+def run_export_task(task_id):
+    """
+    Write one leased export task to disk. The lease is renewed while the
+    export runs and the result is only saved while this worker holds it.
+    """
+    task = ExportTask.objects.get(pk=task_id)
+    leased = task.leased()
+
+    try:
+        file_ext = ".csv" if task.file_type == "csv" else ".xlsx"
+        if task.file_type == "csv" and task.config.get("compress"):
+            file_ext += ".gz"
+        display_name = task.config.get("display_name")
+        filename = f"{display_name}_{timezone.now().strftime('%d%m%Y')}{file_ext}"
+
+        export_dir = Path(settings.MEDIA_ROOT) / "exports"
+        export_dir.mkdir(parents=True, exist_ok=True)
+
+        file_path = export_dir / filename
+        with hold_export_lease(task):
+            stats = export_model_data(task.config, file_path)
+            if file_ext == ".csv":
+                write_gzip_sibling(file_path)
+        CoreLog.info(
+            f"Export {filename} written: {stats['rows']} rows in {stats['seconds']}s "
+            f"({stats['rows_per_sec']} rows/s, peak RSS {stats['peak_rss_mb']} MB)"
+        )
+
+        saved = leased.update(
+            download_url=get_download_url(file_path),
+            status=ExportTask.STATUS_DONE,
+            error_message=None,
+            completed_at=timezone.now(),
+            lease_expires_at=None,
+            next_attempt_at=None,
+        )
+    except Exception:
+        saved = leased.update(
+            status=ExportTask.STATUS_FAILED,
+            error_message=str(traceback.format_exc()),
+            lease_expires_at=None,
+            next_attempt_at=timezone.now() + task.retry_delay(),
+        )
+
+    return task.pk, bool(saved)
+
+
+def notify_export_result(task_id):
+    task = ExportTask.objects.select_related("user").get(pk=task_id)
+
+    if task.status == ExportTask.STATUS_DONE:
+        if task.user and task.user.email:
+            subject = f"Your {task.file_type} export is ready"
+            context = {
+                "task": task,
+                "download_url": task.download_url,
+            }
+            send_email(
+                subject,
+                context,
+                email_template="email/file_export.html",
+                recipient_email=task.user.email,
             )
+    elif task.attempts >= ExportTask.MAX_ATTEMPTS:
+        CoreLog.error(
+            f"Export {task.name} (task {task.pk}) failed after {task.attempts} attempts: "
+            f"{task.error_message}"
+        )
+    else:
+        CoreLog.warning(
+            f"Export {task.name} (task {task.pk}) failed on attempt {task.attempts}, "
+            f"retrying after {task.next_attempt_at:%d.%m.%Y %H:%M}"
+        )
+
+
+def run_export_worker():
+    """
+    Claim and run export tasks one at a time until none is left. A task is
+    leased right before it starts, never while it waits for a free worker.
+    """
+    try:
+        while True:
+            task_ids = ExportTask.claim(1)
+            if not task_ids:
+                return
+            task_id, saved = run_export_task(task_ids[0])
+            if saved:
+                try:
+                    notify_export_result(task_id)
+                except Exception:
+                    CoreLog.warning(
+                        f"Export {task_id} result notification failed: "
+                        f"{traceback.format_exc()}"
+                    )
+    finally:
+        connections.close_all()
 
-            if task.user and task.user.email:
-                subject = f"Your {task.file_type} export is ready"
-                template = "email/file_export.html"
-                context = {
-                    "task": task,
-                    "download_url": task.download_url,
-                }
-                send_email(subject, template, context, recipient_email=task.user.email)
 
-        except Exception:
-            task.status = ExportTask.STATUS_FAILED
-            task.error_message = str(traceback.format_exc())
-            task.save(update_fields=["status", "error_message"])
+def process_pending_exports():
+    now = timezone.now()
+    ExportTask.fail_expired(now)
+    pending = ExportTask.objects.filter(ExportTask.claimable(now)).count()
+    workers = min(settings.EXPORT_WORKERS, pending)
+    if not workers:
+        return True
+
+    # forked workers must not share the parent's database connection
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("fork"),
+    ) as executor:
+        futures = [executor.submit(run_export_worker) for _ in range(workers)]
+
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                # a task it held keeps its lease until that expires, then
+                # the next run picks it up again
+                CoreLog.warning(f"Export worker crashed: {traceback.format_exc()}")
 
     return True
 
 
-@require_GET
+@require_safe
 def download_file(request):
-    file_path = request.GET.get("file_path")
-    if not file_path or not os.path.exists(file_path):
-        raise Http404("File not found")
-
-    return FileResponse(
-        open(file_path, "rb"), as_attachment=True, filename=os.path.basename(file_path)
-    )
+    file_path = resolve_export_file(request.GET.get("file_path"))
+    return serve_export_file(request, file_path)
 
 
 def get_download_url(file_path):
@@ -643,8 +742,9 @@ def cleanup_exports(days):
                     relative_path = file_param[0]
                     full_path = os.path.join(settings.MEDIA_ROOT, relative_path)
 
-                    if os.path.isfile(full_path):
-                        os.remove(full_path)
+                    for path in (full_path, f"{full_path}.gz"):
+                        if os.path.isfile(path):
+                            os.remove(path)
 
             except Exception:
                 pass
@@ -16,6 +16,7 @@ class DentalheldExportAdmin(admin.ModelAdmin):
         "tier_qty_1",
         "tier_price_1",
         "last_pushed_to_dentalheld",
+        "changed_since_last_push",
     )
     list_display_links = list_display
     search_fields = ("article_id", "name")
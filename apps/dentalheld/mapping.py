@@ -2,7 +2,7 @@ from django.conf import settings
 
 
 field_map_update_csv = [
-    ("sku", "artikel_id"),
+    ("article_id", "artikel_id"),
     ("ean", "artikel_ean"),
     ("name", "artikel_name"),
     ("net_price", "artikel_netto"),
@@ -195,6 +195,8 @@ class DentalheldExport(Model):
     comparable_product_urls = TextField(null=True, blank=True)
 
     updated_at = DateTimeField(auto_now=True)
+    row_hash = CharField(max_length=255, editable=False, null=True, blank=True)
+    changed_since_last_push = BooleanField(default=True, db_index=True)
     last_pushed_to_dentalheld = DateTimeField(null=True, blank=True)
 
     def __str__(self):
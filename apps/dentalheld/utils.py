@@ -1,8 +1,10 @@
 from apps.core.models import LogEntry
 from .mapping import field_map_update_csv
+import io
 import os
 import csv
 from django.conf import settings
+from utils import iter_encoded_chunks
 
 
 class DentalheldLog:
@@ -25,32 +27,47 @@ class DentalheldLog:
         )
 
 
-def export_dentalheld_products_to_csv(export_products):
+def iter_dentalheld_csv_lines(export_products):
+    """Yield the update.csv header and one formatted line per export row."""
     model_fields = [m for m, _ in field_map_update_csv]
     headers = [c for _, c in field_map_update_csv]
-    file_name = settings.DENTALHELD_FILE_UPDATE_CSV
-    DENTALHELD_UPLOAD_PATH = settings.DENTALHELD_UPLOAD_PATH
 
-    os.makedirs(DENTALHELD_UPLOAD_PATH, exist_ok=True)
+    line = io.StringIO()
+    writer = csv.writer(
+        line,
+        delimiter=";",
+        quotechar='"',
+        quoting=csv.QUOTE_ALL,
+    )
 
-    csv_file_path = os.path.join(DENTALHELD_UPLOAD_PATH, file_name)
+    def format_line(values):
+        writer.writerow(values)
+        text = line.getvalue()
+        line.seek(0)
+        line.truncate()
+        return text
 
-    with open(csv_file_path, "w", encoding="utf-8", newline="") as f:
-        writer = csv.writer(
-            f,
-            delimiter=";",
-            quotechar='"',
-            quoting=csv.QUOTE_ALL,
-        )
+    yield format_line(headers)
+    for values in export_products.values_list(*model_fields).iterator(chunk_size=2000):
+        yield format_line(["" if value is None else value for value in values])
+
+
+def iter_dentalheld_csv_chunks(export_products):
+    return iter_encoded_chunks(iter_dentalheld_csv_lines(export_products), "utf-8")
 
-        writer.writerow(headers)
 
-        for obj in export_products:
-            writer.writerow(
-                [
-                    getattr(obj, field) if getattr(obj, field) is not None else ""
-                    for field in model_fields
-                ]
-            )
+def get_dentalheld_csv_path():
+    os.makedirs(settings.DENTALHELD_UPLOAD_PATH, exist_ok=True)
+    return os.path.join(
+        settings.DENTALHELD_UPLOAD_PATH, settings.DENTALHELD_FILE_UPDATE_CSV
+    )
+
+
+def export_dentalheld_products_to_csv(export_products):
+    csv_file_path = get_dentalheld_csv_path()
+
+    with open(csv_file_path, "wb") as f:
+        for chunk in iter_dentalheld_csv_chunks(export_products):
+            f.write(chunk)
 
     return csv_file_path
@@ -5,6 +5,7 @@ from datetime import datetime
 from django.utils import timezone
 import time
 import traceback
+from functools import partial
 from django.http import JsonResponse
 from .models import (
     DentalheldOrder,
@@ -13,14 +14,15 @@ from .models import (
 )
 from .utils import (
     DentalheldLog,
-    export_dentalheld_products_to_csv,
+    get_dentalheld_csv_path,
+    iter_dentalheld_csv_chunks,
 )
 from utils import (
     make_time_zone_aware,
     ftp_connection,
+    stream_upload,
 )
 
-
 # Constants
 DENTALHELD_BASE_URL = settings.DENTALHELD_BASE_URL
 DENTALHELD_API_KEY = settings.DENTALHELD_API_KEY
@@ -39,22 +41,33 @@ def push_products_to_dentalheld():
         DentalheldLog.warning("No Dentalheld export rows found, skipping upload")
         return
 
-    update_file = export_dentalheld_products_to_csv(exports)
-
-    with ftp_connection(
-        DENTALHELD_FTP_HOST,
-        DENTALHELD_FTP_USER,
-        DENTALHELD_FTP_PASSWORD,
-        port=DENTALHELD_FTP_PORT,
-    ) as ftp:
-        try:
-            ftp.upload_file(update_file)
-            DentalheldExport.objects.all().update(
-                last_pushed_to_dentalheld=timezone.now()
-            )
-            DentalheldLog.info("Product data updated successfully")
-        except Exception:
-            DentalheldLog.error(f"Product data update failed: {traceback.format_exc()}")
+    upload = stream_upload(
+        partial(
+            ftp_connection,
+            DENTALHELD_FTP_HOST,
+            DENTALHELD_FTP_USER,
+            DENTALHELD_FTP_PASSWORD,
+            port=DENTALHELD_FTP_PORT,
+        ),
+        iter_dentalheld_csv_chunks(exports),
+        settings.DENTALHELD_FILE_UPDATE_CSV,
+        get_dentalheld_csv_path(),
+    )
+
+    if upload["uploaded"]:
+        # the upload is a full file, every row is in sync afterwards
+        DentalheldExport.objects.all().update(
+            last_pushed_to_dentalheld=timezone.now(),
+            changed_since_last_push=False,
+        )
+        DentalheldLog.info(
+            f"Product data updated successfully ({upload['bytes']} bytes)"
+        )
+    else:
+        DentalheldLog.error(
+            f"Product data update failed, file kept at {upload['local_path']}: "
+            f"{upload['error']}"
+        )
 
 
 def fetch_orders():
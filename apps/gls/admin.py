@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import *
+from apps.core.models import RepricingQueue
 
 
 @admin.register(GLSMasterData)
@@ -659,6 +660,10 @@ class GLSHandlingSurchargeAdmin(admin.ModelAdmin):
 
     display_value.short_description = "Handling Fee"
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        RepricingQueue.mark_all()
+
     def has_add_permission(self, r, o=None):
         return False
 
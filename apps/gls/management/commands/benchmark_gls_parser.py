@@ -0,0 +1,147 @@
+import os
+import tempfile
+import time
+from datetime import datetime
+from django.core.management.base import BaseCommand
+from apps.gls.mapping import field_map_as_316
+from utils import compile_field_map, parse_ftp_row, read_ftp_file_rows
+
+
+def legacy_parse_row(values, field_map):
+    # row conversion as it was done before the field maps were precompiled
+    fields = field_map["fields"]
+    boolean_fields = field_map["boolean_fields"]
+    date_fields = field_map["date_fields"]
+    code_fields = field_map.get("code_fields", [])
+    data = {}
+
+    for i, field_name in enumerate(fields):
+        if i >= len(values):
+            continue
+
+        value = values[i].strip()
+
+        if field_name in boolean_fields:
+            value = str(value) in ["j", "J", "y", "Y", "1", "true", "TRUE"]
+
+        elif field_name in date_fields:
+            if value:
+                date_parsed = False
+                for fmt in ("%d.%m.%y", "%d.%m.%Y"):
+                    try:
+                        value = datetime.strptime(value, fmt)
+                        date_parsed = True
+                        break
+                    except ValueError:
+                        continue
+                if not date_parsed:
+                    raise ValueError(
+                        f"Invalid date format for field '{field_name}': {value}"
+                    )
+            else:
+                value = None
+
+        elif field_name in code_fields:
+            value = value.upper()
+
+        if value == "":
+            value = None
+        data[field_name] = value
+    return data
+
+
+def write_synthetic_316_file(file_path, rows):
+    with open(file_path, "w", encoding="cp850") as f:
+        for i in range(rows):
+            values = [
+                f"{i:08d}",
+                f"Artikel {i} Größe M",
+                f"{i % 97:03d}",
+                "A",
+                f"{i % 500:05d}",
+                f"HS-{i}",
+                "1,00",
+                "",
+                "30049000",
+                "DE",
+                "N" if i % 50 else "J",
+                "",
+                "19,00",
+                f"{i % 28 + 1:02d}.{i % 12 + 1:02d}.{'23' if i % 2 else '2023'}",
+                "",
+                "",
+                "",
+                "3,0",
+                "J",
+                "",
+                "ST",
+                "",
+                "1,00",
+                "1,5",
+                "2,5",
+                "3,5",
+                "0,250",
+                "N",
+                "N" if i % 7 else "J",
+                "J",
+                "N",
+                "N",
+                "W1",
+                f"PG{i % 40}",
+                "J",
+                "",
+                "",
+                "",
+            ]
+            f.write("^#!".join(values) + "\n")
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the legacy and precompiled GLS row converters on a synthetic .316 file"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=500000)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        fields = field_map_as_316["fields"]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "benchmark.316")
+            write_synthetic_316_file(file_path, rows)
+
+            lines = [
+                values
+                for _, values in read_ftp_file_rows(
+                    file_path, "^#!", "cp850", False, False
+                )
+            ]
+
+            started = time.perf_counter()
+            legacy = [legacy_parse_row(values, field_map_as_316) for values in lines]
+            legacy_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            converters = compile_field_map(field_map_as_316)
+            compiled = [parse_ftp_row(values, converters) for values in lines]
+            compiled_seconds = time.perf_counter() - started
+
+        mismatches = sum(
+            1 for old, new in zip(legacy, compiled) if old != dict(zip(fields, new))
+        )
+
+        self.stdout.write(f"rows: {rows}")
+        self.stdout.write(
+            f"legacy: {legacy_seconds:.2f}s ({rows / legacy_seconds:.0f} rows/s)"
+        )
+        self.stdout.write(
+            f"compiled: {compiled_seconds:.2f}s ({rows / compiled_seconds:.0f} rows/s)"
+        )
+        self.stdout.write(f"speedup: {legacy_seconds / compiled_seconds:.1f}x")
+
+        if mismatches:
+            self.stdout.write(self.style.ERROR(f"{mismatches} rows differ"))
+        else:
+            self.stdout.write(self.style.SUCCESS("converted rows are identical"))
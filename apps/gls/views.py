@@ -1,4 +1,6 @@
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
@@ -10,6 +12,8 @@ import traceback
 from utils import (
     ftp_connection,
     parse_ftp_file_to_model,
+    stage_ftp_file,
+    format_ingest_stats,
     send_email,
     validate_field_maps,
     move_all_files,
@@ -22,12 +26,14 @@ from .utils import (
     FILE_PRODUCT_GROUP,
 )
 from django.http import JsonResponse, HttpResponse
-from apps.core.models import ExportTask
+from apps.core.models import ExportTask, RepricingQueue
 from .mapping import DATA_FIELD_MAPS
 from .models import (
     GLSOrderConfirmation,
     GLSOrderStatus,
     GLSOrderHeader,
+    GLSPromotionPosition,
+    GLSPromotionPrice,
     SHIPPING_SERVICES,
 )
 
@@ -143,6 +149,65 @@ def upload_gls_orders(order_header):
     return all_ok
 
 
+GLS_INGEST_OPTIONS = {
+    # full daily snapshots, rows missing from the file are removed
+    ".316": {"diff": True},
+    ".317": {"diff": True},
+    ".315": {"use_hash": True},
+    ".320": {"use_hash": True},
+    ".501": {"use_hash": True},
+}
+
+# files feeding the pricing engine, keyed by article_no
+GLS_REPRICING_EXTS = {settings.GLS_FILE_AS316, settings.GLS_FILE_PL317}
+# promotion positions and prices name their article, reprice just those
+GLS_PROMOTION_ARTICLE_EXTS = {settings.GLS_FILE_502, settings.GLS_FILE_503}
+# promotion headers reach their articles through the action code
+GLS_PROMOTION_HEADER_EXTS = {settings.GLS_FILE_501}
+
+
+def get_promotion_article_nos(action_codes):
+    """Article numbers of the promotion positions and prices of action_codes."""
+    action_codes = list(action_codes)
+    article_nos = set()
+    for i in range(0, len(action_codes), RepricingQueue.BATCH):
+        batch = action_codes[i : i + RepricingQueue.BATCH]
+        for Model in (GLSPromotionPosition, GLSPromotionPrice):
+            article_nos.update(
+                Model.objects.filter(action_code__in=batch).values_list(
+                    "article_no", flat=True
+                )
+            )
+    return article_nos
+
+
+def stage_gls_files(filenames, staging_dir):
+    # files are parsed in parallel, writing to the db stays in the calling process
+    staged = {}
+    if not filenames:
+        return staged
+
+    workers = max(1, min(settings.GLS_INGEST_WORKERS, len(filenames)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(
+                stage_ftp_file,
+                os.path.join(GLS_DOWNLOAD_PATH, filename),
+                DATA_FIELD_MAPS[os.path.splitext(filename)[1]],
+                os.path.join(staging_dir, f"{i}.staged"),
+            ): filename
+            for i, filename in enumerate(filenames)
+        }
+        for future in as_completed(futures):
+            filename = futures[future]
+            try:
+                staged_path, _ = future.result()
+                staged[filename] = (staged_path, None)
+            except Exception as e:
+                staged[filename] = (None, f"Failed to parse file {filename}: {e}")
+    return staged
+
+
 def parse_gls_file_data():
     status, errors = validate_field_maps(DATA_FIELD_MAPS)
     if errors:
@@ -164,26 +229,54 @@ def parse_gls_file_data():
             key=lambda f: os.path.getmtime(os.path.join(GLS_DOWNLOAD_PATH, f)),
         )
 
-        for filename in filenames:
-            try:
-                file_path = os.path.join(GLS_DOWNLOAD_PATH, filename)
+        with tempfile.TemporaryDirectory() as staging_dir:
+            staged = stage_gls_files(filenames, staging_dir)
+
+            # apply in mtime order, later files of a table stay behind a failed one
+            failed_exts = set()
+            for filename in filenames:
                 ext = os.path.splitext(filename)[1]
-                if ext in [".316", ".315", ".317", ".320", ".501"]:
-                    parse_ftp_file_to_model(
-                        file_path, DATA_FIELD_MAPS[ext], use_hash=True
+                if ext in failed_exts:
+                    GlsLog.warning(
+                        f"Skipped file {filename}, an earlier {ext} file failed to import"
                     )
-                else:
-                    parse_ftp_file_to_model(
+                    continue
+                try:
+                    staged_path, error = staged[filename]
+                    if error:
+                        raise RuntimeError(error)
+
+                    file_path = os.path.join(GLS_DOWNLOAD_PATH, filename)
+                    changed_keys = set()
+                    stats = parse_ftp_file_to_model(
                         file_path,
                         DATA_FIELD_MAPS[ext],
+                        staged_path=staged_path,
+                        changed_keys=changed_keys,
+                        changed_field=(
+                            "article_no" if ext in GLS_PROMOTION_ARTICLE_EXTS else None
+                        ),
+                        **GLS_INGEST_OPTIONS.get(ext, {}),
                     )
 
-                GlsLog.info(f"File {filename} updated on db successfully")
-            except Exception:
-                all_ok = False
-                GlsLog.error(
-                    f"Failed to update db from file {filename}: {traceback.format_exc()}"
-                )
+                    if ext in GLS_REPRICING_EXTS | GLS_PROMOTION_ARTICLE_EXTS:
+                        RepricingQueue.mark(f"LG{k}" for k in changed_keys if k)
+                    elif ext in GLS_PROMOTION_HEADER_EXTS and changed_keys:
+                        RepricingQueue.mark(
+                            f"LG{k}"
+                            for k in get_promotion_article_nos(changed_keys)
+                            if k
+                        )
+
+                    GlsLog.info(
+                        f"File {filename} updated on db successfully: {format_ingest_stats(stats)}"
+                    )
+                except Exception:
+                    all_ok = False
+                    failed_exts.add(ext)
+                    GlsLog.error(
+                        f"Failed to update db from file {filename}: {traceback.format_exc()}"
+                    )
 
         if all_ok:
             move_all_files(GLS_DOWNLOAD_PATH, PENDING_DELETION_PATH)
@@ -35,6 +35,7 @@ class ShopwareExportAdmin(admin.ModelAdmin):
         "sales_price",
         "updated_at",
         "last_pushed_to_shopware",
+        "changed_since_last_push",
     )
     list_display_links = ("name", "sku")
     search_fields = ("sku", "name")
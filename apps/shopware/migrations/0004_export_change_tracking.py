@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopware', '0003_shopwareexport_gift_free_qty_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopwareexport',
+            name='changed_since_last_push',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+        migrations.AddField(
+            model_name='shopwareexport',
+            name='row_hash',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='shopwareexport',
+            name='sku',
+            field=models.CharField(blank=True, db_index=True, max_length=25, null=True),
+        ),
+    ]
@@ -59,7 +59,7 @@ class ShopwareExport(Model):
     shopware_id = CharField(
         max_length=200, unique=True, null=True, blank=True, db_index=True
     )
-    sku = CharField(max_length=25, blank=True, null=True)
+    sku = CharField(max_length=25, blank=True, null=True, db_index=True)
     name = CharField(max_length=255, blank=True, null=True)
     description = TextField(null=True, blank=True)
     sales_price = DecimalField(max_digits=14, decimal_places=4)
@@ -84,6 +84,8 @@ class ShopwareExport(Model):
     stock = DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
     tax_rate = DecimalField(max_digits=14, decimal_places=4, null=True, blank=True)
     updated_at = DateTimeField(auto_now=True)
+    row_hash = CharField(max_length=255, editable=False, null=True, blank=True)
+    changed_since_last_push = BooleanField(default=True, db_index=True)
     last_pushed_to_shopware = DateTimeField(null=True, blank=True)
 
     def __str__(self):
@@ -20,7 +20,6 @@ from utils import (
     clean_payload,
 )
 
-
 # Constants
 SHOPWARE_BASE_URL = settings.SHOPWARE_BASE_URL
 SHOPWARE_ACCESS_ID = settings.SHOPWARE_ACCESS_ID
@@ -164,7 +163,7 @@ def push_products_to_shopware(sku=None):
         product_exports = (
             ShopwareExport.objects.filter(sku=sku)
             if sku
-            else ShopwareExport.objects.all()
+            else ShopwareExport.objects.filter(changed_since_last_push=True)
         )
         for p in product_exports.iterator(chunk_size=BATCH_SIZE):
             if not p.shopware_id or not p.sales_price:
@@ -211,6 +210,7 @@ def push_products_to_shopware(sku=None):
             _upsert_product_batch(batch_payload, batch_ids)
             total_synced += len(batch_payload)
 
+        # promotions are rebuilt from all offers, they are not pushed as a delta
         push_special_offers_to_shopware(sku=sku)
         ShopwareLog.info(
             f"Product sync completed successfully. Total products synced:{total_synced}"
@@ -247,7 +247,7 @@ def _upsert_product_batch(payload, ids):
     response.raise_for_status()
 
     ShopwareExport.objects.filter(shopware_id__in=ids).update(
-        last_pushed_to_shopware=timezone.now()
+        last_pushed_to_shopware=timezone.now(), changed_since_last_push=False
     )
 
 
@@ -157,6 +157,7 @@ class WawiboxExportAdmin(admin.ModelAdmin):
         "sales_price",
         "updated_at",
         "last_pushed_to_wawibox",
+        "changed_since_last_push",
     )
     search_fields = (
         "name",
@@ -0,0 +1,145 @@
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import date
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.wawibox.mapping import field_map_wawibox_file_upload
+from apps.wawibox.models import WawiboxExport
+from apps.wawibox.utils import write_wawibox_product_csv
+
+
+def legacy_format_value(value, ftype):
+    # cell formatting as it was done before the converters were precompiled
+    if value in (None, ""):
+        return ""
+
+    if ftype == "str":
+        return str(value).strip()
+
+    if ftype == "bool_01":
+        return "1" if value else "0"
+
+    if ftype == "int":
+        return str(int(value))
+
+    if ftype == "int_012":
+        v = int(value)
+        if v not in (0, 1, 2):
+            raise ValueError("MwSt must be 0, 1, or 2")
+        return str(v)
+
+    if ftype == "decimal":
+        return f"{float(value):.2f}"
+
+    if ftype == "date_iso":
+        return value.strftime("%Y-%m-%d")
+
+    return str(value)
+
+
+def legacy_write_csv(csv_path, delimiter=";"):
+    product_list = []
+
+    product_data_fields = field_map_wawibox_file_upload["fields"]
+    for product_data in WawiboxExport.objects.order_by("pk").iterator():
+        product_instance_values = [
+            legacy_format_value(getattr(product_data, field_name), field_type)
+            for field_name, field_type in product_data_fields
+        ]
+        product_list.append(delimiter.join(map(str, product_instance_values)))
+
+    final_product_data = "\r\n".join(product_list)
+
+    with open(csv_path, "w", encoding="cp850") as f:
+        f.write(final_product_data)
+
+
+def create_synthetic_rows(rows):
+    WawiboxExport.objects.bulk_create(
+        (
+            WawiboxExport(
+                manufacturer_article_no=f"MAN-{i}",
+                manufacturer_name=f"Hersteller {i % 300}",
+                private_label=i % 9 == 0,
+                internal_number=f"BENCH{i:08d}",
+                name=f"Artikel {i} Größe M ",
+                description=f"Beschreibung für Artikel {i}; Menge {i % 50}",
+                vat_category=i % 3,
+                max_order_quantity=i % 1000 or None,
+                image1_url=f"https://example.com/img/{i}.jpg",
+                returnable=i % 2 == 0,
+                is_available=i % 5 != 0,
+                delivery_time=3 if i % 4 else 14,
+                order_number=f"BENCH{i:08d}",
+                valid_from=date(2025, 1, i % 28 + 1) if i % 3 else None,
+                min_order_quantity=1,
+                sales_price=Decimal(i % 10000) / 100 + Decimal("0.0049"),
+                discountable=i % 2 == 1,
+                order_number_2=f"BENCH{i:08d}-10" if i % 10 == 0 else None,
+                min_order_quantity_2=10 if i % 10 == 0 else None,
+                price_2=Decimal(i % 10000) / 110 if i % 10 == 0 else None,
+            )
+            for i in range(rows)
+        ),
+        batch_size=5000,
+    )
+
+
+def measure(writer, csv_path):
+    started = time.perf_counter()
+    writer(csv_path)
+    seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    writer(csv_path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 1024 / 1024
+
+
+class Command(BaseCommand):
+    help = "Compare the legacy and streaming Wawibox CSV writers on synthetic rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+
+        with tempfile.TemporaryDirectory() as tmp_dir, transaction.atomic():
+            create_synthetic_rows(rows)
+            total = WawiboxExport.objects.count()
+
+            legacy_path = os.path.join(tmp_dir, "legacy.csv")
+            streaming_path = os.path.join(tmp_dir, "streaming.csv")
+            legacy_seconds, legacy_mb = measure(legacy_write_csv, legacy_path)
+            streaming_seconds, streaming_mb = measure(
+                write_wawibox_product_csv, streaming_path
+            )
+
+            with open(legacy_path, "rb") as f:
+                legacy_bytes = f.read()
+            with open(streaming_path, "rb") as f:
+                identical = f.read() == legacy_bytes
+
+            # keep the synthetic rows out of the database
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"rows: {total} ({len(legacy_bytes) / 1024 / 1024:.1f} MB)")
+        self.stdout.write(
+            f"legacy: {legacy_seconds:.2f}s ({total / legacy_seconds:.0f} rows/s), "
+            f"peak {legacy_mb:.1f} MB"
+        )
+        self.stdout.write(
+            f"streaming: {streaming_seconds:.2f}s ({total / streaming_seconds:.0f} rows/s), "
+            f"peak {streaming_mb:.1f} MB"
+        )
+        self.stdout.write(f"speedup: {legacy_seconds / streaming_seconds:.1f}x")
+
+        if identical:
+            self.stdout.write(self.style.SUCCESS("written files are identical"))
+        else:
+            self.stdout.write(self.style.ERROR("written files differ"))
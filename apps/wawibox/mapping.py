@@ -52,7 +52,7 @@ field_map_wawibox_file_upload = {
         ("valid_from", "date_iso"),
         ("valid_until", "date_iso"),
         ("min_order_quantity", "int"),
-        ("price", "decimal"),
+        ("sales_price", "decimal"),
         ("discountable", "bool_01"),
         ("order_number_2", "str"),
         ("min_order_quantity_2", "int"),
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 13:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wawibox', '0013_alter_wawiboxexport_delivery_time_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='wawiboxexport',
+            name='changed_since_last_push',
+            field=models.BooleanField(db_index=True, default=True),
+        ),
+        migrations.AddField(
+            model_name='wawiboxexport',
+            name='row_hash',
+            field=models.CharField(blank=True, editable=False, max_length=255, null=True),
+        ),
+    ]
@@ -182,6 +182,8 @@ class WawiboxExport(Model):
         help_text="0 = not eligible for discount, 1 = eligible for discount.",
     )
     updated_at = DateTimeField(auto_now=True)
+    row_hash = CharField(max_length=255, editable=False, null=True, blank=True)
+    changed_since_last_push = BooleanField(default=True, db_index=True)
     last_pushed_to_wawibox = DateTimeField(null=True, blank=True)
 
     def __str__(self):
@@ -5,10 +5,12 @@ import re
 from apps.wawibox.mapping import field_map_wawibox_file_upload
 from django.conf import settings
 from .models import WawiboxExport
+from utils import iter_encoded_chunks
 import re
 import datetime
 
 WAWIBOX_UPLOAD_PATH = settings.WAWIBOX_UPLOAD_PATH
+WAWIBOX_PRODUCT_CSV = "wawibox_product_export.csv"
 
 
 class WawiBoxLog:
@@ -31,59 +33,93 @@ class WawiBoxLog:
         )
 
 
-def export_wawibox_product_data_to_csv(delimiter=";"):
-    product_list = []
+def _format_int_012(value):
+    v = int(value)
+    if v not in (0, 1, 2):
+        raise ValueError("MwSt must be 0, 1, or 2")
+    return str(v)
 
-    product_data_fields = field_map_wawibox_file_upload["fields"]
-    for product_data in WawiboxExport.objects.iterator():
-        product_instance_values = [
-            _format_wawibox_value(getattr(product_data, field_name), field_type)
-            for field_name, field_type in product_data_fields
-        ]
-        product_list.append(delimiter.join(map(str, product_instance_values)))
 
-    os.makedirs(WAWIBOX_UPLOAD_PATH, exist_ok=True)
+WAWIBOX_FORMATTERS = {
+    "str": lambda value: str(value).strip(),
+    "bool_01": lambda value: "1" if value else "0",
+    "int": lambda value: str(int(value)),
+    "int_012": _format_int_012,
+    "decimal": lambda value: f"{float(value):.2f}",
+    "date_iso": lambda value: value.strftime("%Y-%m-%d"),
+}
 
-    csv_name = "wawibox_product_export.csv"
-    csv_path = os.path.join(WAWIBOX_UPLOAD_PATH, csv_name)
 
-    final_product_data = "\r\n".join(product_list)
+def compile_wawibox_field_map(field_map):
+    """Return the model field names and one formatter per column."""
+    field_names = [field_name for field_name, _ in field_map["fields"]]
+    formatters = [
+        WAWIBOX_FORMATTERS.get(field_type, str) for _, field_type in field_map["fields"]
+    ]
+    return field_names, formatters
 
-    with open(csv_path, "w", encoding="cp850") as f:
-        f.write(final_product_data)
 
-    return {
-        "csv_path": csv_path,
-        "csv_name": csv_name,
-    }
+def iter_wawibox_lines(queryset, field_map, delimiter=";", chunk_size=2000):
+    field_names, formatters = compile_wawibox_field_map(field_map)
+    columns = list(enumerate(formatters))
 
+    for values in queryset.values_list(*field_names).iterator(chunk_size=chunk_size):
+        yield delimiter.join(
+            [
+                "" if values[i] is None or values[i] == "" else fmt(values[i])
+                for i, fmt in columns
+            ]
+        )
 
-def _format_wawibox_value(value, ftype):
-    if value in (None, ""):
-        return ""
 
-    if ftype == "str":
-        return str(value).strip()
+def iter_wawibox_file_chunks(delimiter=";"):
+    """Yield the product export as cp850 encoded blocks, lines joined by CRLF."""
+    lines = iter_wawibox_lines(
+        WawiboxExport.objects.order_by("pk"),
+        field_map_wawibox_file_upload,
+        delimiter,
+    )
 
-    if ftype == "bool_01":
-        return "1" if value else "0"
+    def pieces():
+        separator = ""
+        for line in lines:
+            yield separator + line
+            separator = "\r\n"
 
-    if ftype == "int":
-        return str(int(value))
+    return iter_encoded_chunks(pieces(), "cp850")
 
-    if ftype == "int_012":
-        v = int(value)
-        if v not in (0, 1, 2):
-            raise ValueError("MwSt must be 0, 1, or 2")
-        return str(v)
 
-    if ftype == "decimal":
-        return f"{float(value):.2f}"
+def write_wawibox_product_csv(csv_path, delimiter=";"):
+    """
+    Stream WawiboxExport rows into a cp850 file. The file is written next to
+    the target and moved into place once complete, so a failing row leaves
+    the previous export untouched.
+    """
+    tmp_path = f"{csv_path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in iter_wawibox_file_chunks(delimiter):
+                f.write(chunk)
+        os.replace(tmp_path, csv_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_wawibox_csv_path():
+    os.makedirs(WAWIBOX_UPLOAD_PATH, exist_ok=True)
+    return os.path.join(WAWIBOX_UPLOAD_PATH, WAWIBOX_PRODUCT_CSV)
+
+
+def export_wawibox_product_data_to_csv(delimiter=";"):
+    csv_path = get_wawibox_csv_path()
 
-    if ftype == "date_iso":
-        return value.strftime("%Y-%m-%d")
+    write_wawibox_product_csv(csv_path, delimiter)
 
-    return str(value)
+    return {
+        "csv_path": csv_path,
+        "csv_name": WAWIBOX_PRODUCT_CSV,
+    }
 
 
 def extract_date_from_wawibox_filename(filename):
@@ -5,6 +5,7 @@ from django.utils import timezone
 from utils import (
     ftps_connection,
     parse_ftp_file_to_model,
+    format_ingest_stats,
     validate_field_maps,
     move_all_files,
 )
@@ -15,7 +16,8 @@ from .utils import (
 )
 from django.http import JsonResponse
 from .mapping import WAWIBOX_DATA_FIELD_MAPS
-from .models import WawiboxExport
+from .models import WawiboxExport, WawiboxCompetitorPrice
+from apps.core.models import RepricingQueue
 
 # Constants
 WAWIBOX_FTP_HOST = settings.WAWIBOX_FTP_HOST
@@ -79,6 +81,21 @@ def download_wawibox_files():
     return is_completed
 
 
+COMPETITOR_PRICE_FIELDS = [
+    f"{name}_{i}" for i in range(1, 7) for name in ("net_top", "vendor_id")
+]
+
+
+def get_competitor_price_snapshot():
+    """Return {sku: (net_top_1, vendor_id_1, ...)} of the current competitor prices."""
+    return {
+        row[0]: row[1:]
+        for row in WawiboxCompetitorPrice.objects.values_list(
+            "sku", *COMPETITOR_PRICE_FIELDS
+        ).iterator(chunk_size=5000)
+    }
+
+
 def parse_wawibox_file_data():
     status, errors = validate_field_maps(WAWIBOX_DATA_FIELD_MAPS)
     if errors:
@@ -104,7 +121,7 @@ def parse_wawibox_file_data():
             try:
                 file_path = os.path.join(WAWIBOX_DOWNLOAD_PATH, filename)
                 if pattern == settings.WAWIBOX_FILE_MARKETPLACE_PREFIX:
-                    parse_ftp_file_to_model(
+                    stats = parse_ftp_file_to_model(
                         file_path,
                         WAWIBOX_DATA_FIELD_MAPS[pattern],
                         delimiter=",",
@@ -113,7 +130,8 @@ def parse_wawibox_file_data():
                         use_csv=True,
                     )
                 else:
-                    parse_ftp_file_to_model(
+                    before = get_competitor_price_snapshot()
+                    stats = parse_ftp_file_to_model(
                         file_path,
                         WAWIBOX_DATA_FIELD_MAPS[pattern],
                         delimiter=";",
@@ -122,8 +140,16 @@ def parse_wawibox_file_data():
                         header_available=True,
                         use_csv=True,
                     )
+                    after = get_competitor_price_snapshot()
+                    RepricingQueue.mark(
+                        sku
+                        for sku in before.keys() | after.keys()
+                        if before.get(sku) != after.get(sku)
+                    )
 
-                WawiBoxLog.info(f"File {filename} updated on db successfully")
+                WawiBoxLog.info(
+                    f"File {filename} updated on db successfully: {format_ingest_stats(stats)}"
+                )
             except Exception as e:
                 is_completed = False
                 WawiBoxLog.error(f"Failed to update db from file {filename}: {e}")
@@ -148,7 +174,9 @@ def push_products_to_wawibox():
         try:
             # ftp.upload_file(csv_path, csv_name)
             # WawiBoxLog.info(f"Uploaded product export file {csv_name} successfully")
-            # WawiboxExport.objects.all().update(last_pushed_to_wawibox=timezone.now())
+            # WawiboxExport.objects.all().update(
+            #     last_pushed_to_wawibox=timezone.now(), changed_since_last_push=False
+            # )
             is_completed = True
         except Exception as e:
             is_completed = False
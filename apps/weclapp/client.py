@@ -1,5 +1,11 @@
 from django.conf import settings
+import re
+import time
+from collections import defaultdict
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.util.util import reraise
 from .utils import WeclappLog
 from utils import to_unix_ms
 from datetime import date
@@ -21,46 +27,170 @@ def get_headers():
     return headers
 
 
+class WeclappRetry(Retry):
+    """
+    A POST is not idempotent. It is resent only when it was rate limited or
+    the connection could not be opened. After a timeout, a dropped connection
+    or a 5xx the record may already exist, so the error is raised instead.
+    """
+
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST":
+            return bool(self.total) and status_code == 429
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(
+        self,
+        method=None,
+        url=None,
+        response=None,
+        error=None,
+        _pool=None,
+        _stacktrace=None,
+    ):
+        if method == "POST" and error and not self._is_connection_error(error):
+            raise reraise(type(error), error, _stacktrace)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+class WeclappClient:
+    """
+    Keep-alive session for the Weclapp REST API. Connections are pooled,
+    429/5xx responses and read errors are retried with exponential backoff
+    (Retry-After is honoured), a POST only on 429, and request latency is
+    counted per endpoint.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    ID_RE = re.compile(r"/id/[^/?]+")
+
+    def __init__(
+        self, base_url, token, pool_size=10, max_retries=3, backoff=0.5, timeout=60
+    ):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update(get_headers())
+        self.session.headers["AuthenticationToken"] = token
+
+        retry = WeclappRetry(
+            total=max_retries,
+            backoff_factor=backoff,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset(["GET", "PUT", "DELETE"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # endpoint -> [requests, errors, total seconds, max seconds]
+        self.latency = defaultdict(lambda: [0, 0, 0.0, 0.0])
+
+    def endpoint(self, method, path):
+        return f"{method} {self.ID_RE.sub('/id/{id}', path.split('?', 1)[0])}"
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            seconds = time.perf_counter() - started
+            counter = self.latency[self.endpoint(method, path)]
+            counter[0] += 1
+            counter[1] += failed
+            counter[2] += seconds
+            counter[3] = max(counter[3], seconds)
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def latency_stats(self):
+        return {
+            endpoint: {
+                "requests": count,
+                "errors": errors,
+                "avg_ms": round(total / count * 1000, 1),
+                "max_ms": round(longest * 1000, 1),
+            }
+            for endpoint, (count, errors, total, longest) in self.latency.items()
+        }
+
+    def report_latency(self, label):
+        """Log and reset the per-endpoint counters."""
+        if not self.latency:
+            return
+        WeclappLog.info(
+            f"{label} Weclapp latency: "
+            + ", ".join(
+                f"{endpoint} {st['requests']}x avg {st['avg_ms']}ms "
+                f"max {st['max_ms']}ms ({st['errors']} errors)"
+                for endpoint, st in sorted(self.latency_stats().items())
+            )
+        )
+        self.latency.clear()
+
+
+weclapp = WeclappClient(
+    WECLAPP_BASE_URL,
+    WECLAPP_API_TOKEN,
+    pool_size=settings.WECLAPP_POOL_SIZE,
+    max_retries=settings.WECLAPP_MAX_RETRIES,
+    timeout=settings.WECLAPP_TIMEOUT,
+)
+
+
 def test_weclapp_endpoint():
     # page = 1
     # page_size = 800
     # sku = "LG00003"
     # sku = "LG00011"
-    # url = f"{WECLAPP_BASE_URL}/article?articleNumber-eq={sku}"
-    # url = f"{WECLAPP_BASE_URL}/article?articleCategoryId-eq=44006325"
-    # url = f"{WECLAPP_BASE_URL}/article"
-    # url = f"{WECLAPP_BASE_URL}/article/id/10227"
-    # url = f"{WECLAPP_BASE_URL}/article/id/999998"
-    # url = f"{WECLAPP_BASE_URL}/salesOrder/id/314854156"
-    # url = f"{WECLAPP_BASE_URL}/salesOrder/id/314853249/createDropshipping"
-    url = f"{WECLAPP_BASE_URL}/articleSupplySource/id/463949"
-    # url = f"{WECLAPP_BASE_URL}/articleSupplySource?dropshippingPossible-eq=false"
-    # url = f"{WECLAPP_BASE_URL}/articleSupplySource"
-    # url = f"{WECLAPP_BASE_URL}/articlePrice"
-    # url = f"{WECLAPP_BASE_URL}/manufacturer"
-    # url = f"{WECLAPP_BASE_URL}/customsTariffNumber"
-    # url = f"{WECLAPP_BASE_URL}/customsTariffNumber?page=1&pageSize=1000"
-
-    # url = f"{WECLAPP_BASE_URL}/salesOrder"
-    # url = f"{WECLAPP_BASE_URL}/paymentMethod"
-    # url = f"{WECLAPP_BASE_URL}/salesOrder?orderNumber-eq=10270"
-
-    # url = f"{WECLAPP_BASE_URL}/customAttributeDefinition"
-    # url = f"{WECLAPP_BASE_URL}/party"
-    # url = f"{WECLAPP_BASE_URL}/salesChannel/activeSalesChannels"
-
-    # url = f"{WECLAPP_BASE_URL}/articleCategory?page={page}&pageSize={page_size}"
-    # url = f"{WECLAPP_BASE_URL}/fulfillmentProvider"
-    # url = f"{WECLAPP_BASE_URL}/purchaseOrder"
-    # url = f"{WECLAPP_BASE_URL}/purchaseOrder/id/314853263"
-    # url = f"{WECLAPP_BASE_URL}/incomingGoods/id/314852138"
-    # url = f"{WECLAPP_BASE_URL}/shipment"
-    # url = f"{WECLAPP_BASE_URL}/purchaseOrder?salesOrderId-eq=314852006"
-    # url = f"{WECLAPP_BASE_URL}/salesOrder"
-
-    headers = get_headers()
-
-    response = requests.get(url, headers=headers)
+    # url = f"/article?articleNumber-eq={sku}"
+    # url = "/article?articleCategoryId-eq=44006325"
+    # url = "/article"
+    # url = "/article/id/10227"
+    # url = "/article/id/999998"
+    # url = "/salesOrder/id/314854156"
+    # url = "/salesOrder/id/314853249/createDropshipping"
+    url = "/articleSupplySource/id/463949"
+    # url = "/articleSupplySource?dropshippingPossible-eq=false"
+    # url = "/articleSupplySource"
+    # url = "/articlePrice"
+    # url = "/manufacturer"
+    # url = "/customsTariffNumber"
+    # url = "/customsTariffNumber?page=1&pageSize=1000"
+
+    # url = "/salesOrder"
+    # url = "/paymentMethod"
+    # url = "/salesOrder?orderNumber-eq=10270"
+
+    # url = "/customAttributeDefinition"
+    # url = "/party"
+    # url = "/salesChannel/activeSalesChannels"
+
+    # url = f"/articleCategory?page={page}&pageSize={page_size}"
+    # url = "/fulfillmentProvider"
+    # url = "/purchaseOrder"
+    # url = "/purchaseOrder/id/314853263"
+    # url = "/incomingGoods/id/314852138"
+    # url = "/shipment"
+    # url = "/purchaseOrder?salesOrderId-eq=314852006"
+    # url = "/salesOrder"
+
+    response = weclapp.get(url)
     response.raise_for_status()
     items = response.json()
 
@@ -70,8 +200,8 @@ def test_weclapp_endpoint():
 
 
 def fetch_order_by_order_number(order_number):
-    url = f"{WECLAPP_BASE_URL}/salesOrder?orderNumber-eq={order_number}"
-    response = requests.get(url, headers=get_headers())
+    url = f"/salesOrder?orderNumber-eq={order_number}"
+    response = weclapp.get(url)
     if response.status_code != 200:
         WeclappLog.error(f"Failed to fetch orders: {response.text}")
         response.raise_for_status()
@@ -92,8 +222,8 @@ def fetch_order_by_order_number(order_number):
 
 
 def fetch_purchase_order_by_sales_order_id(sales_order_weclapp_id):
-    url = f"{WECLAPP_BASE_URL}/purchaseOrder?salesOrderId-eq={sales_order_weclapp_id}"
-    response = requests.get(url, headers=get_headers())
+    url = f"/purchaseOrder?salesOrderId-eq={sales_order_weclapp_id}"
+    response = weclapp.get(url)
     if response.status_code != 200:
         WeclappLog.error(f"Failed to fetch purchase order: {response.text}")
         response.raise_for_status()
@@ -116,8 +246,8 @@ def fetch_purchase_order_by_sales_order_id(sales_order_weclapp_id):
 
 
 def fetch_purchase_order_by_weclapp_id(weclapp_id):
-    url = f"{WECLAPP_BASE_URL}/purchaseOrder/id/{weclapp_id}"
-    response = requests.get(url, headers=get_headers())
+    url = f"/purchaseOrder/id/{weclapp_id}"
+    response = weclapp.get(url)
     if response.status_code != 200:
         WeclappLog.error(
             f"Failed to fetch purchase order by weclapp_id: {response.text}"
@@ -127,8 +257,8 @@ def fetch_purchase_order_by_weclapp_id(weclapp_id):
 
 
 def fetch_sales_order_by_weclapp_id(weclapp_id):
-    url = f"{WECLAPP_BASE_URL}/salesOrder/id/{weclapp_id}"
-    response = requests.get(url, headers=get_headers())
+    url = f"/salesOrder/id/{weclapp_id}"
+    response = weclapp.get(url)
     if response.status_code != 200:
         WeclappLog.error(f"Failed to fetch sales order by weclapp_id: {response.text}")
         response.raise_for_status()
@@ -149,8 +279,8 @@ def get_sales_orders_with_multiple_shipments():
 
     while True:
 
-        url = f"{WECLAPP_BASE_URL}/shipment"
-        response = requests.get(url, headers=get_headers(), params=params)
+        url = "/shipment"
+        response = weclapp.get(url, params=params)
         response.raise_for_status()
 
         shipments = response.json().get("result", [])
@@ -175,7 +305,7 @@ def get_sales_orders_with_multiple_shipments():
 
 
 def fetch_dropshipping_orders():
-    url = f"{WECLAPP_BASE_URL}/salesOrder"
+    url = "/salesOrder"
     params = {
         "status-eq": "ORDER_CONFIRMATION_PRINTED",
         "page": 1,
@@ -185,7 +315,7 @@ def fetch_dropshipping_orders():
     results = []
 
     while True:
-        response = requests.get(url, headers=get_headers(), params=params)
+        response = weclapp.get(url, params=params)
         if response.status_code != 200:
             WeclappLog.error(f"Failed to fetch dropshipping orders: {response.text}")
             response.raise_for_status()
@@ -204,8 +334,8 @@ def fetch_dropshipping_orders():
 
 
 def fetch_latest_shipment_by_order_id(order_weclapp_id):
-    url = f"{WECLAPP_BASE_URL}/shipment?salesOrders.id-eq={order_weclapp_id}"
-    response = requests.get(url, headers=get_headers())
+    url = f"/shipment?salesOrders.id-eq={order_weclapp_id}"
+    response = weclapp.get(url)
     if response.status_code != 200:
         WeclappLog.error(f"Failed to fetch shipment by order_id: {response.text}")
         response.raise_for_status()
@@ -218,8 +348,8 @@ def fetch_latest_shipment_by_order_id(order_weclapp_id):
 
 
 def fetch_shipment_by_order_id(order_weclapp_id):
-    url = f"{WECLAPP_BASE_URL}/shipment?salesOrders.id-eq={order_weclapp_id}"
-    response = requests.get(url, headers=get_headers())
+    url = f"/shipment?salesOrders.id-eq={order_weclapp_id}"
+    response = weclapp.get(url)
     if response.status_code != 200:
         WeclappLog.error(f"Failed to fetch shipment by order_id: {response.text}")
         response.raise_for_status()
@@ -238,8 +368,8 @@ def check_serial_number_required(po_item):
 
 
 def fetch_article_by_weclapp_id(weclapp_id):
-    url = f"{WECLAPP_BASE_URL}/article/id/{weclapp_id}"
-    response = requests.get(url, headers=get_headers())
+    url = f"/article/id/{weclapp_id}"
+    response = weclapp.get(url)
     if response.status_code != 200:
         WeclappLog.error(f"Failed to fetch article by weclapp_id: {response.text}")
         response.raise_for_status()
@@ -247,8 +377,8 @@ def fetch_article_by_weclapp_id(weclapp_id):
 
 
 def fetch_article_by_sku(sku):
-    url = f"{WECLAPP_BASE_URL}/article?articleNumber-eq={sku}"
-    response = requests.get(url, headers=get_headers())
+    url = f"/article?articleNumber-eq={sku}"
+    response = weclapp.get(url)
     if response.status_code != 200:
         WeclappLog.error(f"Failed to fetch article by sku: {response.text}")
         response.raise_for_status()
@@ -262,11 +392,10 @@ def fetch_article_by_sku(sku):
 
 
 def create_shipment_from_order(order_weclapp_id):
-    # url = f"{WECLAPP_BASE_URL}/salesOrder/id/{order_weclapp_id}/createShipment?dryRun=true"
-    url = f"{WECLAPP_BASE_URL}/salesOrder/id/{order_weclapp_id}/createShipment"
-    headers = get_headers()
+    # url = f"/salesOrder/id/{order_weclapp_id}/createShipment?dryRun=true"
+    url = f"/salesOrder/id/{order_weclapp_id}/createShipment"
     payload = {"additionalSalesOrderIds": []}
-    response = requests.post(url, json=payload, headers=headers)
+    response = weclapp.post(url, json=payload)
     if response.status_code == 200:
         return response.json()
 
@@ -288,14 +417,13 @@ def create_shipment_from_order(order_weclapp_id):
 
 # def create_dropshipping_from_order(order_weclapp_id, order_item_ids):
 def create_dropshipping_from_order():
-    # url = f"{WECLAPP_BASE_URL}/salesOrder/id/{order_weclapp_id}/createDropshipping"
-    url = f"{WECLAPP_BASE_URL}/salesOrder/id/314853249/createDropshipping"
-    headers = get_headers()
+    # url = f"/salesOrder/id/{order_weclapp_id}/createDropshipping"
+    url = "/salesOrder/id/314853249/createDropshipping"
     payload = {
         "orderItemIds": ["314853254"],
         "supplierId": "6836",
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = weclapp.post(url, json=payload)
     if response.status_code == 200:
         return response.json()
 
@@ -317,39 +445,35 @@ def create_dropshipping_from_order():
 
 
 def confirm_purchase_order(purchase_order_weclapp_id):
-    url = f"{WECLAPP_BASE_URL}/purchaseOrder/id/{purchase_order_weclapp_id}?ignoreMissingProperties=true"
+    url = f"/purchaseOrder/id/{purchase_order_weclapp_id}?ignoreMissingProperties=true"
     payload = {
         "status": "CONFIRMED",
     }
-    headers = get_headers()
-    response = requests.put(url, json=payload, headers=headers)
+    response = weclapp.put(url, json=payload)
     response.raise_for_status()
 
 
 def set_purchase_order_for_entry(purchase_order_weclapp_id):
-    url = f"{WECLAPP_BASE_URL}/purchaseOrder/id/{purchase_order_weclapp_id}?ignoreMissingProperties=true"
+    url = f"/purchaseOrder/id/{purchase_order_weclapp_id}?ignoreMissingProperties=true"
 
     payload = {
         "status": "ORDER_ENTRY_IN_PROGRESS",
     }
-    headers = get_headers()
-    response = requests.put(url, json=payload, headers=headers)
+    response = weclapp.put(url, json=payload)
     response.raise_for_status()
 
 
 def create_invoice_from_shipment(shipment_weclapp_id):
-    url = f"{WECLAPP_BASE_URL}/shipment/id/{shipment_weclapp_id}/createSalesInvoice"
+    url = f"/shipment/id/{shipment_weclapp_id}/createSalesInvoice"
     payload = {}
-    headers = get_headers()
-    response = requests.post(url, json=payload, headers=headers)
+    response = weclapp.post(url, json=payload)
     response.raise_for_status()
 
 
 def update_purchase_order(payload):
     purchase_order_id = payload["id"]
-    url = f"{WECLAPP_BASE_URL}/purchaseOrder/id/{purchase_order_id}?ignoreMissingProperties=true"
-    headers = get_headers()
-    response = requests.put(url, json=payload, headers=headers)
+    url = f"/purchaseOrder/id/{purchase_order_id}?ignoreMissingProperties=true"
+    response = weclapp.put(url, json=payload)
 
     updated = response.status_code == 200
     if not updated:
@@ -372,9 +496,8 @@ def update_purchase_order(payload):
 def create_weclapp_order(payload=None):
     if not payload:
         return
-    url = f"{WECLAPP_BASE_URL}/salesOrder"
-    headers = get_headers()
-    response = requests.post(url, json=payload, headers=headers)
+    url = "/salesOrder"
+    response = weclapp.post(url, json=payload)
     created = response.status_code in [201, 200]
     if not created:
         try:
@@ -395,20 +518,19 @@ def create_weclapp_order(payload=None):
 
 
 def get_customer_id(order):
-    headers = get_headers()
     email = order.customer_email
-    url = f"{WECLAPP_BASE_URL}/party?email-eq={email}"
+    url = f"/party?email-eq={email}"
 
-    response = requests.get(url, headers=headers)
+    response = weclapp.get(url)
     response.raise_for_status()
 
     result = response.json().get("result")
     if result:
         customer_id = result[0]["id"]
     else:
-        url = f"{WECLAPP_BASE_URL}/party?dryRun=true"
+        url = "/party?dryRun=true"
         payload = order.build_weclapp_customer_payload()
-        response = requests.post(url, json=payload, headers=headers)
+        response = weclapp.post(url, json=payload)
         created = response.status_code in [201, 200]
         if not created:
             WeclappLog.error(f"Failed to create new customer: {response.text}")
@@ -418,10 +540,9 @@ def get_customer_id(order):
 
 
 def get_customer(id):
-    headers = get_headers()
-    url = f"{WECLAPP_BASE_URL}/party/id/{id}"
+    url = f"/party/id/{id}"
 
-    response = requests.get(url, headers=headers)
+    response = weclapp.get(url)
     if response.status_code != 200:
         WeclappLog.error(f"Failed to get customer with id {id}: {response.text}")
         response.raise_for_status()
@@ -429,13 +550,12 @@ def get_customer(id):
 
 
 def create_weclapp_manufacturer(name):
-    url = f"{WECLAPP_BASE_URL}/manufacturer"
-    headers = get_headers()
+    url = "/manufacturer"
 
     payload = {
         "name": name,
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = weclapp.post(url, json=payload)
     created = response.status_code in [201, 200]
     if not created:
         WeclappLog.error(
@@ -446,9 +566,8 @@ def create_weclapp_manufacturer(name):
 
 
 def create_article_category(payload):
-    url = f"{WECLAPP_BASE_URL}/articleCategory"
-    headers = get_headers()
-    response = requests.post(url, json=payload, headers=headers)
+    url = "/articleCategory"
+    response = weclapp.post(url, json=payload)
     created = response.status_code in [201, 200]
     if not created:
         WeclappLog.error(
@@ -460,13 +579,12 @@ def create_article_category(payload):
 
 
 def create_weclapp_custom_number(name):
-    url = f"{WECLAPP_BASE_URL}/customsTariffNumber"
-    headers = get_headers()
+    url = "/customsTariffNumber"
 
     payload = {
         "name": name,
     }
-    response = requests.post(url, json=payload, headers=headers)
+    response = weclapp.post(url, json=payload)
     created = response.status_code in [201, 200]
     if not created:
         WeclappLog.error(
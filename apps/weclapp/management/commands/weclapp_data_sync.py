@@ -6,17 +6,26 @@ from apps.weclapp.views import (
     bootstrap_article_category_weclapp_ids,
 )
 from apps.weclapp.views_async import sync_master_data
+from apps.weclapp.client import weclapp
 import asyncio
 from django.utils import timezone
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Send every product, even when its payload did not change",
+        )
+
     def handle(self, *args, **kwargs):
         ids_synced = bootstrap_weclapp_ids()
         manu_ids_synced = bootstrap_manufacturer_weclapp_ids()
         custom_pos_synced = bootstrap_customs_position_weclapp_ids()
         category_ids_synced = bootstrap_article_category_weclapp_ids()
+        weclapp.report_latency("Weclapp id bootstrap")
 
         if all(
             [
@@ -32,7 +41,7 @@ class Command(BaseCommand):
                 )
             )
 
-            asyncio.run(sync_master_data())
+            asyncio.run(sync_master_data(force=kwargs["force"]))
             self.stdout.write(
                 self.style.SUCCESS(
                     f"Master data sync to Weclapp completed {timezone.now()}"
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 14:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0032_export_task_leasing'),
+        ('weclapp', '0002_syncstatus'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSyncDigest',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='weclapp_sync_digest', serialize=False, to='core.product')),
+                ('article_digest', models.CharField(blank=True, max_length=64, null=True)),
+                ('supply_source_digest', models.CharField(blank=True, max_length=64, null=True)),
+                ('last_sent', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
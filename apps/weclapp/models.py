@@ -3,12 +3,14 @@ from django.db.models import F
 from django.db.models import Model
 from django.db.models import QuerySet
 from django.db.models import ForeignKey
+from django.db.models import OneToOneField
 from django.db.models import CharField
 from django.db.models import BooleanField
 from django.db.models import DateField
 from django.db.models import IntegerField
 from django.db.models import DateTimeField
 from django.db.models import SET_NULL
+from django.db.models import CASCADE
 from utils import CleanDecimalField
 from django.core.validators import MaxValueValidator
 from apps.core.models import Product
@@ -83,3 +85,43 @@ class SyncStatus(Model):
                 "time_completed": timezone.now(),
             },
         )
+
+
+class ProductSyncDigest(Model):
+    """
+    Digests of the article and supply source payloads last sent to Weclapp,
+    used by the master data sync to skip products that did not change.
+    """
+
+    product = OneToOneField(
+        Product,
+        on_delete=CASCADE,
+        primary_key=True,
+        related_name="weclapp_sync_digest",
+    )
+    article_digest = CharField(max_length=64, null=True, blank=True)
+    supply_source_digest = CharField(max_length=64, null=True, blank=True)
+    last_sent = DateTimeField(auto_now=True)
+
+    BATCH = 1000
+
+    def __str__(self):
+        return str(self.product_id)
+
+    @classmethod
+    def store(cls, digests):
+        objs = [
+            cls(
+                product_id=product_id,
+                article_digest=values.get("article_digest"),
+                supply_source_digest=values.get("supply_source_digest"),
+            )
+            for product_id, values in digests.items()
+        ]
+        cls.objects.bulk_create(
+            objs,
+            batch_size=cls.BATCH,
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=["article_digest", "supply_source_digest", "last_sent"],
+        )
@@ -1,3 +1,175 @@
-from django.test import TestCase
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from apps.core.models import Product
+from apps.gls.models import GLSMasterData, GLSPriceList
+
+from . import views_async
+from .client import WeclappClient
+from .models import ProductSyncDigest
+
+
+class FakeWeclappHandler(BaseHTTPRequestHandler):
+    def _answer(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+
+        key = f"{self.command} {self.path}"
+        server.hits[key] += 1
+        statuses = server.statuses.get(key, [])
+        status = statuses.pop(0) if statuses else 200
+        if self.path.startswith("/slow"):
+            time.sleep(server.delay)
+
+        try:
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+        except OSError:
+            # the client gave up waiting
+            pass
+
+    do_GET = do_POST = do_PUT = _answer
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WeclappClientRetryTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeWeclappHandler)
+        cls.server.daemon_threads = True
+        cls.server.delay = 0.5
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.hits = Counter()
+        self.server.statuses = {}
+        host, port = self.server.server_address
+        self.client = WeclappClient(
+            f"http://{host}:{port}", "token", max_retries=3, backoff=0, timeout=0.2
+        )
+
+    def tearDown(self):
+        self.client.session.close()
+
+    def test_post_read_timeout_is_sent_once(self):
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.client.post("/slow/salesOrder", json={"orderNumber": "1"})
+        self.assertEqual(self.server.hits["POST /slow/salesOrder"], 1)
+
+    def test_post_server_error_is_sent_once(self):
+        self.server.statuses["POST /salesOrder"] = [500]
+        response = self.client.post("/salesOrder", json={})
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(self.server.hits["POST /salesOrder"], 1)
+
+    def test_post_rate_limit_is_retried(self):
+        self.server.statuses["POST /salesOrder"] = [429, 429]
+        response = self.client.post("/salesOrder", json={})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.hits["POST /salesOrder"], 3)
+
+    def test_get_read_timeout_is_retried(self):
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.client.get("/slow/article")
+        self.assertEqual(self.server.hits["GET /slow/article"], 4)
+
+    def test_put_server_error_is_retried(self):
+        self.server.statuses["PUT /article/id/1"] = [503]
+        response = self.client.put("/article/id/1", json={})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.hits["PUT /article/id/1"], 2)
+
+
+class ProductSyncDigestTests(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            sku="LG1",
+            supplier_article_no="1",
+            weclapp_id="10",
+            weclapp_article_supply_source_id="20",
+        )
+        self.master_data = GLSMasterData.objects.create(
+            product=self.product,
+            article_no="1",
+            description="Gloves",
+            vat_rate=Decimal("19"),
+        )
+        GLSPriceList.objects.create(
+            product=self.product,
+            article_no="1",
+            purchase_price=Decimal("10"),
+            bill_back_price=Decimal("9"),
+        )
+
+    def sync(self, force=False):
+        weclapp_calls = {
+            "fetch_list": mock.AsyncMock(),
+            "fetch_article": mock.AsyncMock(return_value={"id": "10"}),
+            "fetch_article_supply_source": mock.AsyncMock(return_value={"id": "20"}),
+            "put_article": mock.AsyncMock(),
+            "put_supply_source": mock.AsyncMock(),
+        }
+        with mock.patch.multiple(views_async, **weclapp_calls):
+            async_to_sync(views_async.sync_products)([self.product.id], force)
+        return weclapp_calls
+
+    @override_settings(WECLAPP_SYNC_DRY_RUN=False)
+    def test_unchanged_product_is_skipped_once_digest_exists(self):
+        calls = self.sync()
+        self.assertEqual(calls["put_article"].await_count, 1)
+        self.assertEqual(calls["put_supply_source"].await_count, 1)
+        self.assertTrue(ProductSyncDigest.objects.filter(product=self.product).exists())
+
+        calls = self.sync()
+        for name in ("fetch_article", "put_article", "put_supply_source"):
+            self.assertEqual(calls[name].await_count, 0, name)
+
+    @override_settings(WECLAPP_SYNC_DRY_RUN=False)
+    def test_changed_product_is_sent_again(self):
+        self.sync()
+        self.master_data.description = "Nitrile gloves"
+        self.master_data.save()
+
+        calls = self.sync()
+        self.assertEqual(calls["put_article"].await_count, 1)
+        self.assertEqual(calls["put_supply_source"].await_count, 1)
+
+    @override_settings(WECLAPP_SYNC_DRY_RUN=False)
+    def test_force_sends_unchanged_product(self):
+        self.sync()
+
+        calls = self.sync(force=True)
+        self.assertEqual(calls["put_article"].await_count, 1)
+        self.assertEqual(calls["put_supply_source"].await_count, 1)
+
+    @override_settings(WECLAPP_SYNC_DRY_RUN=True)
+    def test_dry_run_stores_no_digest(self):
+        self.sync()
+        self.assertFalse(ProductSyncDigest.objects.exists())
+        self.assertEqual(views_async.write_query(), "?dryRun=true")
+
+        calls = self.sync()
+        self.assertEqual(calls["put_article"].await_count, 1)
@@ -3,6 +3,12 @@ from utils import (
     make_json_safe,
     remove_null_keys,
 )
+import asyncio
+import hashlib
+import json
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from asgiref.sync import sync_to_async
 from apps.core.models import (
@@ -11,11 +17,16 @@ from apps.core.models import (
     LogEntry,
 )
 from apps.gls.models import (
+    GLSMasterData,
+    GLSPriceList,
+    GLSProductGroup,
     GLSPromotionHeader,
+    GLSPromotionPrice,
     GLSHandlingSurcharge,
+    GLSSupplier,
 )
 from decimal import Decimal
-from .models import SyncStatus
+from .models import CustomsPositionMap, ProductSyncDigest, SyncStatus
 
 
 class WeclappLog:
@@ -50,6 +61,107 @@ class WeclappLog:
         await sync_to_async(WeclappLog.error)(msg)
 
 
+class ProductSyncContext:
+    """
+    GLS data behind the article and supply source payloads of one batch of
+    products, loaded in a fixed number of queries. Lookups mirror the
+    .first() calls they replace: the lowest pk wins when a product has more
+    than one row.
+    """
+
+    def __init__(self, products):
+        product_ids = [product.id for product in products]
+
+        self.master_data = self._first_by(
+            GLSMasterData.objects.filter(product_id__in=product_ids), "product_id"
+        )
+        self.price_lists = self._first_by(
+            GLSPriceList.objects.filter(product_id__in=product_ids), "product_id"
+        )
+        self.promotional_prices = self._first_by(
+            GLSPromotionPrice.objects.filter(product_id__in=product_ids),
+            "product_id",
+        )
+        self.promo_headers = self._first_by(
+            GLSPromotionHeader.objects.filter(
+                action_code__in={
+                    promo.action_code for promo in self.promotional_prices.values()
+                }
+            ),
+            "action_code",
+        )
+
+        master_data = self.master_data.values()
+        self.manufacturer_ids = dict(
+            GLSSupplier.objects.filter(
+                supplier_no__in={md.manufacturer for md in master_data}
+            ).values_list("supplier_no", "weclapp_id")
+        )
+        self.product_group_ids = dict(
+            GLSProductGroup.objects.filter(
+                product_group_no__in={md.product_group_no for md in master_data}
+            ).values_list("product_group_no", "weclapp_id")
+        )
+        self.customs_number_ids = dict(
+            CustomsPositionMap.objects.filter(
+                customs_number__in={md.customs_position for md in master_data}
+            ).values_list("customs_number", "weclapp_id")
+        )
+        self.handling_surcharges = AsyncDb._fetch_gls_handling_surcharge()
+        self.digests = {
+            row["product_id"]: row
+            for row in ProductSyncDigest.objects.filter(
+                product_id__in=product_ids
+            ).values("product_id", "article_digest", "supply_source_digest")
+        }
+        self.sent = set()
+        # filled on the event loop while the batch is synced
+        self.local_payloads = {}
+        self.weclapp_articles = {}
+        self.weclapp_supply_sources = {}
+
+    @staticmethod
+    def _first_by(queryset, key):
+        rows = {}
+        for obj in queryset.order_by("pk"):
+            rows.setdefault(getattr(obj, key), obj)
+        return rows
+
+    def get_master_data(self, product):
+        return self.master_data.get(product.id)
+
+    def get_price_list(self, product):
+        return self.price_lists.get(product.id)
+
+    def get_promotional_price(self, product):
+        return self.promotional_prices.get(product.id)
+
+    def get_promo_header(self, action_code):
+        return self.promo_headers.get(action_code)
+
+    def get_manufacturer_weclapp_id(self, md):
+        return self.manufacturer_ids.get(md.manufacturer)
+
+    def get_product_group_weclapp_id(self, md):
+        return self.product_group_ids.get(md.product_group_no)
+
+    def get_customs_number_weclapp_id(self, md):
+        return self.customs_number_ids.get(md.customs_position)
+
+    def get_handling_surcharge(self, md):
+        return self.handling_surcharges.get(md.article_group_no, 0)
+
+    def get_digest(self, product, name):
+        return self.digests.get(product.id, {}).get(name)
+
+    def mark_sent(self, product, name, digest):
+        self.digests.setdefault(product.id, {})[name] = digest
+        self.sent.add(product.id)
+
+    def sent_digests(self):
+        return {product_id: self.digests[product_id] for product_id in self.sent}
+
+
 class AsyncDb:
 
     @staticmethod
@@ -84,18 +196,6 @@ class AsyncDb:
     def _fetch_gtin_map():
         return dict(ProductGtin.objects.all().values_list("article_no", "gtin"))
 
-    @staticmethod
-    def _fetch_master_data(product):
-        return product.gls_master_data.first()
-
-    @staticmethod
-    def _fetch_price_list(product):
-        return product.gls_price_list.first()
-
-    @staticmethod
-    def _fetch_promotional_price(product):
-        return product.gls_promotional_price.first()
-
     @staticmethod
     def _fetch_gls_handling_surcharge():
         surcharge_map = {}
@@ -106,12 +206,12 @@ class AsyncDb:
         return surcharge_map
 
     @staticmethod
-    def _fetch_promo_header(action_code):
-        return GLSPromotionHeader.objects.filter(action_code=action_code).first()
+    def _fetch_sync_context(products):
+        return ProductSyncContext(products)
 
     @staticmethod
-    def _get_instance_property(obj, property_name):
-        return getattr(obj, property_name)
+    def _store_sync_digests(context):
+        ProductSyncDigest.store(context.sent_digests())
 
     @staticmethod
     def _get_is_sync_ongoing():
@@ -130,14 +230,11 @@ class AsyncDb:
     get_product_by_sku = staticmethod(sync_to_async(_fetch_product_by_sku))
     get_products_by_ids = staticmethod(sync_to_async(_fetch_products_by_ids))
     get_gtin_map = staticmethod(sync_to_async(_fetch_gtin_map))
-    get_master_data = staticmethod(sync_to_async(_fetch_master_data))
-    get_price_list = staticmethod(sync_to_async(_fetch_price_list))
-    get_promotional_price = staticmethod(sync_to_async(_fetch_promotional_price))
-    get_promo_header = staticmethod(sync_to_async(_fetch_promo_header))
     get_gls_handling_surcharge = staticmethod(
         sync_to_async(_fetch_gls_handling_surcharge)
     )
-    get_model_property = staticmethod(sync_to_async(_get_instance_property))
+    get_sync_context = staticmethod(sync_to_async(_fetch_sync_context))
+    store_sync_digests = staticmethod(sync_to_async(_store_sync_digests))
     get_gls_products = staticmethod(sync_to_async(_fetch_gls_products))
     get_gls_product_ids = staticmethod(sync_to_async(_fetch_gls_product_ids))
     is_sync_ongoing = staticmethod(sync_to_async(_get_is_sync_ongoing))
@@ -145,6 +242,139 @@ class AsyncDb:
     set_sync_completed = staticmethod(sync_to_async(_set_sync_completed))
 
 
+class AdaptiveRateLimiter:
+    """
+    One request budget shared by every call of the async sync. A token bucket
+    paces the request rate and an AIMD controller sets how many requests may
+    be in flight. Both start with exponential growth, after the first 429 or
+    rate limit header they grow by about one request per second and one slot
+    per round trip. A 429 halves both and pauses everyone for Retry-After.
+    X-RateLimit-Remaining/Reset headers cap the rate to what is left of the
+    current window.
+    """
+
+    def __init__(
+        self,
+        rate=5.0,
+        max_rate=50.0,
+        concurrency=4,
+        max_concurrency=20,
+        min_rate=0.5,
+    ):
+        self.rate = float(rate)
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min_rate)
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.in_flight = 0
+        # grow exponentially until the first sign of the limit, then linearly
+        self.slow_start = True
+        self.lock = asyncio.Lock()
+        self.slot_freed = asyncio.Event()
+        self.stats = Counter()
+
+    def _refill(self, now):
+        burst = max(1.0, self.concurrency)
+        self.tokens = min(burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        # waiters queue on the lock, so tokens are handed out in order
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                elif self.in_flight >= int(self.concurrency):
+                    self.slot_freed.clear()
+                    await self.slot_freed.wait()
+                elif self.tokens < 1:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+                else:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+
+    def release(self, status=None, headers=None):
+        self.in_flight -= 1
+        self.slot_freed.set()
+        self.stats["requests"] += 1
+        now = time.monotonic()
+
+        if status == 429:
+            self.stats["429"] += 1
+            self.slow_start = False
+            self.concurrency = max(1.0, self.concurrency / 2)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0.0
+            retry_after = self._seconds(headers, "Retry-After") or 1.0
+            self.paused_until = max(self.paused_until, now + retry_after)
+            return
+
+        if status is None or status >= 500:
+            self.stats["errors"] += 1
+            self.concurrency = max(1.0, self.concurrency / 2)
+            return
+
+        if self.slow_start:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.rate = min(self.max_rate, self.rate + 1)
+        else:
+            self.concurrency = min(
+                self.max_concurrency, self.concurrency + 1 / self.concurrency
+            )
+            self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+        remaining = self._number(headers, "X-RateLimit-Remaining")
+        reset = self._seconds(headers, "X-RateLimit-Reset")
+        if remaining is not None and reset:
+            if remaining < 1:
+                self.paused_until = max(self.paused_until, now + reset)
+            elif remaining / reset < self.rate:
+                self.slow_start = False
+                self.rate = max(self.min_rate, remaining / reset)
+
+    @staticmethod
+    def _number(headers, name):
+        try:
+            return float(headers[name])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    @classmethod
+    def _seconds(cls, headers, name):
+        value = cls._number(headers, name)
+        if value is None:
+            return None
+        # some APIs send an epoch timestamp instead of a delay
+        if value > 1e9:
+            value -= time.time()
+        return max(value, 0.0)
+
+    @asynccontextmanager
+    async def request(self, send, *args, **kwargs):
+        """async with limiter.request(session.get, url) as response: ..."""
+        await self.acquire()
+        status = headers = None
+        try:
+            async with send(*args, **kwargs) as response:
+                status, headers = response.status, response.headers
+                yield response
+        finally:
+            self.release(status, headers)
+
+    def summary(self):
+        return (
+            f"{self.stats['requests']} requests, {self.stats['429']} rate limited, "
+            f"{self.stats['errors']} failed, ended at {self.rate:.1f} req/s "
+            f"with {int(self.concurrency)} in flight"
+        )
+
+
 def vat_rate_type(rate):
     return "STANDARD" if rate == 19 else "REDUCED" if rate == 7 else None
 
@@ -257,6 +487,12 @@ def strip_system_fields(data):
     return data
 
 
+def payload_digest(weclapp_id, payload):
+    """Digest of a payload together with the Weclapp object it is sent to."""
+    data = json.dumps([weclapp_id, payload], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
 def weclapp_clean_payload(payload):
     # payload = remove_null_keys(payload)
     payload = strip_system_fields(payload)
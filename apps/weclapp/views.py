@@ -1,6 +1,5 @@
 from apps.gls.models import GLSOrderStatus
-from django.conf import settings
-import time, requests
+import time
 import traceback
 from django.http import JsonResponse
 from apps.core.models import Product
@@ -19,6 +18,7 @@ from django.db import transaction
 from .models import CustomsPositionMap
 from apps.gls.utils import clean_gls_address
 from .client import (
+    weclapp,
     fetch_order_by_order_number,
     create_weclapp_order,
     get_customer_id,
@@ -50,22 +50,6 @@ from .utils import (
     parse_gls_shipping_date,
 )
 
-# Constants
-WECLAPP_BASE_URL = settings.WECLAPP_BASE_URL
-WECLAPP_API_TOKEN = settings.WECLAPP_API_TOKEN
-
-
-def get_headers():
-    headers = {
-        "AuthenticationToken": WECLAPP_API_TOKEN,
-        "Accept": "application/json",
-        "Content-Type": "application/json",
-        "Accept-Encoding": "gzip",
-        "User-Agent": "Jasado Middleware",
-    }
-
-    return headers
-
 
 def bootstrap_weclapp_ids():
     missing_ids_exists = Product.objects.filter(
@@ -73,14 +57,12 @@ def bootstrap_weclapp_ids():
     ).exists()
     if not missing_ids_exists:
         return True
-
-    headers = get_headers()
     page = 1
     page_size = 1000
 
     while True:
-        url = f"{WECLAPP_BASE_URL}/article?page={page}&pageSize={page_size}"
-        r = requests.get(url, headers=headers)
+        url = f"/article?page={page}&pageSize={page_size}"
+        r = weclapp.get(url)
         r.raise_for_status()
 
         articles = r.json().get("result", [])
@@ -131,15 +113,13 @@ def bootstrap_manufacturer_weclapp_ids():
         return True
 
     suppliers = list(suppliers)
-
-    headers = get_headers()
     page = 1
     page_size = 1000
     id_map = {}
 
     while True:
-        url = f"{WECLAPP_BASE_URL}/manufacturer?page={page}&pageSize={page_size}"
-        r = requests.get(url, headers=headers)
+        url = f"/manufacturer?page={page}&pageSize={page_size}"
+        r = weclapp.get(url)
         r.raise_for_status()
 
         manufacturers = r.json().get("result", [])
@@ -174,15 +154,13 @@ def bootstrap_article_category_weclapp_ids():
         return True
 
     product_groups = list(product_groups)
-
-    headers = get_headers()
     page = 1
     page_size = 1000
     id_map = {}
 
     while True:
-        url = f"{WECLAPP_BASE_URL}/articleCategory?page={page}&pageSize={page_size}"
-        r = requests.get(url, headers=headers)
+        url = f"/articleCategory?page={page}&pageSize={page_size}"
+        r = weclapp.get(url)
         r.raise_for_status()
 
         categories = r.json().get("result", [])
@@ -237,15 +215,13 @@ def bootstrap_customs_position_weclapp_ids():
 
     if not missing:
         return True
-
-    headers = get_headers()
     page = 1
     page_size = 1000
     weclapp_map = {}
 
     while True:
-        url = f"{WECLAPP_BASE_URL}/customsTariffNumber?page={page}&pageSize={page_size}"
-        r = requests.get(url, headers=headers)
+        url = f"/customsTariffNumber?page={page}&pageSize={page_size}"
+        r = weclapp.get(url)
         r.raise_for_status()
 
         result = r.json().get("result", [])
@@ -316,12 +292,13 @@ def sync_new_orders_from_marketplaces():
         WeclappLog.error(
             f"Error occured during order creation to weclapp: {traceback.format_exc()}."
         )
+    finally:
+        weclapp.report_latency("Marketplace order sync")
 
 
 def process_dropshipping(purchase_order, feedback_status):
     confirm_purchase_order(purchase_order["id"])
-    url = f"{WECLAPP_BASE_URL}/purchaseOrder/id/{purchase_order['id']}/processDropshipping"
-    headers = get_headers()
+    url = f"/purchaseOrder/id/{purchase_order['id']}/processDropshipping"
     payload = {
         "shipmentParameters": {
             "deliveryDate": parse_gls_shipping_date(feedback_status.delivery_date),
@@ -351,7 +328,7 @@ def process_dropshipping(purchase_order, feedback_status):
                     }
                 )
 
-    response = requests.post(url, json=payload, headers=headers)
+    response = weclapp.post(url, json=payload)
     if response.status_code == 200:
         return response.json()
 
@@ -466,6 +443,8 @@ def sync_order_feedback_status():
         WeclappLog.error(
             f"Error occurred during order sync to weclapp: {traceback.format_exc()}"
         )
+    finally:
+        weclapp.report_latency("GLS feedback sync")
 
 
 def create_dropshipping_orders(orders=None):
@@ -557,6 +536,8 @@ def create_dropshipping_orders(orders=None):
             WeclappLog.error(str(traceback.format_exc()))
             continue
 
+    weclapp.report_latency("Dropshipping order import")
+
 
 def purchase_order_webhook(request):
     from apps.gls.views import push_dropshipping_orders_to_gls
@@ -1,6 +1,6 @@
 import asyncio
+import json
 import aiohttp
-import random
 from django.conf import settings
 from .utils import (
     WeclappLog,
@@ -10,6 +10,8 @@ from .utils import (
     upsert_sales_price,
     upsert_promo_purchase_price,
     AsyncDb,
+    AdaptiveRateLimiter,
+    payload_digest,
     weclapp_clean_payload,
 )
 from utils import (
@@ -25,9 +27,50 @@ from copy import deepcopy
 WECLAPP_BASE_URL = settings.WECLAPP_BASE_URL
 WECLAPP_API_TOKEN = settings.WECLAPP_API_TOKEN
 
-SEM = asyncio.Semaphore(10)
 MAX_RETRIES = 3
 BATCH_SIZE = 200
+SKIPPED = "skipped"
+LIST_PAGE_SIZE = 100
+# properties the payload builders merge into, PUTs ignore everything else
+ARTICLE_PROPERTIES = [
+    "id",
+    "version",
+    "articleNumber",
+    "name",
+    "ean",
+    "manufacturerId",
+    "customsTariffNumberId",
+    "articleCategoryId",
+    "manufacturerPartNumber",
+    "articleNetWeight",
+    "articleLength",
+    "articleWidth",
+    "articleHeight",
+    "description",
+    "countryOfOriginCode",
+    "active",
+    "launchDate",
+    "taxRateType",
+    "customAttributes",
+    "articleCalculationPrices",
+    "articlePrices",
+]
+SUPPLY_SOURCE_PROPERTIES = [
+    "id",
+    "version",
+    "articleNumber",
+    "name",
+    "ean",
+    "taxRateType",
+    "customAttributes",
+    "articlePrices",
+]
+
+
+def write_query(*params):
+    if settings.WECLAPP_SYNC_DRY_RUN:
+        params += ("dryRun=true",)
+    return f"?{'&'.join(params)}" if params else ""
 
 
 def get_headers():
@@ -63,8 +106,9 @@ async def raise_for_status_with_message(response):
     )
 
 
-async def fetch_article(session, weclapp_id):
-    async with session.get(
+async def fetch_article(session, limiter, weclapp_id):
+    async with limiter.request(
+        session.get,
         f"{WECLAPP_BASE_URL}/article/id/{weclapp_id}",
         headers=get_headers(),
     ) as response:
@@ -76,8 +120,39 @@ async def fetch_article(session, weclapp_id):
         return await response.json()
 
 
-async def fetch_article_supply_source(session, supply_source_id):
-    async with session.get(
+async def fetch_list(session, limiter, entity, ids, properties, records):
+    """
+    Fetch records by id through a list endpoint into records, LIST_PAGE_SIZE
+    ids per request and only the given properties.
+    """
+    for i in range(0, len(ids), LIST_PAGE_SIZE):
+        chunk = ids[i : i + LIST_PAGE_SIZE]
+        params = {
+            "id-in": json.dumps(chunk),
+            "properties": ",".join(properties),
+            "pageSize": str(len(chunk)),
+        }
+        async with limiter.request(
+            session.get,
+            f"{WECLAPP_BASE_URL}/{entity}",
+            headers=get_headers(),
+            params=params,
+        ) as response:
+            if response.status == 429:
+                raise aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=429
+                )
+            await raise_for_status_with_message(response)
+            data = await response.json()
+
+        for record in data.get("result", []):
+            records[record["id"]] = record
+    return records
+
+
+async def fetch_article_supply_source(session, limiter, supply_source_id):
+    async with limiter.request(
+        session.get,
         f"{WECLAPP_BASE_URL}/articleSupplySource/id/{supply_source_id}",
         headers=get_headers(),
     ) as response:
@@ -88,9 +163,11 @@ async def fetch_article_supply_source(session, supply_source_id):
         return await response.json()
 
 
-async def put_article(session, weclapp_id, payload):
-    async with session.put(
-        f"{WECLAPP_BASE_URL}/article/id/{weclapp_id}?ignoreMissingProperties=true&dryRun=true",
+async def put_article(session, limiter, weclapp_id, payload):
+    async with limiter.request(
+        session.put,
+        f"{WECLAPP_BASE_URL}/article/id/{weclapp_id}"
+        f"{write_query('ignoreMissingProperties=true')}",
         headers=get_headers(),
         json=payload,
     ) as response:
@@ -102,9 +179,10 @@ async def put_article(session, weclapp_id, payload):
         return response.status
 
 
-async def post_article(session, payload):
-    async with session.post(
-        f"{WECLAPP_BASE_URL}/article?dryRun=true",
+async def post_article(session, limiter, payload):
+    async with limiter.request(
+        session.post,
+        f"{WECLAPP_BASE_URL}/article{write_query()}",
         headers=get_headers(),
         json=payload,
     ) as response:
@@ -116,9 +194,11 @@ async def post_article(session, payload):
         return response.status
 
 
-async def put_supply_source(session, supply_source_id, payload):
-    async with session.put(
-        f"{WECLAPP_BASE_URL}/articleSupplySource/id/{supply_source_id}?ignoreMissingProperties=true&dryRun=true",
+async def put_supply_source(session, limiter, supply_source_id, payload):
+    async with limiter.request(
+        session.put,
+        f"{WECLAPP_BASE_URL}/articleSupplySource/id/{supply_source_id}"
+        f"{write_query('ignoreMissingProperties=true')}",
         headers=get_headers(),
         json=payload,
     ) as response:
@@ -130,9 +210,10 @@ async def put_supply_source(session, supply_source_id, payload):
         return response.status
 
 
-async def post_supply_source(session, payload):
-    async with session.post(
-        f"{WECLAPP_BASE_URL}/articleSupplySource?dryRun=true",
+async def post_supply_source(session, limiter, payload):
+    async with limiter.request(
+        session.post,
+        f"{WECLAPP_BASE_URL}/articleSupplySource{write_query()}",
         headers=get_headers(),
         json=payload,
     ) as response:
@@ -144,25 +225,19 @@ async def post_supply_source(session, payload):
         return response.status
 
 
-async def build_article_payload(product, gtin_map, weclapp_article=None):
+def build_article_payload(product, context, gtin_map, weclapp_article=None):
     payload = deepcopy(weclapp_article) if weclapp_article else {}
 
-    md = await AsyncDb.get_master_data(product)
+    md = context.get_master_data(product)
     if md:
         payload.update(
             {
                 "articleNumber": product.sku,
                 "name": md.description,
                 "ean": gtin_map.get(product.supplier_article_no),
-                "manufacturerId": await AsyncDb.get_model_property(
-                    md, "manufacturer_weclapp_id"
-                ),
-                "customsTariffNumberId": await AsyncDb.get_model_property(
-                    md, "customs_number_weclapp_id"
-                ),
-                "articleCategoryId": await AsyncDb.get_model_property(
-                    md, "product_group_weclapp_id"
-                ),
+                "manufacturerId": context.get_manufacturer_weclapp_id(md),
+                "customsTariffNumberId": context.get_customs_number_weclapp_id(md),
+                "articleCategoryId": context.get_product_group_weclapp_id(md),
                 "manufacturerPartNumber": md.manufacturer_article_no,
                 "articleNetWeight": g_to_kg(md.weight),
                 "articleLength": mm_to_m(md.length),
@@ -216,7 +291,7 @@ async def build_article_payload(product, gtin_map, weclapp_article=None):
 
     # rrp
     calculation_prices = payload.get("articleCalculationPrices", [])
-    pl = await AsyncDb.get_price_list(product)
+    pl = context.get_price_list(product)
 
     if pl and pl.recommended_retail_price is not None:
         calculation_prices = upsert_rrp(
@@ -227,7 +302,7 @@ async def build_article_payload(product, gtin_map, weclapp_article=None):
     payload["articleCalculationPrices"] = calculation_prices
 
     # Sales Price
-    promo_price = await AsyncDb.get_promotional_price(product)
+    promo_price = context.get_promotional_price(product)
 
     start = promo_price.valid_from if promo_price else None
     end = promo_price.valid_to if promo_price else None
@@ -275,11 +350,11 @@ async def build_article_payload(product, gtin_map, weclapp_article=None):
     return payload
 
 
-async def build_supply_source_payload(product, gtin_map, weclapp_supply_source=None):
+def build_supply_source_payload(product, context, gtin_map, weclapp_supply_source=None):
     payload = deepcopy(weclapp_supply_source) if weclapp_supply_source else {}
 
-    md = await AsyncDb.get_master_data(product)
-    pl = await AsyncDb.get_price_list(product)
+    md = context.get_master_data(product)
+    pl = context.get_price_list(product)
 
     if md:
         payload.update(
@@ -309,17 +384,16 @@ async def build_supply_source_payload(product, gtin_map, weclapp_supply_source=N
     payload["customAttributes"] = attrs
 
     # purchase Price
-    promo_price = await AsyncDb.get_promotional_price(product)
+    promo_price = context.get_promotional_price(product)
 
     if promo_price:
-        promo_header = await AsyncDb.get_promo_header(promo_price.action_code)
+        promo_header = context.get_promo_header(promo_price.action_code)
 
         min_qty = promo_header.min_qty
         start = promo_price.valid_from
         end = promo_price.valid_to
 
-        gls_handling_surcharge = await AsyncDb.get_gls_handling_surcharge()
-        handling_surcharge = gls_handling_surcharge.get(md.article_group_no, 0)
+        handling_surcharge = context.get_handling_surcharge(md)
         price = pl.bill_back_price * (1 + handling_surcharge)
 
         price_data = {
@@ -341,92 +415,215 @@ async def build_supply_source_payload(product, gtin_map, weclapp_supply_source=N
     return payload
 
 
-async def sync_one_product(session, product, gtin_map, DEBUG=False):
-
-    async with SEM:
+def local_payload(name, product, context, gtin_map):
+    """
+    Payload built from our own data alone and its digest, kept on the batch
+    context so the prefetch and the sync build it once.
+    """
+    key = (name, product.id)
+    if key not in context.local_payloads:
+        if name == "article":
+            payload = build_article_payload(product, context, gtin_map)
+            weclapp_id = product.weclapp_id
+        else:
+            payload = build_supply_source_payload(product, context, gtin_map)
+            weclapp_id = product.weclapp_article_supply_source_id
+        context.local_payloads[key] = payload, payload_digest(weclapp_id, payload)
+    return context.local_payloads[key]
+
+
+def needs_sync(name, product, context, gtin_map, force=False):
+    if force:
+        return True
+    try:
+        _, digest = local_payload(name, product, context, gtin_map)
+    except Exception:
+        # sync_one_product reports it for this product
+        return False
+    return digest != context.get_digest(product, f"{name}_digest")
+
+
+async def prefetch_weclapp_records(
+    session, limiter, product_batch, context, gtin_map, force=False
+):
+    """
+    Load the current Weclapp articles and supply sources of the products in a
+    batch that will be sent, a page of ids per request instead of one GET per
+    product. Records missing here are fetched one by one by sync_one_product.
+    """
+    article_ids = []
+    supply_source_ids = []
+    for product in product_batch:
+        if product.weclapp_id and needs_sync(
+            "article", product, context, gtin_map, force
+        ):
+            article_ids.append(product.weclapp_id)
+        if product.weclapp_article_supply_source_id and needs_sync(
+            "supply_source", product, context, gtin_map, force
+        ):
+            supply_source_ids.append(product.weclapp_article_supply_source_id)
+
+    for entity, ids, properties, records in (
+        ("article", article_ids, ARTICLE_PROPERTIES, context.weclapp_articles),
+        (
+            "articleSupplySource",
+            supply_source_ids,
+            SUPPLY_SOURCE_PROPERTIES,
+            context.weclapp_supply_sources,
+        ),
+    ):
         for attempt in range(1, MAX_RETRIES + 1):
             try:
+                missing = [
+                    weclapp_id for weclapp_id in ids if weclapp_id not in records
+                ]
+                await fetch_list(session, limiter, entity, missing, properties, records)
+                break
+            except aiohttp.ClientResponseError as e:
+                if e.status == 429 and attempt < MAX_RETRIES:
+                    continue
+                await WeclappLog.awarning(
+                    f"Weclapp {entity} prefetch failed ({e.status} {e.message}), "
+                    f"falling back to single requests"
+                )
+                break
+            except Exception as e:
+                await WeclappLog.awarning(
+                    f"Weclapp {entity} prefetch failed ({str(e)[:400]}), "
+                    f"falling back to single requests"
+                )
+                break
+
+
+async def sync_one_product(
+    session, limiter, product, context, gtin_map, force=False, DEBUG=False
+):
+    article = supply_source = None
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            changed = False
+
+            # digests cover the payload built from our data alone, so
+            # unchanged products need neither the GET nor the PUT
+            article_payload, article_digest = local_payload(
+                "article", product, context, gtin_map
+            )
+            if force or article_digest != context.get_digest(product, "article_digest"):
+                changed = True
                 if product.weclapp_id:
-                    article = await fetch_article(session, product.weclapp_id)
-                    article_payload = await build_article_payload(
-                        product, gtin_map, weclapp_article=article
+                    article = context.weclapp_articles.get(product.weclapp_id)
+                    if article is None:
+                        article = await fetch_article(
+                            session, limiter, product.weclapp_id
+                        )
+                    article_payload = build_article_payload(
+                        product, context, gtin_map, weclapp_article=article
+                    )
+                    await put_article(
+                        session, limiter, product.weclapp_id, article_payload
                     )
-                    await put_article(session, product.weclapp_id, article_payload)
                 else:
-                    article_payload = await build_article_payload(product, gtin_map)
-                    await post_article(session, article_payload)
+                    await post_article(session, limiter, article_payload)
+                context.mark_sent(product, "article_digest", article_digest)
 
+            supply_source_payload, supply_source_digest = local_payload(
+                "supply_source", product, context, gtin_map
+            )
+            if force or supply_source_digest != context.get_digest(
+                product, "supply_source_digest"
+            ):
+                changed = True
                 if product.weclapp_article_supply_source_id:
-                    supply_source = await fetch_article_supply_source(
-                        session, product.weclapp_article_supply_source_id
+                    supply_source = context.weclapp_supply_sources.get(
+                        product.weclapp_article_supply_source_id
                     )
-                    supply_source_payload = await build_supply_source_payload(
-                        product, gtin_map, weclapp_supply_source=supply_source
+                    if supply_source is None:
+                        supply_source = await fetch_article_supply_source(
+                            session, limiter, product.weclapp_article_supply_source_id
+                        )
+                    supply_source_payload = build_supply_source_payload(
+                        product, context, gtin_map, weclapp_supply_source=supply_source
                     )
                     await put_supply_source(
                         session,
+                        limiter,
                         product.weclapp_article_supply_source_id,
                         supply_source_payload,
                     )
                 else:
-                    supply_source_payload = await build_supply_source_payload(
-                        product, gtin_map
-                    )
-                    await post_supply_source(session, supply_source_payload)
+                    await post_supply_source(session, limiter, supply_source_payload)
+                context.mark_sent(product, "supply_source_digest", supply_source_digest)
 
-                if DEBUG:
-                    import json
+            if DEBUG:
+                import json
 
-                    with open("article_before.json", "w") as f:
-                        json.dump(article, f, indent=2)
+                with open("article_before.json", "w") as f:
+                    json.dump(article, f, indent=2)
 
-                    with open("article_after.json", "w") as f:
-                        json.dump(article_payload, f, indent=2)
+                with open("article_after.json", "w") as f:
+                    json.dump(article_payload, f, indent=2)
 
-                    with open("supply_source_before.json", "w") as f:
-                        json.dump(supply_source, f, indent=2)
+                with open("supply_source_before.json", "w") as f:
+                    json.dump(supply_source, f, indent=2)
 
-                    with open("supply_source_after.json", "w") as f:
-                        json.dump(supply_source_payload, f, indent=2)
+                with open("supply_source_after.json", "w") as f:
+                    json.dump(supply_source_payload, f, indent=2)
 
-                await asyncio.sleep(0.3)
-                return True
+            return True if changed else SKIPPED
 
-            except aiohttp.ClientResponseError as e:
-                if e.status == 429 and attempt < MAX_RETRIES:
-                    await asyncio.sleep(2**attempt + random.random())
-                    continue
+        except aiohttp.ClientResponseError as e:
+            # the limiter already paused all requests for Retry-After
+            if e.status == 429 and attempt < MAX_RETRIES:
+                continue
 
-                return {
-                    "error_type": str(e.status),
-                    "error_message": str(e.message),
-                }
+            return {
+                "error_type": str(e.status),
+                "error_message": str(e.message),
+            }
 
-            except Exception as e:
-                return {
-                    "error_type": "exception",
-                    "error_message": str(e)[:400],
-                }
+        except Exception as e:
+            return {
+                "error_type": "exception",
+                "error_message": str(e)[:400],
+            }
 
 
-async def sync_products(product_ids):
+async def sync_products(product_ids, force=False):
     timeout = aiohttp.ClientTimeout(total=120)
     failed_total = 0
+    skipped_total = 0
     total_products = len(product_ids)
     error_counter = Counter()
     sample_failed_products = []
     MAX_SAMPLE = 20
     gtin_map = await AsyncDb.get_gtin_map()
+    limiter = AdaptiveRateLimiter(
+        rate=settings.WECLAPP_SYNC_RATE,
+        max_rate=settings.WECLAPP_SYNC_MAX_RATE,
+        max_concurrency=settings.WECLAPP_SYNC_MAX_CONCURRENCY,
+    )
 
     async with aiohttp.ClientSession(timeout=timeout) as session:
         for i in range(0, total_products, BATCH_SIZE):
             batch_ids = product_ids[i : i + BATCH_SIZE]
             product_batch = await AsyncDb.get_products_by_ids(batch_ids)
-            tasks = [sync_one_product(session, p, gtin_map) for p in product_batch]
+            context = await AsyncDb.get_sync_context(product_batch)
+            await prefetch_weclapp_records(
+                session, limiter, product_batch, context, gtin_map, force
+            )
+            tasks = [
+                sync_one_product(session, limiter, p, context, gtin_map, force)
+                for p in product_batch
+            ]
             results = await asyncio.gather(*tasks, return_exceptions=False)
+            if not settings.WECLAPP_SYNC_DRY_RUN:
+                await AsyncDb.store_sync_digests(context)
 
             for product, result in zip(product_batch, results):
-                if result is not True:
+                if result == SKIPPED:
+                    skipped_total += 1
+                elif result is not True:
                     failed_total += 1
 
                     # result contains error info
@@ -445,23 +642,28 @@ async def sync_products(product_ids):
     if failed_total:
         message = (
             f"Weclapp product sync had {failed_total} failures | "
+            f"unchanged={skipped_total} | "
             f"errors={dict(error_counter)} | "
-            f"failed_products={sample_failed_products}"
+            f"failed_products={sample_failed_products} | "
+            f"rate limiter: {limiter.summary()}"
         )
         await WeclappLog.aerror(message)
 
     else:
-        await WeclappLog.ainfo(f"{total_products} product sync completed successfully")
+        await WeclappLog.ainfo(
+            f"{total_products} product sync completed successfully, "
+            f"{skipped_total} unchanged ({limiter.summary()})"
+        )
 
 
-async def sync_master_data():
+async def sync_master_data(force=False):
     await AsyncDb.set_sync_completed()
 
     is_sync_ongoing = await AsyncDb.is_sync_ongoing()
     if not is_sync_ongoing:
         await AsyncDb.set_sync_ongoing()
         product_ids = await AsyncDb.get_gls_product_ids(limit=True)
-        await sync_products(product_ids)
+        await sync_products(product_ids, force)
         await AsyncDb.set_sync_completed()
 
 
@@ -473,7 +675,11 @@ async def sync_master_data():
 
 #     async with aiohttp.ClientSession(timeout=timeout) as session:
 #         product = await AsyncDb.get_product_by_sku(DEBUG_SKU)
-#         await sync_one_product(session, product, gtin_map, DEBUG=False)
+#         context = await AsyncDb.get_sync_context([product])
+#         limiter = AdaptiveRateLimiter()
+#         await sync_one_product(
+#             session, limiter, product, context, gtin_map, DEBUG=False
+#         )
 
 
 # import asyncio
@@ -108,12 +108,20 @@ WAWIBOX_UPLOAD_PATH = os.path.join(FTP_FILES_ROOT, "wawibox", "uploads")
 DENTALHELD_DOWNLOAD_PATH = os.path.join(FTP_FILES_ROOT, "dentalheld", "downloads")
 DENTALHELD_UPLOAD_PATH = os.path.join(FTP_FILES_ROOT, "dentalheld", "uploads")
 
+# EXPORT WORKER CONFIG
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", 2))
+# "nginx" (X-Accel-Redirect), "apache" (X-Sendfile) or empty to send from Django
+EXPORT_SENDFILE_BACKEND = os.getenv("EXPORT_SENDFILE_BACKEND", "")
+EXPORT_ACCEL_PREFIX = os.getenv("EXPORT_ACCEL_PREFIX", "/protected-exports/")
+
 
 # AERA API CONFIG
 AERA_BASE_URL = os.getenv("AERA_BASE_URL")
 AERA_COMPANY_ID = os.getenv("AERA_COMPANY_ID")
 AERA_LOGIN_NAME = os.getenv("AERA_LOGIN_NAME")
 AERA_PASSWORD = os.getenv("AERA_PASSWORD")
+AERA_PUSH_CHUNK_SIZE = int(os.getenv("AERA_PUSH_CHUNK_SIZE", 5000))
+AERA_PUSH_GZIP = os.getenv("AERA_PUSH_GZIP", "True") == "True"
 
 # SHOPWARE API CONFIG
 SHOPWARE_BASE_URL = os.getenv("SHOPWARE_BASE_URL")
@@ -166,6 +174,7 @@ GLS_DOWNLOAD_FILES_EXT = [
 ]
 
 GLS_UPLOAD_FILES = [GLS_FILE_101, GLS_FILE_102]
+GLS_INGEST_WORKERS = int(os.getenv("GLS_INGEST_WORKERS", 4))
 
 
 # WAWIBOX FTP CONFIG
@@ -190,6 +199,16 @@ WAWIBOX_UPLOAD_FILES = [WAWIBOX_FILE_UPLOAD]
 # WECLAPP API CONFIG
 WECLAPP_BASE_URL = os.getenv("WECLAPP_BASE_URL")
 WECLAPP_API_TOKEN = os.getenv("WECLAPP_API_TOKEN")
+WECLAPP_POOL_SIZE = int(os.getenv("WECLAPP_POOL_SIZE", 10))
+WECLAPP_MAX_RETRIES = int(os.getenv("WECLAPP_MAX_RETRIES", 3))
+WECLAPP_TIMEOUT = int(os.getenv("WECLAPP_TIMEOUT", 60))
+# starting and maximum request rate (req/s) of the async master data sync
+WECLAPP_SYNC_RATE = float(os.getenv("WECLAPP_SYNC_RATE", 5))
+WECLAPP_SYNC_MAX_RATE = float(os.getenv("WECLAPP_SYNC_MAX_RATE", 50))
+WECLAPP_SYNC_MAX_CONCURRENCY = int(os.getenv("WECLAPP_SYNC_MAX_CONCURRENCY", 20))
+# send the sync writes with dryRun=true; sent payload digests are only
+# stored, and unchanged products only skipped, once this is off
+WECLAPP_SYNC_DRY_RUN = os.getenv("WECLAPP_SYNC_DRY_RUN", "True") == "True"
 WECLAPP_SHIPPING_ARTICLE_MAP = {
     "DE": "SHIP001",
     "AT": "SHIP003",
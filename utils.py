@@ -1,18 +1,25 @@
 import os
+import posixpath
 import stat
 import csv
+import queue
+import threading
+import traceback
 from datetime import datetime, date
 from datetime import time as datetime_time
 from datetime import timezone as datetime_timezone
-from io import BytesIO, StringIO
 from ftplib import FTP_TLS
+from ftplib import all_errors as ftp_errors
 from contextlib import contextmanager
+from functools import lru_cache
 import shutil
 from django.core.exceptions import ImproperlyConfigured
 from decimal import Decimal
 
 import time
 import hashlib, json
+import gzip
+import pickle
 from django.db.models import Model
 from django.db.models import BooleanField
 from django.db.models import DateTimeField
@@ -24,7 +31,7 @@ from babel.numbers import parse_decimal
 
 from django.conf import settings
 from django.apps import apps
-from django.db import transaction
+from django.db import connection, transaction
 from django.template.loader import render_to_string
 from django.core.mail import EmailMessage
 from django.utils import timezone
@@ -67,6 +74,18 @@ class FTPClient:
     def upload_file(self, local_path, remote_path):
         self.sftp.put(local_path, remote_path)
 
+    def upload_stream(self, file_obj, remote_path):
+        partial_path = partial_remote_path(remote_path)
+        try:
+            self.sftp.putfo(file_obj, partial_path)
+        except Exception:
+            try:
+                self.sftp.remove(partial_path)
+            except (OSError, paramiko.SSHException):
+                pass
+            raise
+        self.sftp.posix_rename(partial_path, remote_path)
+
     def change_dir(self, path):
         self.sftp.chdir(path)
 
@@ -109,6 +128,29 @@ class FTPSClient:
         with open(local_path, "rb") as f:
             self.ftps.storbinary(f"STOR {remote_path}", f)
 
+    def upload_stream(self, file_obj, remote_path):
+        partial_path = partial_remote_path(remote_path)
+        try:
+            self.ftps.storbinary(f"STOR {partial_path}", file_obj)
+        except StreamAborted:
+            # closing the data connection ended the transfer, read its reply
+            try:
+                self.ftps.voidresp()
+            except ftp_errors:
+                pass
+            self._remove_partial(partial_path)
+            raise
+        except Exception:
+            self._remove_partial(partial_path)
+            raise
+        self.ftps.rename(partial_path, remote_path)
+
+    def _remove_partial(self, partial_path):
+        try:
+            self.ftps.delete(partial_path)
+        except ftp_errors:
+            pass
+
     def change_dir(self, path):
         self.ftps.cwd(path)
 
@@ -126,6 +168,12 @@ class FTPSClient:
             pass
 
 
+def partial_remote_path(remote_path):
+    """Name a stream is uploaded under until the transfer is complete."""
+    head, name = posixpath.split(remote_path)
+    return posixpath.join(head, f".{name}.part")
+
+
 @contextmanager
 def ftp_connection(host, user, password, port=22, timeout=30):
     client = FTPClient(host, user, password, port, timeout).connect()
@@ -144,6 +192,460 @@ def ftps_connection(host, user, password, port=21, timeout=30):
         client.disconnect()
 
 
+class StreamAborted(Exception):
+    pass
+
+
+class StreamPipe:
+    """
+    Bounded in-memory pipe between a producer and a reader thread. write()
+    blocks while max_chunks are queued, read() behaves like a file object so
+    it can be handed to putfo/storbinary.
+    """
+
+    EOF = object()
+    ABORT = object()
+
+    def __init__(self, max_chunks=64):
+        self.queue = queue.Queue(max_chunks)
+        self.buffer = bytearray()
+        self.reader_closed = False
+        self.eof = False
+
+    def _put(self, item):
+        # give up once the reader is gone, nobody would drain the queue
+        while not self.reader_closed:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, chunk):
+        self._put(chunk)
+
+    def close(self):
+        self._put(self.EOF)
+
+    def abort(self):
+        self._put(self.ABORT)
+
+    def close_reader(self):
+        self.reader_closed = True
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.queue.get()
+            if chunk is self.ABORT:
+                raise StreamAborted("Stream aborted by producer")
+            if chunk is self.EOF:
+                self.eof = True
+                break
+            self.buffer += chunk
+
+        if size < 0 or size > len(self.buffer):
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+def iter_encoded_chunks(pieces, encoding, chunk_size=64 * 1024):
+    """Join text pieces and yield them encoded in blocks of about chunk_size."""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield "".join(buffer).encode(encoding)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer).encode(encoding)
+
+
+def stream_upload(open_connection, chunks, remote_path, local_path, max_chunks=64):
+    """
+    Write chunks to local_path while a background thread uploads them through
+    a bounded pipe, so building the file and the transfer overlap. The local
+    file is always completed: when the connection or the upload fails it is
+    kept as the fallback copy and the error is returned. The upload_stream
+    of the clients writes to a partial remote name and renames it only after
+    a complete transfer, so remote_path never holds a truncated file.
+
+    open_connection is a callable returning a connection context manager,
+    e.g. functools.partial(ftps_connection, host, user, password).
+    """
+    pipe = StreamPipe(max_chunks)
+    upload = {"error": None}
+
+    def run_upload():
+        try:
+            with open_connection() as client:
+                client.upload_stream(pipe, remote_path)
+        except Exception:
+            upload["error"] = traceback.format_exc()
+        finally:
+            pipe.close_reader()
+
+    thread = threading.Thread(target=run_upload, daemon=True)
+    thread.start()
+
+    size = 0
+    tmp_path = f"{local_path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                pipe.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, local_path)
+    except Exception:
+        # the upload thread drops the partial remote file
+        pipe.abort()
+        thread.join()
+        raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    pipe.close()
+    thread.join()
+
+    return {
+        "uploaded": upload["error"] is None,
+        "error": upload["error"],
+        "bytes": size,
+        "local_path": local_path,
+    }
+
+
+class StagingTable:
+    def __init__(self, model, batch_size=2000):
+        self.model = model
+        self.batch_size = batch_size
+        self.fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+        self.table = f"{model._meta.db_table}__staging"
+        self.pending = []
+        self.count = 0
+
+    def _columns(self):
+        qn = connection.ops.quote_name
+        return ", ".join(qn(f.column) for f in self.fields)
+
+    def create(self):
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {qn(self.table)}")
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE {qn(self.table)} AS "
+                f"SELECT {self._columns()} FROM {qn(self.model._meta.db_table)} "
+                f"WHERE 1 = 0"
+            )
+        return self
+
+    def add(self, obj):
+        self.pending.append(obj)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def add_many(self, objs):
+        for obj in objs:
+            self.add(obj)
+
+    def flush(self):
+        if not self.pending:
+            return
+        qn = connection.ops.quote_name
+        placeholders = ", ".join(["%s"] * len(self.fields))
+        params = [
+            [f.get_db_prep_save(f.pre_save(obj, True), connection) for f in self.fields]
+            for obj in self.pending
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {qn(self.table)} ({self._columns()}) "
+                f"VALUES ({placeholders})",
+                params,
+            )
+        self.count += len(self.pending)
+        self.pending = []
+
+    def swap(self):
+        # readers keep seeing the old rows until this transaction commits
+        self.flush()
+        qn = connection.ops.quote_name
+        columns = self._columns()
+        with transaction.atomic():
+            self.model.objects.all().delete()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {qn(self.model._meta.db_table)} ({columns}) "
+                    f"SELECT {columns} FROM {qn(self.table)}"
+                )
+        return self.count
+
+    def drop(self):
+        qn = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {qn(self.table)}")
+
+
+@contextmanager
+def staging_table(model, batch_size=2000):
+    table = StagingTable(model, batch_size).create()
+    try:
+        yield table
+    finally:
+        table.drop()
+
+
+class IncrementalTable:
+    """
+    Upserts rows by key_field instead of recreating the table. Each row gets
+    a content digest in row_hash; new and changed rows are flagged with
+    changed_since_last_push and keys not added during the run are deleted
+    by finish(). Push state (last_pushed_to_*, pushed_*) is left untouched.
+    Every flush commits in its own transaction; build rows outside of one.
+
+    Rows are plain tuples in field_names order, see row_factory(); add()
+    still accepts model instances.
+    """
+
+    BOOKKEEPING_FIELDS = ("row_hash", "changed_since_last_push", "updated_at")
+
+    def __init__(self, model, key_field, batch_size=2000):
+        self.model = model
+        self.key_field = key_field
+        self.batch_size = batch_size
+        self.fields = [
+            f
+            for f in model._meta.concrete_fields
+            if not f.primary_key
+            and f.name not in self.BOOKKEEPING_FIELDS
+            and not f.name.startswith(("last_pushed_to_", "pushed_"))
+        ]
+        self.field_names = [f.name for f in self.fields]
+        self.key_position = self.field_names.index(key_field)
+        self.defaults = tuple(f.get_default() for f in self.fields)
+        self.bookkeeping_fields = [
+            name
+            for name in self.BOOKKEEPING_FIELDS
+            if any(f.name == name for f in model._meta.concrete_fields)
+        ]
+        # fields only written on insert, e.g. the push state
+        self.insert_only_fields = [
+            f
+            for f in model._meta.concrete_fields
+            if not f.primary_key
+            and f not in self.fields
+            and f.name not in self.BOOKKEEPING_FIELDS
+        ]
+        self.digest = make_line_digest(self.field_names)
+        self.index = load_digest_index(model, key_field)
+        self.seen = set()
+        self.to_create = []
+        self.to_update = []
+        self.stats = {"created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    def row_factory(self, names):
+        """
+        Return a function that turns values for names into a full row in
+        field_names order, using the model defaults for all other fields.
+        """
+        positions = [self.field_names.index(name) for name in names]
+        defaults = self.defaults
+
+        def make_row(*values):
+            row = list(defaults)
+            for position, value in zip(positions, values):
+                row[position] = value
+            return row
+
+        return make_row
+
+    def add(self, obj):
+        self.add_row([f.value_from_object(obj) for f in self.fields])
+
+    def add_row(self, row):
+        key = row[self.key_position]
+        if key in self.seen:
+            return
+        self.seen.add(key)
+
+        row_hash = self.digest("\x1f".join(map(str, row)))
+        existing = self.index.get(key)
+        if existing is None:
+            self.to_create.append((row, row_hash))
+        elif existing[1] != row_hash:
+            self.to_update.append((existing[0], row, row_hash))
+        else:
+            self.stats["unchanged"] += 1
+            return
+
+        if len(self.to_create) + len(self.to_update) >= self.batch_size:
+            self.flush()
+
+    def _bookkeeping(self, row_hash, now):
+        values = {
+            "row_hash": row_hash,
+            "changed_since_last_push": True,
+            "updated_at": now,
+        }
+        return [values[name] for name in self.bookkeeping_fields]
+
+    def _insert_only(self, now):
+        return [
+            (
+                now
+                if getattr(f, "auto_now", False) or getattr(f, "auto_now_add", False)
+                else f.get_default()
+            )
+            for f in self.insert_only_fields
+        ]
+
+    def flush(self):
+        # one short transaction per batch, so the write lock is not held
+        # while the caller builds the next rows
+        with transaction.atomic():
+            self._write_batch()
+
+    def _write_batch(self):
+        now = timezone.now()
+        if self.to_create:
+            insert_only = self._insert_only(now)
+            bulk_insert_rows(
+                self.model,
+                self.field_names
+                + self.bookkeeping_fields
+                + [f.name for f in self.insert_only_fields],
+                (
+                    (*row, *self._bookkeeping(row_hash, now), *insert_only)
+                    for row, row_hash in self.to_create
+                ),
+                batch_size=self.batch_size,
+            )
+            self.stats["created"] += len(self.to_create)
+            self.to_create = []
+        if self.to_update:
+            bulk_update_rows(
+                self.model,
+                self.field_names + self.bookkeeping_fields,
+                (
+                    (pk, *row, *self._bookkeeping(row_hash, now))
+                    for pk, row, row_hash in self.to_update
+                ),
+                batch_size=self.batch_size,
+            )
+            self.stats["updated"] += len(self.to_update)
+            self.to_update = []
+
+    def finish(self):
+        self.flush()
+        stale_pks = [pk for key, (pk, _) in self.index.items() if key not in self.seen]
+        with transaction.atomic():
+            for i in range(0, len(stale_pks), self.batch_size):
+                self.model.objects.filter(
+                    pk__in=stale_pks[i : i + self.batch_size]
+                ).delete()
+        self.stats["deleted"] = len(stale_pks)
+        return self.stats
+
+
+def bulk_insert_rows(model, fields, rows, batch_size=5000):
+    """
+    Insert rows given as tuples in fields order with executemany, without
+    building model instances. Returns the number of inserted rows.
+    """
+    qn = connection.ops.quote_name
+    model_fields = [model._meta.get_field(name) for name in fields]
+    columns = ", ".join(qn(f.column) for f in model_fields)
+    placeholders = ", ".join(["%s"] * len(model_fields))
+    sql = f"INSERT INTO {qn(model._meta.db_table)} ({columns}) VALUES ({placeholders})"
+
+    def prepared(batch):
+        return [
+            [
+                f.get_db_prep_save(value, connection)
+                for f, value in zip(model_fields, row)
+            ]
+            for row in batch
+        ]
+
+    inserted = 0
+    with connection.cursor() as cursor:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, prepared(batch))
+                inserted += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, prepared(batch))
+            inserted += len(batch)
+    return inserted
+
+
+def bulk_update_rows(model, fields, rows, key="id", batch_size=5000):
+    """
+    Set-based alternative to bulk_update for many rows and few columns.
+
+    rows are tuples of (key, *values in fields order). They are loaded into a
+    temporary table and applied with a single UPDATE ... FROM join instead of
+    one CASE WHEN per column and batch. Returns the number of updated rows.
+    """
+    qn = connection.ops.quote_name
+    meta = model._meta
+    key_field = meta.get_field(key)
+    model_fields = [meta.get_field(name) for name in fields]
+    all_fields = [key_field] + model_fields
+    target = qn(meta.db_table)
+    table = qn(f"{meta.db_table}__update")
+    columns = ", ".join(qn(f.column) for f in all_fields)
+    placeholders = ", ".join(["%s"] * len(all_fields))
+    assignments = ", ".join(
+        f"{qn(f.column)} = {table}.{qn(f.column)}" for f in model_fields
+    )
+
+    def prepared(batch):
+        return [
+            [f.get_db_prep_save(value, connection) for f, value in zip(all_fields, row)]
+            for row in batch
+        ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE {table} AS "
+            f"SELECT {columns} FROM {target} WHERE 1 = 0"
+        )
+        try:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    cursor.executemany(
+                        f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
+                        prepared(batch),
+                    )
+                    batch = []
+            if batch:
+                cursor.executemany(
+                    f"INSERT INTO {table} ({columns}) VALUES ({placeholders})",
+                    prepared(batch),
+                )
+
+            cursor.execute(
+                f"UPDATE {target} SET {assignments} FROM {table} "
+                f"WHERE {target}.{qn(key_field.column)} = {table}.{qn(key_field.column)}"
+            )
+            return cursor.rowcount
+        finally:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
 def make_time_zone_aware(dt_str):
     if not dt_str:
         return None
@@ -157,31 +659,20 @@ def compute_hash(data: dict) -> str:
     return hashlib.sha256(json.dumps(clean, sort_keys=True).encode()).hexdigest()
 
 
-def parse_ftp_file_to_model(
-    file_path,
-    field_map,
-    delimiter="^#!",
-    batch_size=800,
-    encoding="cp850",
-    use_hash=False,
-    replace_all=False,
-    header_available=False,
-    use_csv=False,
-):
-
-    model_label = field_map["model_label"]
-    fields = field_map["fields"]
-    unique_field = field_map["unique_field"]
-    boolean_fields = field_map["boolean_fields"]
-    date_fields = field_map["date_fields"]
-    code_fields = field_map.get("code_fields", [])
-    Model = apps.get_model(model_label)
+def get_peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is reported in kilobytes on linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
 
-    objects = []
 
+def read_ftp_file_rows(file_path, delimiter, encoding, header_available, use_csv):
+    # yields (raw_line, values) so callers can digest the line before converting it
     with open(file_path, "r", encoding=encoding) as f:
         if header_available:
-            next(f)
+            next(f, None)
         for line in f:
             line = line.strip()
             if not line:
@@ -190,106 +681,472 @@ def parse_ftp_file_to_model(
                 values = next(csv.reader([line], delimiter=delimiter))
             else:
                 values = line.split(delimiter)
-            data = {}
+            yield line, values
 
-            for i, field_name in enumerate(fields):
-                if i >= len(values):
-                    continue
 
-                value = values[i].strip()
-
-                if field_name in boolean_fields:
-                    value = str(value) in ["j", "J", "y", "Y", "1", "true", "TRUE"]
-
-                elif field_name in date_fields:
-                    if value:
-                        date_parsed = False
-                        for fmt in ("%d.%m.%y", "%d.%m.%Y"):
-                            try:
-                                value = datetime.strptime(value, fmt)
-                                date_parsed = True
-                                break
-                            except ValueError:
-                                continue
-                        if not date_parsed:
-                            raise ValueError(
-                                f"Invalid date format for field '{field_name}': {value}"
-                            )
-                    else:
-                        value = None
-
-                elif field_name in code_fields:
-                    value = value.upper()
-
-                if value == "":
-                    value = None
-                data[field_name] = value
+def make_line_digest(fields):
+    # seeded with the field layout so a mapping change invalidates stored digests
+    base = hashlib.blake2b("|".join(fields).encode(), digest_size=16)
 
-            if use_hash:
-                row_hash = compute_hash(data)
-                data["row_hash"] = row_hash
-            if data:
-                objects.append(Model(**data))
+    def digest(line):
+        h = base.copy()
+        h.update(line.encode("utf-8"))
+        return h.hexdigest()
 
-    if replace_all:
-        Model.objects.all().delete()
-        Model.objects.bulk_create(objects, batch_size=batch_size)
-        return
+    return digest
 
-    for i in range(0, len(objects), batch_size):
-        batch = objects[i : i + batch_size]
-        objs_to_update = []
-        objs_to_create = []
-        if unique_field:
-            keys = [getattr(obj, unique_field) for obj in batch]
-            if use_hash:
-                existing_objs = {
-                    unique_field_value: (pk, row_hash)
-                    for unique_field_value, pk, row_hash in Model.objects.filter(
-                        **{f"{unique_field}__in": keys}
-                    ).values_list(unique_field, "pk", "row_hash")
-                }
-            else:
-                existing_objs = {
-                    unique_field_value: (pk, "N/A")
-                    for unique_field_value, pk in Model.objects.filter(
-                        **{f"{unique_field}__in": keys}
-                    ).values_list(unique_field, "pk")
-                }
 
-            for obj in batch:
-                key = getattr(obj, unique_field)
-                if key in existing_objs:
-                    old_pk, old_hash = existing_objs[key]
+def load_digest_index(Model, unique_field):
+    return {
+        key: (pk, row_hash)
+        for key, pk, row_hash in Model.objects.values_list(
+            unique_field, "pk", "row_hash"
+        ).iterator(chunk_size=5000)
+    }
 
-                    obj.pk = old_pk
 
-                    if use_hash:
-                        if obj.row_hash != old_hash:
-                            objs_to_update.append(obj)
-                    else:
-                        objs_to_update.append(obj)
+FTP_TRUE_VALUES = frozenset(["j", "J", "y", "Y", "1", "true", "TRUE"])
 
-                else:
-                    objs_to_create.append(obj)
 
+@lru_cache(maxsize=8192)
+def parse_ftp_date(value):
+    # fast path for dd.mm.yy / dd.mm.yyyy, feeds repeat the same dates a lot
+    parts = value.split(".")
+    if len(parts) == 3 and all(p.isdigit() for p in parts):
+        day, month, year = parts
+        if len(day) <= 2 and len(month) <= 2 and len(year) in (2, 4):
+            year = int(year)
+            if len(parts[2]) == 2:
+                # same pivot as strptime's %y
+                year += 1900 if year >= 69 else 2000
+            try:
+                return datetime(year, int(month), int(day))
+            except ValueError:
+                pass
+
+    for fmt in ("%d.%m.%y", "%d.%m.%Y"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _convert_ftp_text(value):
+    return value.strip() or None
+
+
+def _convert_ftp_code(value):
+    return value.strip().upper() or None
+
+
+def _convert_ftp_boolean(value):
+    return value.strip() in FTP_TRUE_VALUES
+
+
+def _make_ftp_date_converter(field_name):
+    def convert(value):
+        value = value.strip()
+        if not value:
+            return None
+        parsed = parse_ftp_date(value)
+        if parsed is None:
+            raise ValueError(f"Invalid date format for field '{field_name}': {value}")
+        return parsed
+
+    return convert
+
+
+def compile_field_map(field_map):
+    boolean_fields = set(field_map["boolean_fields"])
+    date_fields = set(field_map["date_fields"])
+    code_fields = set(field_map.get("code_fields", []))
+
+    converters = []
+    for field_name in field_map["fields"]:
+        if field_name in boolean_fields:
+            converters.append(_convert_ftp_boolean)
+        elif field_name in date_fields:
+            converters.append(_make_ftp_date_converter(field_name))
+        elif field_name in code_fields:
+            converters.append(_convert_ftp_code)
         else:
-            objs_to_create = batch
+            converters.append(_convert_ftp_text)
+    return tuple(converters)
+
 
+def parse_ftp_row(values, converters):
+    return tuple([convert(value) for convert, value in zip(converters, values)])
+
+
+def stage_ftp_file(
+    file_path,
+    field_map,
+    staged_path,
+    delimiter="^#!",
+    encoding="cp850",
+    header_available=False,
+    use_csv=False,
+    batch_size=5000,
+):
+    # runs in worker processes: parse and digest only, no database access
+    converters = compile_field_map(field_map)
+    line_digest = make_line_digest(list(field_map["fields"]))
+
+    rows = 0
+    with open(staged_path, "wb") as out:
+        window = []
+        for line, values in read_ftp_file_rows(
+            file_path, delimiter, encoding, header_available, use_csv
+        ):
+            row = parse_ftp_row(values, converters)
+            if not row:
+                continue
+            window.append((line_digest(line), row))
+            rows += 1
+            if len(window) >= batch_size:
+                pickle.dump(window, out, protocol=pickle.HIGHEST_PROTOCOL)
+                window = []
+        if window:
+            pickle.dump(window, out, protocol=pickle.HIGHEST_PROTOCOL)
+    return staged_path, rows
+
+
+def read_staged_ftp_rows(staged_path):
+    with open(staged_path, "rb") as f:
+        while True:
+            try:
+                window = pickle.load(f)
+            except EOFError:
+                return
+            yield from window
+
+
+def build_ftp_row_obj(Model, fields, row, use_hash=False):
+    # rows are compact tuples aligned to fields, with row_hash appended when use_hash
+    if use_hash:
+        data = dict(zip(fields, row[:-1]))
+        data["row_hash"] = row[-1]
+    else:
+        data = dict(zip(fields, row))
+    return Model(**data)
+
+
+def apply_ftp_rows(
+    Model,
+    fields,
+    unique_field,
+    rows,
+    use_hash=False,
+    existing_objs=None,
+):
+    created = updated = 0
+
+    if not unique_field:
+        Model.objects.bulk_create(
+            [build_ftp_row_obj(Model, fields, r, use_hash) for r in rows]
+        )
+        return len(rows), 0
+
+    key_index = fields.index(unique_field)
+    data_len = (lambda r: len(r) - 1) if use_hash else len
+    keys = [r[key_index] if data_len(r) > key_index else None for r in rows]
+    keep_index = existing_objs is not None
+    if not keep_index:
+        if use_hash:
+            existing_objs = {
+                unique_field_value: (pk, row_hash)
+                for unique_field_value, pk, row_hash in Model.objects.filter(
+                    **{f"{unique_field}__in": keys}
+                ).values_list(unique_field, "pk", "row_hash")
+            }
+        else:
+            existing_objs = {
+                unique_field_value: (pk, "N/A")
+                for unique_field_value, pk in Model.objects.filter(
+                    **{f"{unique_field}__in": keys}
+                ).values_list(unique_field, "pk")
+            }
+
+    objs_to_update = []
+    objs_to_create = []
+    for key, r in zip(keys, rows):
+        if key in existing_objs:
+            old_pk, old_hash = existing_objs[key]
+            if use_hash and r[-1] == old_hash:
+                continue
+            obj = build_ftp_row_obj(Model, fields, r, use_hash)
+            obj.pk = old_pk
+            objs_to_update.append(obj)
+        else:
+            objs_to_create.append(build_ftp_row_obj(Model, fields, r, use_hash))
+
+    with transaction.atomic():
+        if objs_to_update:
+            update_fields = fields + (["row_hash"] if use_hash else [])
+            Model.objects.bulk_update(objs_to_update, update_fields)
+            updated = len(objs_to_update)
+        if objs_to_create:
+            Model.objects.bulk_create(objs_to_create)
+            created = len(objs_to_create)
+
+    if keep_index:
+        # keep a preloaded index current so later windows see rows written here
+        for obj in objs_to_update + objs_to_create:
+            if obj.pk is not None:
+                existing_objs[getattr(obj, unique_field)] = (
+                    obj.pk,
+                    obj.row_hash if use_hash else "N/A",
+                )
+    return created, updated
+
+
+def parse_ftp_file_to_model(
+    file_path,
+    field_map,
+    delimiter="^#!",
+    batch_size=800,
+    encoding="cp850",
+    use_hash=False,
+    replace_all=False,
+    header_available=False,
+    use_csv=False,
+    diff=False,
+    staged_path=None,
+    changed_keys=None,
+    changed_field=None,
+):
+    """
+    changed_keys, when given a set, collects the unique keys of rows that were
+    created, updated or deleted so callers can react to just those.
+    changed_field collects that field of the written rows instead, e.g. the
+    article_no of files without a unique_field.
+    """
+
+    model_label = field_map["model_label"]
+    fields = list(field_map["fields"])
+    unique_field = field_map["unique_field"]
+    converters = compile_field_map(field_map)
+    Model = apps.get_model(model_label)
+
+    if diff:
+        # diff imports compare digests by unique key and delete keys missing
+        # from the file, so they need both
+        if not unique_field:
+            raise ValueError(f"Diff import of {model_label} requires a unique_field")
+        use_hash = True
+        replace_all = False
+
+    stats = {"rows": 0, "unchanged": 0, "created": 0, "updated": 0, "deleted": 0}
+    started = time.monotonic()
+
+    line_digest = make_line_digest(fields)
+    seen_keys = set()
+    digest_index = None
+    if unique_field:
+        key_index = fields.index(unique_field)
+        key_converter = converters[key_index]
+    changed_field = changed_field or unique_field
+    if changed_field:
+        changed_index = fields.index(changed_field)
+    if use_hash and unique_field and not replace_all:
+        # one query per file instead of an __in lookup per window
+        digest_index = load_digest_index(Model, unique_field)
+
+    def is_unchanged(key, digest):
+        if diff:
+            seen_keys.add(key)
+        existing = digest_index.get(key)
+        return existing is not None and existing[1] == digest
+
+    def staged_rows():
+        # rows already converted and digested by stage_ftp_file
+        for digest, row in read_staged_ftp_rows(staged_path):
+            stats["rows"] += 1
+            if use_hash:
+                if (
+                    digest_index is not None
+                    and len(row) > key_index
+                    and is_unchanged(row[key_index], digest)
+                ):
+                    stats["unchanged"] += 1
+                    continue
+                row = row + (digest,)
+            yield row
+
+    def rows():
+        if staged_path:
+            yield from staged_rows()
+            return
+
+        for line, values in read_ftp_file_rows(
+            file_path, delimiter, encoding, header_available, use_csv
+        ):
+            stats["rows"] += 1
+            if use_hash:
+                digest = line_digest(line)
+                if (
+                    digest_index is not None
+                    and len(values) > key_index
+                    and is_unchanged(key_converter(values[key_index]), digest)
+                ):
+                    stats["unchanged"] += 1
+                    continue
+
+            row = parse_ftp_row(values, converters)
+            if not row:
+                continue
+            if use_hash:
+                row = row + (digest,)
+            yield row
+
+    def windows():
+        window = []
+        for row in rows():
+            if changed_keys is not None and changed_field and len(row) > changed_index:
+                changed_keys.add(row[changed_index])
+            window.append(row)
+            if len(window) >= batch_size:
+                yield window
+                window = []
+        if window:
+            yield window
+
+    if replace_all:
+        # load into a shadow table first so the live table is never left empty
+        with staging_table(Model, batch_size) as staging:
+            for window in windows():
+                staging.add_many(
+                    build_ftp_row_obj(Model, fields, r, use_hash) for r in window
+                )
+            stats["created"] = staging.swap()
+    elif diff:
         with transaction.atomic():
-            if objs_to_update:
-                update_fields = fields + (["row_hash"] if use_hash else [])
-                Model.objects.bulk_update(objs_to_update, update_fields)
-            if objs_to_create:
-                Model.objects.bulk_create(objs_to_create)
+            for window in windows():
+                created, updated = apply_ftp_rows(
+                    Model,
+                    fields,
+                    unique_field,
+                    window,
+                    use_hash,
+                    existing_objs=digest_index,
+                )
+                stats["created"] += created
+                stats["updated"] += updated
+
+            # an empty file is more likely a broken transfer than an empty feed
+            if stats["rows"]:
+                stale = [
+                    (key, pk)
+                    for key, (pk, _) in digest_index.items()
+                    if key not in seen_keys
+                ]
+                stale_pks = [pk for _, pk in stale]
+                if changed_keys is not None and changed_field == unique_field:
+                    changed_keys.update(key for key, _ in stale)
+                for i in range(0, len(stale_pks), batch_size):
+                    Model.objects.filter(pk__in=stale_pks[i : i + batch_size]).delete()
+                stats["deleted"] = len(stale_pks)
+    else:
+        for window in windows():
+            created, updated = apply_ftp_rows(
+                Model,
+                fields,
+                unique_field,
+                window,
+                use_hash,
+                existing_objs=digest_index,
+            )
+            stats["created"] += created
+            stats["updated"] += updated
+
+    elapsed = time.monotonic() - started
+    stats["seconds"] = round(elapsed, 2)
+    stats["rows_per_sec"] = round(stats["rows"] / elapsed) if elapsed else stats["rows"]
+    stats["peak_rss_mb"] = get_peak_rss_mb()
+    return stats
+
+
+def format_ingest_stats(stats):
+    return (
+        f"{stats['rows']} rows, {stats['unchanged']} unchanged, "
+        f"{stats['created']} created, "
+        f"{stats['updated']} updated, {stats['deleted']} deleted "
+        f"in {stats['seconds']}s "
+        f"({stats['rows_per_sec']} rows/s, peak RSS {stats['peak_rss_mb']} MB)"
+    )
+
+
+def object_export_rows(objs, model_fields, property_fields, preload=None):
+    if preload:
+        preload(objs)
+    for obj in objs:
+        yield [getattr(obj, f.name) for f in model_fields] + [
+            getattr(obj, p) for p in property_fields
+        ]
 
 
-def export_model_data(config: dict):
+def iter_export_rows(qs, model_fields, property_fields, chunk_size=2000):
+    """
+    Yield export rows in field order. Plain models are read with values_list,
+    foreign keys are resolved to str() once per chunk. Models with property
+    columns need instances and are iterated in chunks instead.
+    """
+    if property_fields:
+        # models can declare preload_export_rows(objs) to back their computed
+        # columns with a few queries per chunk instead of queries per row
+        preload = getattr(qs.model, "preload_export_rows", None)
+        chunk = []
+        for obj in qs.iterator(chunk_size=chunk_size):
+            chunk.append(obj)
+            if len(chunk) >= chunk_size:
+                yield from object_export_rows(
+                    chunk, model_fields, property_fields, preload
+                )
+                chunk = []
+        if chunk:
+            yield from object_export_rows(chunk, model_fields, property_fields, preload)
+        return
+
+    fk_positions = [i for i, f in enumerate(model_fields) if f.is_relation]
+    rows = qs.values_list(*[f.name for f in model_fields]).iterator(
+        chunk_size=chunk_size
+    )
+
+    def resolve(chunk):
+        for i in fk_positions:
+            related = model_fields[i].related_model.objects.in_bulk(
+                {row[i] for row in chunk if row[i] is not None}
+            )
+            for row in chunk:
+                if row[i] is not None:
+                    row[i] = related.get(row[i])
+        return chunk
+
+    chunk = []
+    for row in rows:
+        chunk.append(list(row))
+        if len(chunk) >= chunk_size:
+            yield from resolve(chunk)
+            chunk = []
+    if chunk:
+        yield from resolve(chunk)
+
+
+def export_model_data(config: dict, file_path):
+    """
+    Stream the export described by config straight into file_path: csv.writer
+    on a file handle, or a write-only openpyxl workbook. CSV output is gzip
+    compressed when config["compress"] is set. Returns rows, seconds,
+    rows_per_sec and peak_rss_mb.
+    """
     file_type = config.get("file_type", "csv").lower()
     model_label = config["model_label"]
     exclude_fields = config.get("exclude_fields", ["id", "pk"])
     delimiter = config.get("delimiter", ",")
     raw_kwargs = config.get("raw_kwargs", {})
+    compress = config.get("compress", False)
+    chunk_size = config.get("chunk_size", 2000)
 
     model = apps.get_model(model_label)
     qs = model.objects.filter(**raw_kwargs)
@@ -299,7 +1156,6 @@ def export_model_data(config: dict):
         for f in model._meta.fields
         if f.concrete and not f.many_to_many and f.name not in exclude_fields
     ]
-    model_field_names = [f.name for f in model_fields]
 
     property_fields = [
         name
@@ -307,8 +1163,6 @@ def export_model_data(config: dict):
         if isinstance(obj, property) and name not in exclude_fields
     ]
 
-    field_names = model_field_names + property_fields
-
     header_labels = []
 
     for f in model_fields:
@@ -322,44 +1176,54 @@ def export_model_data(config: dict):
         else:
             header_labels.append(p.replace("_", " ").title())
 
-    if file_type == "csv":
-        buffer = StringIO()
-        writer = csv.writer(buffer, delimiter=delimiter)
-        writer.writerow(header_labels)
+    rows = iter_export_rows(qs, model_fields, property_fields, chunk_size)
+    count = 0
+    started = time.monotonic()
 
-        for obj in qs:
-            writer.writerow([getattr(obj, f) for f in field_names])
+    if file_type == "csv":
+        if compress:
+            f = gzip.open(file_path, "wt", encoding="utf-8", newline="")
+        else:
+            f = open(file_path, "w", encoding="utf-8", newline="")
+        with f:
+            writer = csv.writer(f, delimiter=delimiter)
+            writer.writerow(header_labels)
 
-        return buffer.getvalue().encode("utf-8")
+            for row in rows:
+                writer.writerow(row)
+                count += 1
 
     elif file_type == "excel":
-        wb = openpyxl.Workbook()
-        ws = wb.active
+        # xlsx is a zip archive already, compress does not apply
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet()
 
         ws.append(header_labels)
 
-        for obj in qs:
-            row = []
-            for f in field_names:
-                value = getattr(obj, f)
-
+        for row in rows:
+            for i, value in enumerate(row):
                 if isinstance(value, datetime) and is_aware(value):
-                    value = make_naive(value)
-
-                if isinstance(value, Model):
-                    value = str(value)
+                    row[i] = make_naive(value)
 
-                row.append(value)
+                elif isinstance(value, Model):
+                    row[i] = str(value)
 
             ws.append(row)
+            count += 1
 
-        output = BytesIO()
-        wb.save(output)
-        return output.getvalue()
+        wb.save(file_path)
 
     else:
         raise ValueError("Invalid file_type. Must be 'csv' or 'excel'.")
 
+    elapsed = time.monotonic() - started
+    return {
+        "rows": count,
+        "seconds": round(elapsed, 2),
+        "rows_per_sec": round(count / elapsed) if elapsed else count,
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
 
 def send_email(
     subject,
@@ -522,6 +1386,12 @@ def clean_payload(payload, json_safe=True):
     return payload
 
 
+def payload_digest(payload):
+    # stable digest of an API payload, used to skip rows already sent unchanged
+    data = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
 class OrderBaseModel(Model):
     order_number = CharField(max_length=100, null=True, blank=True)
     fetched_at = DateTimeField(null=True, blank=True, auto_now=True)